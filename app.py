@@ -3,11 +3,19 @@ import certifi
 import secrets
 
 # Función auxiliar para detectar números flotantes\ndef is_float(value):\n    try:\n        float(value)\n        return True\n    except (ValueError, TypeError):\n        return False
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import tempfile
+import shutil
 import zipfile
+import mimetypes
 from dotenv import load_dotenv
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -40,15 +48,53 @@ if variables_faltantes:
     # sys.exit(1)
 from flask import (
     Flask, request, render_template, redirect, url_for,
-    send_from_directory, session, flash, send_file
+    send_from_directory, session, flash, send_file,
+    jsonify, Response, stream_with_context, make_response, stream_template,
+    get_flashed_messages
 )
 import openpyxl
 from openpyxl import load_workbook, Workbook
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from flask_mail import Mail, Message
+from itsdangerous import URLSafeTimedSerializer
 from bson import ObjectId
+from pagination import (
+    obtener_pagina, obtener_tamano_pagina, TAMANOS_PAGINA, MOSTRAR_TODOS, condicion_keyset, decodificar_cursor
+)
+from catalog_records import (
+    COLACION_NUMERICA, CAMPO_ORDEN, ORDEN_REGISTROS, clave_ordenacion, filtro_tabla, siguiente_numero,
+    CAMPO_IDENTIFICADOR, clave_identificador,
+    renumerar_tabla, bloqueo_tabla, TablaBloqueada,
+    MODOS_NUMERACION, NUMERACION_CONTINUA, NUMERACION_CON_HUECOS, modo_numeracion, posicion_inicial,
+    campo_seguro, proyeccion_registros, proyeccion_edicion, listas_imagenes,
+    CAMPO_BUSQUEDA, ORDEN_BUSQUEDA, texto_busqueda, etapas_busqueda,
+    registrar_cambio, version_tabla, CAMPO_DERIVADOS, CAMPO_INTEGRIDAD
+)
+from mongo_indexes import (
+    COLACION_SIN_MAYUSCULAS, S3_DELETIONS_COLLECTION, IMAGES_COLLECTION, sincronizar_indices, registrar_uso_orden, crear_indice_columna
+)
+from catalog_query import (
+    filtros_columnas, campo_columna, etapas_orden, orden_columna, parametros_consulta,
+    CAMPO_RANGO_ORDEN, CAMPO_VALOR_ORDEN
+)
+from table_cache import CacheTablas
+from row_cache import CacheFilas, PLANTILLA_FILA
+from s3_urls import FirmadorUrls
+from s3_object_cache import CacheObjetosS3
+from image_derivatives import enviar_a_procesar, subir_derivados, clave_derivado, rutas_mostradas, VARIANTES
+from upload_spool import SpoolSubidas, procesar_spool, iniciar_trabajador, es_pendiente
+from s3_deletion_queue import ColaBorrados, procesar_cola_borrados, INTERVALO_BORRADOS
+from s3_checksums import subir_con_suma, integridad_cabecera, suma_sha256
+from image_store import (
+    clave_contenido, reservar, subida_de_usuario, marcar_almacenada, liberar
+)
+from direct_uploads import (
+    TAMANO_MAXIMO_SUBIDA, tipo_contenido, politica_subida, token_subida, clave_de_token, verificar_objeto
+)
+from records_api import FORMATOS, campos_solicitados, generar_ndjson, generar_json
 import logging
 logging.basicConfig(filename="/var/www/vhosts/edefrutos2025.xyz/httpdocs/flask_app.log", level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
@@ -73,12 +119,23 @@ s3_client = boto3.client(
     region_name=AWS_REGION
 )
 
+# URLs prefirmadas estables por ventana de tiempo para mostrar las imágenes desde S3
+firmador_urls = FirmadorUrls(s3_client, S3_BUCKET_NAME)
+
+# Caché en disco de los objetos de S3 que se leen (exportación, derivados), compartida por los procesos
+cache_s3 = CacheObjetosS3(s3_client)
+
 # -------------------------------------------
 # CONFIGURACIÓN FLASK
 # -------------------------------------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24).hex())
 
+# Las plantillas muestran las imágenes con url_imagen(ruta) (URL de S3 directa y estable)
+app.jinja_env.globals["url_imagen"] = firmador_urls.url_imagen
+# Imágenes aún en el spool de subidas diferidas: {% if ruta is pendiente %}
+app.jinja_env.tests["pendiente"] = es_pendiente
+
 # Carpeta para imágenes del catálogo
 app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "imagenes_subidas")
 if not os.path.exists(app.config["UPLOAD_FOLDER"]):
@@ -104,6 +161,11 @@ def eliminar_archivo_imagen(ruta_imagen):
     """
     if not ruta_imagen:
         return False
+
+    # Las imágenes pendientes no están aún en S3: el spool descarta la subida
+    # al ver que el registro ya no tiene la marca de pendiente
+    if es_pendiente(ruta_imagen):
+        return False
     
     # Verificar si es una ruta S3
     if ruta_imagen.startswith('s3://'):
@@ -119,12 +181,31 @@ def eliminar_archivo_imagen(ruta_imagen):
             if bucket_name != S3_BUCKET_NAME:
                 print(f"El bucket en la ruta ({bucket_name}) no coincide con el configurado ({S3_BUCKET_NAME})")
                 return False
-                
+
+            # Las imágenes del registro de imágenes solo pierden una referencia; cuando
+            # ya no las usa ningún registro las borra la recogida de basura
+            # (clean_images_scheduled.py)
+            if liberar(images_collection, object_key) is not None:
+                return True
+
+            # Los derivados (miniatura, tamaño medio) se eliminan junto con el original
+            claves = [object_key] + [clave_derivado(object_key, variante) for variante in VARIANTES]
+            # Ningún registro los usa ya: se dejan de servir desde la caché local desde ahora
+            for clave in claves:
+                cache_s3.descartar(S3_BUCKET_NAME, clave)
+            if cola_borrados:
+                # Se borran en segundo plano, por lotes (ver s3_deletion_queue.py)
+                cola_borrados.encolar(S3_BUCKET_NAME, claves, imagen=object_key)
+                return True
+            for clave in claves[1:]:
+                delete_file_from_s3(clave)
             return delete_file_from_s3(object_key)
         except Exception as e:
             print(f"Error al eliminar el archivo de S3 {ruta_imagen}: {str(e)}")
             return False
     else:
+        if liberar(images_collection, ruta_imagen) is not None:
+            return True
         # Comportamiento anterior para archivos locales
         # Convertir ruta relativa a absoluta
         if ruta_imagen.startswith('/'):
@@ -145,82 +226,262 @@ def eliminar_archivo_imagen(ruta_imagen):
             print(f"Error al eliminar el archivo {ruta_absoluta}: {str(e)}")
             return False
 
-def upload_file_to_s3(file_path, object_name=None, max_retries=3, delete_local=True):
-    """Sube un archivo a un bucket de S3, verifica que la subida fue exitosa, 
-    implementa reintentos en caso de fallo y elimina el archivo local después de la subida
+def delete_file_from_s3(object_name):
+    """Elimina un archivo de un bucket de S3
     
     Args:
-        file_path: Ruta del archivo a subir
-        object_name: Nombre de objeto S3, si es None, se usa el nombre del archivo
-        max_retries: Número máximo de intentos de subida (por defecto: 3)
-        delete_local: Si True, elimina el archivo local después de una subida exitosa
+        object_name: Nombre del objeto a eliminar
     
     Returns:
-        bool: True si la subida es exitosa, False en caso contrario
+        bool: True si la eliminación es exitosa, False en caso contrario
     """
-    if object_name is None:
-        object_name = os.path.basename(file_path)
-    
-    if not os.path.exists(file_path):
-        app.logger.error(f"El archivo {file_path} no existe")
+    try:
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=object_name)
+        print(f"Archivo eliminado de S3: {object_name}")
+        return True
+    except ClientError as e:
+        print(f"Error eliminando archivo de S3: {e}")
         return False
-    
-    successful = False
-    attempt = 0
-    
-    while attempt < max_retries and not successful:
-        attempt += 1
+
+# Subidas simultáneas de imágenes a S3 (compartidas por todas las peticiones del proceso)
+pool_subidas = ThreadPoolExecutor(max_workers=int(os.getenv("S3_UPLOAD_WORKERS", "8")))
+
+# Generación en segundo plano de los derivados de las subidas directas, con su propio pool
+# para no ocupar los hilos a los que esperan los formularios. Las tareas pendientes están
+# acotadas: las que no caben se omiten y las genera después backfill_derivatives.py
+pool_derivados = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2")))
+plazas_derivados = threading.BoundedSemaphore(int(os.getenv("IMAGE_DERIVATIVE_QUEUE", "64")))
+
+# Segundos que se espera a que el pool de procesos genere los derivados de una imagen
+TIEMPO_MAXIMO_DERIVADOS = int(os.getenv("IMAGE_DERIVATIVES_TIMEOUT", "60"))
+
+def guardar_derivados(futuro, object_name):
+    """Sube a S3 los derivados generados por el pool de procesos para un objeto.
+
+    Returns:
+        dict: Rutas "s3://" de cada variante, o None si no se han podido generar
+    """
+    try:
+        return subir_derivados(s3_client, S3_BUCKET_NAME, object_name, futuro.result(timeout=TIEMPO_MAXIMO_DERIVADOS))
+    except Exception as e:
+        app.logger.warning(f"No se pudieron generar los derivados de {object_name}: {str(e)}")
+        return None
+
+def upload_fileobj_to_s3(fileobj, object_name, max_retries=3, integridad=None, tipo=None):
+    """Sube a S3 el contenido de un objeto tipo archivo (sin escribirlo en disco)
+    con su SHA-256, de modo que S3 verifica la integridad al recibirlo (sin
+    head_object posterior), e implementa reintentos en caso de fallo
+
+    Args:
+        fileobj: Objeto tipo archivo con posibilidad de seek (ej: stream de un FileStorage)
+        object_name: Nombre de objeto S3
+        max_retries: Número máximo de intentos de subida (por defecto: 3)
+        integridad: Suma y tamaño ya calculados del contenido (evita leerlo otra vez para la suma)
+        tipo: Content-Type del objeto (ej: "image/jpeg")
+
+    Returns:
+        dict: Suma y tamaño del objeto subido ({"sha256": ..., "tamano": ...}), o None si falla
+    """
+    for attempt in range(1, max_retries + 1):
         app.logger.info(f"Intento {attempt}/{max_retries} - Subiendo archivo a S3: {object_name}")
-        
         try:
-            # Subir el archivo a S3
-            s3_client.upload_file(file_path, S3_BUCKET_NAME, object_name)
-            
-            # Verificar que el archivo existe en S3
-            try:
-                s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=object_name)
-                successful = True
-                app.logger.info(f"✅ Archivo subido y verificado en S3: {object_name}")
-            except ClientError as e:
-                app.logger.warning(f"⚠️ Archivo subido pero no se pudo verificar en S3: {object_name}. Error: {e}")
-                # Si el archivo no se puede verificar, se considera como un error
-                successful = False
-                
-        except ClientError as e:
+            extra = {"ContentType": tipo} if tipo else {}
+            confirmada = subir_con_suma(s3_client, S3_BUCKET_NAME, object_name, fileobj, integridad, **extra)
+            app.logger.info(f"✅ Archivo subido y verificado en S3: {object_name}")
+            return confirmada
+        except (ClientError, ValueError) as e:
             app.logger.error(f"❌ Error al subir archivo a S3 (intento {attempt}/{max_retries}): {e}")
             if attempt < max_retries:
-                import time
                 # Esperar un tiempo incremental entre reintentos (backoff exponencial)
                 wait_time = 2 ** attempt
                 app.logger.info(f"Esperando {wait_time} segundos antes del siguiente intento...")
                 time.sleep(wait_time)
-    
-    # Si la subida fue exitosa y se solicita eliminar el archivo local
-    if successful and delete_local:
-        try:
-            os.remove(file_path)
-            app.logger.info(f"🗑️ Archivo local eliminado después de subida exitosa: {file_path}")
-        except Exception as e:
-            app.logger.warning(f"⚠️ No se pudo eliminar el archivo local {file_path}: {e}")
-    
-    return successful
+    return None
+
+def almacenar_imagen(fileobj, tipo, descripcion, max_retries=3, usuario=None):
+    """Guarda una imagen en S3 con una clave derivada de su contenido (ver image_store.py).
+
+    Si el mismo contenido ya está en S3 solo se suma una referencia: no se vuelve
+    a subir ni se generan otra vez los derivados.
 
-def delete_file_from_s3(object_name):
-    """Elimina un archivo de un bucket de S3
-    
     Args:
-        object_name: Nombre del objeto a eliminar
-    
+        fileobj: Objeto tipo archivo con posibilidad de seek
+        tipo: Tipo MIME de la imagen (ej: "image/jpeg"); la clave no lleva extensión
+        descripcion: Texto para los mensajes de log
+        max_retries: Número máximo de intentos de subida
+        usuario: Usuario que sube la imagen (queda registrado en el registro de imágenes)
+
     Returns:
-        bool: True si la eliminación es exitosa, False en caso contrario
+        tuple: (ruta "s3://" del original, rutas de los derivados o None, suma y tamaño),
+        o (None, None, None) si falla la subida
+    """
+    # El contenido se lee una sola vez: de esos bytes salen la suma, los derivados y la subida
+    fileobj.seek(0)
+    datos = fileobj.read()
+    cuerpo = io.BytesIO(datos)
+    suma, tamano = suma_sha256(cuerpo)
+    integridad = {"sha256": suma, "tamano": tamano}
+    object_name = clave_contenido(suma)
+    s3_url = f"s3://{S3_BUCKET_NAME}/{object_name}"
+
+    previa = reservar(images_collection, object_name, integridad, S3_BUCKET_NAME, tipo, usuario)
+    if previa and previa.get("almacenada"):
+        app.logger.info(f"{descripcion}: la imagen ya está en S3, no se vuelve a subir: {s3_url}")
+        return s3_url, previa.get("derivados"), integridad
+    if previa is None and cola_borrados:
+        # Un borrado pendiente de este mismo contenido ya no debe ejecutarse
+        cola_borrados.cancelar(S3_BUCKET_NAME, [object_name] + [clave_derivado(object_name, v) for v in VARIANTES])
+
+    futuro = enviar_a_procesar(datos)
+    if not upload_fileobj_to_s3(cuerpo, object_name, max_retries=max_retries,
+                                integridad=integridad, tipo=tipo):
+        futuro.cancel()
+        liberar(images_collection, object_name)
+        return None, None, None
+    derivados = guardar_derivados(futuro, object_name)
+    marcar_almacenada(images_collection, object_name, derivados)
+    app.logger.info(f"Imagen subida exitosamente a S3: {s3_url}")
+    return s3_url, derivados, integridad
+
+def subir_imagen_formulario(file, descripcion, usuario=None):
+    """Sube a S3 una imagen recibida en un formulario y genera sus derivados.
+
+    El original se envía directamente desde el stream del archivo recibido (sin
+    guardarlo en disco), con la clave derivada de su contenido (ver
+    `almacenar_imagen`), y los derivados (miniatura y tamaño medio) se generan
+    en el pool de procesos mientras tanto.
+
+    Args:
+        file: Archivo recibido (werkzeug FileStorage)
+        descripcion: Texto para los mensajes de log (ej: "imagen 1 para nuevo registro")
+        usuario: Usuario que sube la imagen
+
+    Returns:
+        tuple: (ruta "s3://" del original, rutas de los derivados o None, suma y tamaño),
+        o (None, None, None) si falla la subida
     """
+    app.logger.info(f"Procesando {descripcion}: {file.filename}")
+
     try:
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=object_name)
-        print(f"Archivo eliminado de S3: {object_name}")
-        return True
+        resultado = almacenar_imagen(file.stream, tipo_contenido(file.filename), descripcion, usuario=usuario)
+        if not resultado[0]:
+            app.logger.error(f"Falló la subida a S3 para {descripcion}: {file.filename}")
+        return resultado
+    except Exception as e:
+        app.logger.error(f"Error al procesar {descripcion}: {str(e)}")
+        return None, None, None
+
+def nombre_unico_imagen(filename):
+    """Nombre único (timestamp y token aleatorio) con el que se guarda una imagen en S3"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S%f')
+    extension = os.path.splitext(secure_filename(filename))[1]
+    return f"{timestamp}_{secrets.token_hex(4)}{extension}"
+
+def subir_pendiente(datos, object_name):
+    """Sube a S3 una imagen del spool de subidas diferidas y genera sus derivados.
+
+    La clave final es la de su contenido (ver `almacenar_imagen`), no el nombre del spool.
+
+    Sin reintentos: si falla, el spool vuelve a intentarlo más tarde con espera exponencial.
+
+    Returns:
+        tuple: (ruta "s3://" del original, rutas de los derivados, suma y tamaño), o (None, None, None) si falla
+    """
+    return almacenar_imagen(
+        io.BytesIO(datos), tipo_contenido(object_name), f"imagen {object_name} del spool", max_retries=1
+    )
+
+def subir_imagenes_formulario(archivos, descripcion, tabla=None, registro_id=None):
+    """Sube en paralelo las imágenes de una petición (ver `subir_imagen_formulario`).
+
+    En modo de subida diferida (S3_DEFERRED_UPLOADS) las imágenes no se suben
+    aquí: se guardan en el spool y se devuelve su marca de pendiente, que el
+    hilo de fondo sustituye por la ruta de S3 cuando termina la subida.
+
+    Args:
+        archivos: Dict posición -> archivo recibido
+        descripcion: Texto para los mensajes de log (ej: "para nuevo registro")
+        tabla: Tabla del registro (necesaria en modo diferido)
+        registro_id: _id del registro (necesario en modo diferido)
+
+    Returns:
+        dict: posición -> (ruta "s3://" o marca de pendiente, rutas de los derivados, suma y tamaño),
+        (None, None, None) si falla
+    """
+    if SUBIDAS_DIFERIDAS:
+        pendientes = {}
+        for i, file in archivos.items():
+            object_name = nombre_unico_imagen(file.filename)
+            app.logger.info(f"Imagen {i+1} {descripcion} guardada en el spool: {object_name}")
+            pendientes[i] = (spool_subidas.encolar(file.stream.read(), object_name, tabla, registro_id, i), None, None)
+        return pendientes
+    futuros = {
+        i: pool_subidas.submit(subir_imagen_formulario, file, f"imagen {i+1} {descripcion}", session.get("usuario"))
+        for i, file in archivos.items()
+    }
+    return {i: futuro.result() for i, futuro in futuros.items()}
+
+def claves_subidas_directas(tokens):
+    """Verifica las imágenes que el navegador ha subido directamente a S3.
+
+    Args:
+        tokens: Tokens recibidos en el formulario (ver direct_uploads.py)
+
+    Returns:
+        list: (clave de S3, suma y tamaño, rutas de los derivados si ya existen) de cada
+        objeto, en el orden de los tokens
+
+    Raises:
+        ValueError: Si un token no es válido o su objeto no es una imagen válida en S3
+    """
+    claves = []
+    for token in tokens:
+        if token:
+            clave = clave_de_token(serializador_subidas, token, session["usuario"])
+            cabecera = verificar_objeto(s3_client, S3_BUCKET_NAME, clave)
+            integridad = integridad_cabecera(cabecera)
+            previa = reservar(images_collection, clave, integridad, S3_BUCKET_NAME, cabecera.get("ContentType"),
+                              session["usuario"])
+            if previa and previa.get("almacenada"):
+                claves.append((clave, integridad, previa.get("derivados")))
+            else:
+                marcar_almacenada(images_collection, clave)
+                claves.append((clave, integridad, None))
+    return claves
+
+def completar_subida_directa(registro_id, tabla, indice, object_name):
+    """Genera los derivados de una imagen subida directamente a S3 y los guarda en el registro.
+
+    Se ejecuta en segundo plano, después de guardar el registro; solo se actualiza
+    si la imagen sigue en la misma posición.
+    """
+    try:
+        datos = cache_s3.leer(S3_BUCKET_NAME, object_name)
     except ClientError as e:
-        print(f"Error eliminando archivo de S3: {e}")
-        return False
+        app.logger.warning(f"No se pudo leer {object_name} para generar sus derivados: {e}")
+        return
+    derivados = guardar_derivados(enviar_a_procesar(datos), object_name)
+    if derivados:
+        marcar_almacenada(images_collection, object_name, derivados)
+        resultado = catalog_collection.update_one(
+            {"_id": registro_id, f"Imagenes.{indice}": f"s3://{S3_BUCKET_NAME}/{object_name}"},
+            {"$set": {f"{CAMPO_DERIVADOS}.{indice}": derivados}}
+        )
+        if resultado.matched_count:
+            registrar_cambio(counters_collection, tabla)
+
+def programar_derivados_directos(registro_id, tabla, directas):
+    """Encola la generación de derivados de las imágenes subidas directamente (posición -> clave)"""
+    for i, object_name in directas.items():
+        if not plazas_derivados.acquire(blocking=False):
+            app.logger.warning(f"Cola de derivados llena; {object_name} queda para backfill_derivatives.py")
+            continue
+        try:
+            futuro = pool_derivados.submit(completar_subida_directa, registro_id, tabla, i, object_name)
+        except RuntimeError:
+            plazas_derivados.release()
+            raise
+        futuro.add_done_callback(lambda _: plazas_derivados.release())
 
 def get_s3_url(object_name, expiration=3600):
     """Genera una URL prefirmada para acceder a un objeto de S3
@@ -284,18 +545,65 @@ catalog_collection = db["67b8c24a7fdc72dd4d8703cf"]  # Asegúrate de que el nomb
 users_collection = db["users"]
 resets_collection = db["password_resets"]
 spreadsheets_collection = db["spreadsheets"]
+# Registro de imágenes de S3 con su número de referencias (ver image_store.py)
+images_collection = db[IMAGES_COLLECTION]
+counters_collection = db["table_counters"]
+locks_collection = db["table_locks"]
+sort_stats_collection = db["column_sort_stats"]
+
+# Metadatos de las tablas (encabezados, numeración) cacheados por nombre de fichero
+cache_tablas = CacheTablas()
+
+def obtener_tabla(filename):
+    """Devuelve el documento de la tabla (colección spreadsheets) usando la caché del proceso"""
+    return cache_tablas.obtener(filename, lambda: spreadsheets_collection.find_one({"filename": filename}))
+
+# HTML de las filas del listado ya renderizadas, por _id de registro
+cache_filas = CacheFilas()
+
+# Subida diferida de imágenes: el registro se guarda con las imágenes pendientes
+# y un hilo de fondo las sube a S3 desde el spool local (ver upload_spool.py)
+SUBIDAS_DIFERIDAS = os.environ.get("S3_DEFERRED_UPLOADS", "False") == "True"
+spool_subidas = SpoolSubidas() if SUBIDAS_DIFERIDAS else None
+if SUBIDAS_DIFERIDAS:
+    iniciar_trabajador(spool_subidas, lambda: procesar_spool(
+        spool_subidas, catalog_collection, counters_collection, subir_pendiente, eliminar_archivo_imagen
+    ))
+
+# Borrado de objetos de S3 en segundo plano, agrupados en llamadas a delete_objects
+COLA_BORRADOS_S3 = os.environ.get("S3_DELETE_QUEUE", "True") == "True"
+cola_borrados = ColaBorrados(db[S3_DELETIONS_COLLECTION]) if COLA_BORRADOS_S3 else None
+if COLA_BORRADOS_S3:
+    iniciar_trabajador(cola_borrados, lambda: procesar_cola_borrados(
+        cola_borrados, s3_client, imagenes=images_collection, cache=cache_s3
+    ), INTERVALO_BORRADOS, nombre="borrados-s3")
+
+# Subida directa del navegador a S3 con POST prefirmado (ver direct_uploads.py);
+# el bucket debe permitir POST desde el dominio de la aplicación (CORS)
+SUBIDAS_DIRECTAS = os.environ.get("S3_DIRECT_UPLOADS", "False") == "True"
+serializador_subidas = URLSafeTimedSerializer(app.secret_key)
+app.jinja_env.globals["subida_directa"] = SUBIDAS_DIRECTAS
+
+# Intentos de inserción de un registro cuyo "Número" asigna el contador de la tabla
+INTENTOS_INSERCION = 3
+
+# Crear índices para las columnas por las que más se ordena el catálogo
+AUTO_INDICES_COLUMNA = os.environ.get("CATALOG_AUTO_INDEX", "True") == "True"
+
+# Crear los índices declarados en mongo_indexes.py que falten (idempotente)
+if os.environ.get("MONGO_SYNC_INDEXES", "True") == "True":
+    try:
+        sincronizar_indices(db, logger=app.logger)
+    except Exception as e:
+        app.logger.error(f"Error al sincronizar los índices de MongoDB: {str(e)}")
 
-# Verificar si la colección tiene datos
-registros = list(catalog_collection.find())
-# Comentado para evitar imprimir todos los documentos
-# print("\U0001F4CC Documentos en la colección:")
-# for doc in registros:
-#     print(doc)
-print(f"\U0001F4CC Total de registros en la colección: {len(registros)}")
+# Verificar si la colección tiene datos (sin cargar los documentos en memoria)
+total_registros = catalog_collection.estimated_document_count()
+print(f"\U0001F4CC Total de registros en la colección: {total_registros}")
 
 
 # Insertar un documento de prueba si la colección está vacía
-if len(registros) == 0:
+if total_registros == 0:
     doc_prueba = {"test": "Conexión funcionando"}
     catalog_collection.insert_one(doc_prueba)
     print("✅ Se insertó un documento de prueba.")
@@ -330,25 +638,33 @@ def leer_datos_excel(filename):
     wb.close()
     return data
 
-def escribir_datos_excel(data, filename):
-    wb = Workbook()
-    hoja = wb.active
-    hoja.title = "Datos"
+def escribir_datos_excel(data, filename, headers=None):
+    """Escribe los registros en un Excel de forma incremental (modo write_only).
 
-    headers = session.get("selected_headers", ["Número", "Descripción", "Peso", "Valor", "Imagenes"])
+    Args:
+        data: Iterable de registros (puede ser un cursor de MongoDB)
+        filename: Ruta del archivo Excel a generar
+        headers: Encabezados de la tabla (por defecto, los de la sesión)
+    """
+    wb = Workbook(write_only=True)
+    hoja = wb.create_sheet("Datos")
+
+    headers = list(headers or session.get("selected_headers", ["Número", "Descripción", "Peso", "Valor", "Imagenes"]))
 
     if "Número" not in headers:
         headers.insert(0, "Número")
+    if "Imagenes" not in headers:
+        headers.append("Imagenes")
 
     hoja.append(headers)
 
     for item in data:
         fila = []
         for header in headers:
-            valor = item.get(header, "")
+            valor = item.get(campo_seguro(header), "")
 
             if header == "Imagenes" and isinstance(valor, list):
-                valor = ", ".join(valor)
+                valor = ", ".join(ruta for ruta in valor if ruta)
 
             fila.append(valor)
 
@@ -396,12 +712,13 @@ def login():
     if request.method == "POST":
         login_input = request.form.get("login_input").strip()
         password = request.form.get("password").strip()
+        # Comparación sin distinguir mayúsculas, servida por los índices de nombre y email
         usuario = users_collection.find_one({
             "$or": [
-                {"nombre": {"$regex": f"^{login_input}$", "$options": "i"}},
-                {"email": {"$regex": f"^{login_input}$", "$options": "i"}}
+                {"nombre": login_input},
+                {"email": login_input}
             ]
-        })
+        }, collation=COLACION_SIN_MAYUSCULAS)
         if not usuario:
             return "Error: Usuario no encontrado. <a href='/login'>Reintentar</a>"
         if check_password_hash(usuario["password"], password):
@@ -427,10 +744,10 @@ def forgot_password():
         usuario_input = request.form.get("usuario").strip()
         user = users_collection.find_one({
             "$or": [
-                {"email": {"$regex": f"^{usuario_input}$", "$options": "i"}},
-                {"nombre": {"$regex": f"^{usuario_input}$", "$options": "i"}}
+                {"email": usuario_input},
+                {"nombre": usuario_input}
             ]
-        })
+        }, collation=COLACION_SIN_MAYUSCULAS)
         if not user:
             return "No se encontró ningún usuario con ese nombre o email. <a href='/forgot-password'>Volver</a>"
         token = secrets.token_urlsafe(32)
@@ -530,6 +847,7 @@ def tables():
                                 "headers": headers,
                                 "created_at": datetime.utcnow()
                             })
+                            cache_tablas.invalidar(filename)
                         except Exception as e:
                             app.logger.error(f"Error al guardar en MongoDB: {str(e)}")
                             flash("Error al guardar la información de la tabla en la base de datos.", "error")
@@ -576,6 +894,7 @@ def tables():
                                 "headers": headers,
                                 "created_at": datetime.utcnow()
                             })
+                            cache_tablas.invalidar(filename)
                         except Exception as e:
                             app.logger.error(f"Error al guardar en MongoDB: {str(e)}")
                             flash("Error al guardar la información de la tabla en la base de datos.", "error")
@@ -631,6 +950,149 @@ def select_table(table_id):
 # -------------------------------------------
 # RUTAS DEL CATÁLOGO (Excel e imágenes) para la tabla seleccionada
 # -------------------------------------------
+def crear_indice_columna_en_segundo_plano(campo):
+    try:
+        nombre = crear_indice_columna(catalog_collection, campo)
+        if nombre:
+            app.logger.info(f"Índice de columna creado: {nombre}")
+    except Exception as e:
+        app.logger.warning(f"No se pudo crear el índice de la columna {campo}: {str(e)}")
+
+def programar_indice_columna(campo):
+    """Cuenta la ordenación por un campo y, al llegar al umbral, crea su índice sin bloquear la petición"""
+    if not AUTO_INDICES_COLUMNA:
+        return
+    try:
+        if registrar_uso_orden(sort_stats_collection, campo):
+            threading.Thread(target=crear_indice_columna_en_segundo_plano, args=(campo,), daemon=True).start()
+    except Exception as e:
+        app.logger.warning(f"No se pudo registrar la ordenación por {campo}: {str(e)}")
+
+def consulta_catalogo(table_info, args):
+    """Etapas iniciales (filtro y clave de ordenación), campos de ordenación y
+    proyección del listado según la query string.
+
+    Raises:
+        ValueError: Si los filtros o la ordenación pedidos no son válidos
+    """
+    headers = table_info.get("headers", [])
+    filtro = filtro_tabla(table_info["filename"])
+    filtro.update(filtros_columnas(headers, args))
+    campo = campo_columna(headers, args.get("orden"))
+    campos_orden = orden_columna(headers, args.get("orden"), args.get("dir"))
+    proyeccion = proyeccion_registros(headers)
+    if campo:
+        # El índice de la columna sirve sus filtros; la ordenación usa la clave tipada calculada
+        programar_indice_columna(campo)
+        proyeccion = proyeccion_registros(headers, CAMPO_RANGO_ORDEN, CAMPO_VALOR_ORDEN)
+    return [{"$match": filtro}] + etapas_orden(campo), campos_orden, proyeccion
+
+def obtener_pagina_catalogo(table_info, args):
+    """Obtiene la página de registros de la tabla pedida en la query string.
+
+    La ordenación natural por "NumeroOrdenacion" la sirve el índice único {table, NumeroOrdenacion}
+    y solo se devuelven los campos que se muestran en la tabla. Los filtros y la ordenación
+    por columnas (ver catalog_query.py) se ejecutan en MongoDB.
+
+    Raises:
+        ValueError: Si los filtros o la ordenación pedidos no son válidos
+    """
+    etapas, campos_orden, proyeccion = consulta_catalogo(table_info, args)
+    return obtener_pagina(
+        catalog_collection,
+        etapas,
+        campos_orden,
+        obtener_tamano_pagina(args.get("por_pagina")),
+        despues=args.get("despues"),
+        antes=args.get("antes"),
+        proyeccion=proyeccion,
+        collation=COLACION_NUMERICA,
+        allowDiskUse=True
+    )
+
+def cursor_catalogo(table_info, args):
+    """Cursor de MongoDB con todos los registros de la tabla (modo "mostrar todos").
+
+    Raises:
+        ValueError: Si los filtros o la ordenación pedidos no son válidos
+    """
+    etapas, campos_orden, proyeccion = consulta_catalogo(table_info, args)
+    return catalog_collection.aggregate(
+        etapas + [{"$sort": dict(campos_orden)}, {"$project": proyeccion}],
+        collation=COLACION_NUMERICA, allowDiskUse=True, batchSize=500
+    )
+
+def render_catalogo(table_info, **contexto):
+    """Renderiza index.html con la página de registros pedida de la tabla.
+
+    Con por_pagina=todos la plantilla se envía en streaming mientras se lee el
+    cursor de MongoDB, de modo que la memoria y el tiempo hasta el primer byte
+    no dependen del número de registros.
+
+    En las tablas con numeración con huecos se calcula además la posición de la
+    primera fila de la página (solo en el orden natural y sin filtros), para
+    mostrar la posición de cada fila sin renumerar.
+    """
+    selected_table = table_info["filename"]
+    headers = table_info.get("headers", [])
+    plantilla_fila = app.jinja_env.get_template(PLANTILLA_FILA)
+    consulta = parametros_consulta(request.args)
+    contexto.update(consulta=consulta, tamanos_pagina=TAMANOS_PAGINA, mostrar_todos=MOSTRAR_TODOS, headers=headers)
+    con_posicion = modo_numeracion(table_info) == NUMERACION_CON_HUECOS
+
+    if request.args.get("por_pagina") == MOSTRAR_TODOS and "error_message" not in contexto:
+        try:
+            cursor = cursor_catalogo(table_info, request.args)
+        except ValueError as e:
+            contexto["error_message"] = str(e)
+        else:
+            if con_posicion and not consulta:
+                contexto["posicion_inicial"] = 1
+            filas = cache_filas.iterar(plantilla_fila, cursor, headers, firmador_urls.ventana_actual())
+            # Los mensajes se leen antes de enviar la respuesta: la sesión se guarda
+            # con las cabeceras y la plantilla se evalúa después
+            get_flashed_messages(with_categories=True)
+            return Response(stream_template("index.html", filas=filas, pagina=None, **contexto))
+
+    try:
+        pagina = obtener_pagina_catalogo(table_info, request.args)
+    except ValueError as e:
+        contexto["error_message"] = str(e)
+        contexto["consulta"] = consulta = {}
+        pagina = obtener_pagina_catalogo(table_info, {"por_pagina": request.args.get("por_pagina")})
+    if con_posicion and not consulta:
+        primer_registro = pagina.registros[0] if pagina.registros else None
+        contexto["posicion_inicial"] = posicion_inicial(catalog_collection, selected_table, primer_registro)
+    # Las URLs de las imágenes de la página se firman de una vez antes de renderizar las filas
+    firmador_urls.firmar_lote(ruta for registro in pagina.registros for ruta in rutas_mostradas(registro))
+    html_filas = cache_filas.renderizar(plantilla_fila, pagina.registros, headers, firmador_urls.ventana_actual())
+    filas = zip(pagina.registros, html_filas)
+    return render_template("index.html", filas=filas, pagina=pagina, **contexto)
+
+def etag_catalogo(table_info, version):
+    """ETag de una página del catálogo.
+
+    Depende de la versión de la tabla (cambia con cada inserción, edición,
+    eliminación o renumeración), de los metadatos de la tabla, del usuario, de
+    los parámetros de la página (cursor, filtros, orden, tamaño) y de la ventana
+    de firma de las URLs de las imágenes.
+    """
+    datos = json.dumps([
+        table_info["filename"], version, session.get("usuario"),
+        table_info.get("headers", []), modo_numeracion(table_info),
+        sorted(request.args.items(multi=True)),
+        # Las URLs de las imágenes de la página cambian con la ventana de firma
+        firmador_urls.ventana_actual(),
+    ], default=str)
+    return f"{version}-{hashlib.sha1(datos.encode('utf-8')).hexdigest()[:16]}"
+
+def pagina_sin_cambios(etag, modificado):
+    """Indica si la petición condicional (If-None-Match / If-Modified-Since) puede responderse con 304"""
+    if request.if_none_match:
+        return etag in request.if_none_match
+    if request.if_modified_since and modificado:
+        return modificado.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
 
 @app.route("/catalog", methods=["GET", "POST"])
 def catalog():
@@ -642,7 +1104,7 @@ def catalog():
         return redirect(url_for("tables"))
 
     selected_table = session["selected_table"]
-    table_info = spreadsheets_collection.find_one({"filename": selected_table})
+    table_info = obtener_tabla(selected_table)
 
     if not table_info:
         flash("La tabla seleccionada no existe.", "error")
@@ -656,84 +1118,141 @@ def catalog():
     # Guardar los encabezados en la sesión
     session["selected_headers"] = headers
 
-    # Obtener registros de MongoDB para la tabla seleccionada
-    # Asegurarse de que el campo "Número" es entero antes de ordenar
-    pipeline = [
-        {"$match": {"table": selected_table}},
-        {"$addFields": {"NumeroOrdenacion": {"$toInt": {"$ifNull": [{"$toInt": "$Número"}, "$Número"]}}}},
-        {"$sort": {"NumeroOrdenacion": 1}}
-    ]
-    registros = list(catalog_collection.aggregate(pipeline))
-
     if request.method == "POST":
         form_data = {k.strip(): v.strip() for k, v in request.form.items()}
 
         # Verificar si existe "Número" o el primer encabezado como identificador
         id_field = headers[0]
         if id_field not in form_data or not form_data[id_field]:
-            return render_template("index.html", data=registros, headers=headers, error_message=f"Error: Sin {id_field}.")
+            return render_catalogo(table_info, error_message=f"Error: Sin {id_field}.")
 
-        # Verificar si el identificador ya existe en esta tabla
-        if any(item.get(id_field) == form_data[id_field] for item in registros):
-            return render_template("index.html", data=registros, headers=headers, error_message=f"Error: Ese {id_field} ya existe.")
+        # Verificar si el identificador ya existe en esta tabla, antes de subir las imágenes.
+        # Lo garantizan los índices únicos {table, NumeroOrdenacion} e {table, IdentificadorTabla}
+        # al insertar; esta consulta solo evita subidas inútiles en el caso habitual
+        identificador = clave_identificador(headers, {campo_seguro(id_field): form_data[id_field]})
+        if identificador:
+            filtro_id = {"table": selected_table, CAMPO_IDENTIFICADOR: identificador}
+            if catalog_collection.find_one(filtro_id, {"_id": 1}, collation=COLACION_NUMERICA):
+                return render_catalogo(table_info, error_message=f"Error: Ese {id_field} ya existe.")
 
         # Construir el nuevo registro
-        nuevo_registro = {
-            "Número": len(registros) + 1,
-            "table": selected_table
-        }
+        nuevo_registro = {"_id": ObjectId(), "table": selected_table}
         
         # Agregar los campos del formulario
         for header in headers:
-            safe_header = header.replace(" ", "_").replace(".", "_")
-            nuevo_registro[safe_header] = form_data.get(header, "").strip()
+            nuevo_registro[campo_seguro(header)] = form_data.get(header, "").strip()
+
+        # Si la tabla no tiene columna "Número" (o se ha dejado vacía), se asigna el siguiente
+        # del contador de la tabla: sin identificador el registro no aparecería en los listados
+        numero_del_contador = not clave_ordenacion(nuevo_registro.get("Número"))
+        if numero_del_contador:
+            nuevo_registro["Número"] = siguiente_numero(counters_collection, catalog_collection, selected_table)
+        nuevo_registro[CAMPO_ORDEN] = clave_ordenacion(nuevo_registro["Número"])
+        if identificador:
+            nuevo_registro[CAMPO_IDENTIFICADOR] = identificador
+        nuevo_registro[CAMPO_BUSQUEDA] = texto_busqueda(nuevo_registro, headers)
 
-        # Manejo de imágenes
         # Manejo de imágenes
         files = request.files.getlist("imagenes")
         rutas_imagenes = [None, None, None]
-        
-        for i, file in enumerate(files[:3]):
-            if file and allowed_file(file.filename):
-                # Generar un nombre único con timestamp y uuid para evitar colisiones
-                original_filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S%f')
-                unique_id = secrets.token_hex(4)
-                extension = os.path.splitext(original_filename)[1]
-                unique_filename = f"{timestamp}_{unique_id}{extension}"
-                
-                app.logger.info(f"Procesando imagen {i+1} para nuevo registro: {unique_filename}")
-                
-                # Guardar temporalmente el archivo
-                temp_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-                file.save(temp_path)
-                
-                try:
-                    # Subir a S3 con nuestra función mejorada que verifica la subida y elimina archivos locales
-                    if upload_file_to_s3(temp_path, unique_filename, delete_local=True):
-                        # Si la carga a S3 es exitosa, guardamos la referencia a S3
-                        s3_url = f"s3://{S3_BUCKET_NAME}/{unique_filename}"
-                        rutas_imagenes[i] = s3_url
-                        app.logger.info(f"Imagen {i+1} subida exitosamente a S3: {s3_url}")
-                    else:
-                        app.logger.error(f"Falló la subida a S3 para imagen {i+1}: {unique_filename}")
-                        # No almacenamos la imagen localmente, solo registramos el error
-                except Exception as e:
-                    app.logger.error(f"Error al procesar imagen {i+1}: {str(e)}")
-                    # Asegurar que el archivo temporal se elimina incluso si hay error
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                        app.logger.info(f"Archivo temporal eliminado: {temp_path}")
-        # Asignar las rutas de imágenes al nuevo registro
+        derivados = [None, None, None]
+        integridad = [None, None, None]
+
+        archivos = {i: file for i, file in enumerate(files[:3]) if file and allowed_file(file.filename)}
+        # Las imágenes que el navegador ya ha subido a S3 ocupan las posiciones libres
+        try:
+            claves_directas = claves_subidas_directas(request.form.getlist("imagenes_s3"))
+        except ValueError as e:
+            return render_catalogo(table_info, error_message=f"Error: {e}")
+        directas = {}
+        for i, (object_name, integridad_imagen, derivados_imagen) in zip(
+                [i for i in range(3) if i not in archivos], claves_directas):
+            rutas_imagenes[i] = f"s3://{S3_BUCKET_NAME}/{object_name}"
+            integridad[i], derivados[i] = integridad_imagen, derivados_imagen
+            if not derivados_imagen:
+                directas[i] = object_name
+        for i, (ruta, derivados_imagen, integridad_imagen) in subir_imagenes_formulario(
+                archivos, "para nuevo registro", selected_table, nuevo_registro["_id"]).items():
+            rutas_imagenes[i], derivados[i], integridad[i] = ruta, derivados_imagen, integridad_imagen
+        # Asignar las rutas de imágenes (con sus derivados, suma y tamaño) al nuevo registro
         nuevo_registro["Imagenes"] = rutas_imagenes
+        nuevo_registro[CAMPO_DERIVADOS] = derivados
+        nuevo_registro[CAMPO_INTEGRIDAD] = integridad
 
-        # Insertar en MongoDB
-        catalog_collection.insert_one(nuevo_registro)
+        # Insertar en MongoDB. Si el número lo asignó el contador y ya está ocupado (una
+        # renumeración en curso puede haberlo reutilizado), se reserva otro y se reintenta
+        for intento in range(1, INTENTOS_INSERCION + 1):
+            try:
+                catalog_collection.insert_one(nuevo_registro)
+                break
+            except DuplicateKeyError as e:
+                indice = (e.details or {}).get("keyPattern") or {}
+                if not numero_del_contador or CAMPO_ORDEN not in indice or intento == INTENTOS_INSERCION:
+                    # Las imágenes ya subidas dejan de estar referenciadas por el registro
+                    for ruta in rutas_imagenes:
+                        eliminar_archivo_imagen(ruta)
+                    return render_catalogo(table_info, error_message=f"Error: Ese {id_field} ya existe.")
+                nuevo_registro["Número"] = siguiente_numero(counters_collection, catalog_collection, selected_table)
+                nuevo_registro[CAMPO_ORDEN] = clave_ordenacion(nuevo_registro["Número"])
+        registrar_cambio(counters_collection, selected_table)
+        programar_derivados_directos(nuevo_registro["_id"], selected_table, directas)
 
         return redirect(url_for("catalog"))
 
-    # GET: mostrar los registros existentes
-    return render_template("index.html", data=registros, headers=headers)
+    # GET: si la página no ha cambiado desde la copia del navegador se responde 304
+    # sin consultar los registros ni renderizar la plantilla
+    version, modificado = version_tabla(counters_collection, selected_table)
+    etag = etag_catalogo(table_info, version)
+    if "_flashes" not in session and pagina_sin_cambios(etag, modificado):
+        respuesta = Response(status=304)
+    else:
+        respuesta = make_response(render_catalogo(table_info))
+    respuesta.set_etag(etag)
+    if modificado:
+        respuesta.last_modified = modificado.replace(tzinfo=timezone.utc)
+    # El navegador puede guardar la página, pero debe revalidarla en cada visita
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+@app.route("/buscar")
+def buscar():
+    """Búsqueda de texto en los registros de la tabla seleccionada o de todas las del usuario.
+
+    Usa el índice de texto {table, "TextoBusqueda"} (una búsqueda por tabla); los resultados se ordenan por
+    relevancia y se paginan por cursor, igual que el listado del catálogo.
+    """
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+
+    texto = request.args.get("q", "").strip()
+    todas = request.args.get("todas") == "1"
+    if not todas and "selected_table" not in session:
+        flash("Por favor, seleccione una tabla primero.", "warning")
+        return redirect(url_for("tables"))
+
+    filtro_tablas = {"owner": session["usuario"]}
+    if not todas:
+        filtro_tablas["filename"] = session["selected_table"]
+    tablas = {
+        tabla["filename"]: tabla
+        for tabla in spreadsheets_collection.find(filtro_tablas, {"filename": 1, "name": 1, "headers": 1})
+    }
+
+    pagina = None
+    if texto and tablas:
+        pagina = obtener_pagina(
+            catalog_collection,
+            etapas_busqueda(texto, list(tablas), catalog_collection.name),
+            ORDEN_BUSQUEDA,
+            obtener_tamano_pagina(request.args.get("por_pagina")),
+            despues=request.args.get("despues"),
+            antes=request.args.get("antes"),
+            proyeccion={"table": 1, "Número": 1, CAMPO_BUSQUEDA: 1, "puntuacion": 1}
+        )
+
+    return render_template("buscar.html", texto=texto, todas=todas, pagina=pagina, tablas=tablas,
+                           tamanos_pagina=TAMANOS_PAGINA)
 
 @app.route("/editar/<id>", methods=["GET", "POST"])
 def editar(id):
@@ -745,7 +1264,7 @@ def editar(id):
         return redirect(url_for("tables"))
 
     selected_table = session["selected_table"]
-    table_info = spreadsheets_collection.find_one({"filename": selected_table})
+    table_info = obtener_tabla(selected_table)
 
     if not table_info:
         flash("La tabla seleccionada no existe.", "error")
@@ -757,25 +1276,23 @@ def editar(id):
         return redirect(url_for("tables"))
 
     id_field = headers[0]
-    safe_id_field = id_field.replace(" ", "_").replace(".", "_")
+    safe_id_field = campo_seguro(id_field)
+    # Solo se leen los campos que se muestran y se vuelven a guardar
+    proyeccion = proyeccion_edicion(headers)
 
     # Obtenemos el registro desde MongoDB - Intentamos primero con "Número" para tablas manuales
-    registro = None
-    encontrado_por_numero = False  # Variable para rastrear cómo se encontró el registro
-    
-    try:
-        # Intenta buscar por "Número" convertido a entero
-        num_id = int(id)
-        registro = catalog_collection.find_one({"Número": num_id, "table": selected_table})
-        if registro:
-            encontrado_por_numero = True  # Marcamos que se encontró por Número
-    except (ValueError, TypeError):
-        # Si la conversión falla, continúa con la búsqueda normal
-        pass
+    # (a través de "NumeroOrdenacion", que cubre números y textos y usa el índice de la tabla)
+    registro = catalog_collection.find_one(
+        filtro_tabla(selected_table, {"$eq": clave_ordenacion(id)}),
+        proyeccion,
+        collation=COLACION_NUMERICA
+    )
         
     # Si no encontramos el registro por "Número", intentamos con el encabezado original
     if not registro:
-        registro = catalog_collection.find_one({safe_id_field: id, "table": selected_table})
+        registro = catalog_collection.find_one(
+            {safe_id_field: id, "table": selected_table}, proyeccion, collation=COLACION_NUMERICA
+        )
         
     if not registro:
         flash(f"No existe el registro con ID {id} en la tabla seleccionada.", "error")
@@ -799,17 +1316,18 @@ def editar(id):
                 eliminar_archivo_imagen(ruta)
                 
         # Ahora eliminar el registro de la base de datos
-        # Usar el mismo criterio por el que se encontró el registro originalmente
-        if encontrado_por_numero:
-            # Si se encontró por "Número", eliminamos usando ese campo
-            result = catalog_collection.delete_one({"Número": int(id), "table": selected_table})
-        else:
-            # Si se encontró por safe_id_field, eliminamos usando ese campo
-            result = catalog_collection.delete_one({safe_id_field: id, "table": selected_table})
+        result = catalog_collection.delete_one({"_id": registro["_id"]})
             
         if result.deleted_count > 0:
+            registrar_cambio(counters_collection, selected_table)
+            cache_filas.invalidar(registro["_id"])
             # Renumerar registros para evitar huecos en la numeración
-            renumerar_registros(selected_table)
+            # (las tablas con numeración con huecos se compactan aparte, con compact_tables.py)
+            if modo_numeracion(table_info) == NUMERACION_CONTINUA:
+                try:
+                    renumerar_registros(selected_table)
+                except TablaBloqueada as e:
+                    app.logger.warning(f"No se renumeró tras eliminar: {e}")
             flash("Registro y sus imágenes eliminados exitosamente.", "success")
         else:
             flash("No se pudo eliminar el registro.", "error")
@@ -820,6 +1338,7 @@ def editar(id):
         
         # Manejar campos especiales primero
         update_data["Número"] = registro["Número"]  # Mantener el número original
+        update_data[CAMPO_ORDEN] = clave_ordenacion(registro["Número"])
         update_data["table"] = selected_table
 
         # Actualizar el resto de campos desde el formulario
@@ -827,113 +1346,48 @@ def editar(id):
             if header != "Imagenes" and header != "Número":
                 form_value = request.form.get(header, "").strip()
                 # Usar punto para campos con espacios en MongoDB
-                safe_header = header.replace(" ", "_").replace(".", "_")
-                update_data[safe_header] = form_value
+                update_data[campo_seguro(header)] = form_value
+        identificador = clave_identificador(headers, update_data)
+        if identificador:
+            update_data[CAMPO_IDENTIFICADOR] = identificador
+        update_data[CAMPO_BUSQUEDA] = texto_busqueda(update_data, headers)
 
         # Manejo de imágenes
         # Manejo de imágenes
-        rutas_imagenes = registro.get("Imagenes", [None, None, None])
-        
-        # Procesar cada campo de imagen por separado
-        # Imagen 1
-        imagen1 = request.files.get("imagen1")
-        if imagen1 and imagen1.filename and allowed_file(imagen1.filename):
-            # Generar un nombre único con timestamp y uuid para evitar colisiones
-            original_filename = secure_filename(imagen1.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S%f')
-            unique_id = secrets.token_hex(4)
-            extension = os.path.splitext(original_filename)[1]
-            unique_filename = f"{timestamp}_{unique_id}{extension}"
-            
-            app.logger.info(f"Procesando imagen 1 para actualización: {unique_filename}")
-            
-            # Guardar temporalmente el archivo
-            temp_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-            imagen1.save(temp_path)
-            
-            try:
-                # Subir a S3 con nuestra función mejorada que verifica la subida y elimina archivos locales
-                if upload_file_to_s3(temp_path, unique_filename, delete_local=True):
-                    # Si la carga a S3 es exitosa, guardamos la referencia a S3
-                    s3_url = f"s3://{S3_BUCKET_NAME}/{unique_filename}"
-                    rutas_imagenes[0] = s3_url
-                    app.logger.info(f"Imagen 1 subida exitosamente a S3: {s3_url}")
-                else:
-                    app.logger.error(f"Falló la subida a S3 para imagen 1: {unique_filename}")
-                    # No almacenamos la imagen localmente, solo registramos el error
-            except Exception as e:
-                app.logger.error(f"Error al procesar imagen 1: {str(e)}")
-                # Asegurar que el archivo temporal se elimina incluso si hay error
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    app.logger.info(f"Archivo temporal eliminado: {temp_path}")
-            
-        # Imagen 2
-        imagen2 = request.files.get("imagen2")
-        if imagen2 and imagen2.filename and allowed_file(imagen2.filename):
-            # Generar un nombre único con timestamp y uuid para evitar colisiones
-            original_filename = secure_filename(imagen2.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S%f')
-            unique_id = secrets.token_hex(4)
-            extension = os.path.splitext(original_filename)[1]
-            unique_filename = f"{timestamp}_{unique_id}{extension}"
-            
-            app.logger.info(f"Procesando imagen 2 para actualización: {unique_filename}")
-            
-            # Guardar temporalmente el archivo
-            temp_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-            imagen2.save(temp_path)
-            
-            try:
-                # Subir a S3 con nuestra función mejorada que verifica la subida y elimina archivos locales
-                if upload_file_to_s3(temp_path, unique_filename, delete_local=True):
-                    # Si la carga a S3 es exitosa, guardamos la referencia a S3
-                    s3_url = f"s3://{S3_BUCKET_NAME}/{unique_filename}"
-                    rutas_imagenes[1] = s3_url
-                    app.logger.info(f"Imagen 2 subida exitosamente a S3: {s3_url}")
-                else:
-                    app.logger.error(f"Falló la subida a S3 para imagen 2: {unique_filename}")
-                    # No almacenamos la imagen localmente, solo registramos el error
-            except Exception as e:
-                app.logger.error(f"Error al procesar imagen 2: {str(e)}")
-                # Asegurar que el archivo temporal se elimina incluso si hay error
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    app.logger.info(f"Archivo temporal eliminado: {temp_path}")
-            
-        # Imagen 3
-        # Imagen 3
-        imagen3 = request.files.get("imagen3")
-        if imagen3 and imagen3.filename and allowed_file(imagen3.filename):
-            # Generar un nombre único con timestamp y uuid para evitar colisiones
-            original_filename = secure_filename(imagen3.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S%f')
-            unique_id = secrets.token_hex(4)
-            extension = os.path.splitext(original_filename)[1]
-            unique_filename = f"{timestamp}_{unique_id}{extension}"
-            
-            app.logger.info(f"Procesando imagen 3 para actualización: {unique_filename}")
-            
-            # Guardar temporalmente el archivo
-            temp_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-            imagen3.save(temp_path)
-            
-            try:
-                # Subir a S3 con nuestra función mejorada que verifica la subida y elimina archivos locales
-                if upload_file_to_s3(temp_path, unique_filename, delete_local=True):
-                    # Si la carga a S3 es exitosa, guardamos la referencia a S3
-                    s3_url = f"s3://{S3_BUCKET_NAME}/{unique_filename}"
-                    rutas_imagenes[2] = s3_url
-                    app.logger.info(f"Imagen 3 subida exitosamente a S3: {s3_url}")
-                else:
-                    app.logger.error(f"Falló la subida a S3 para imagen 3: {unique_filename}")
-                    # No almacenamos la imagen localmente, solo registramos el error
-            except Exception as e:
-                app.logger.error(f"Error al procesar imagen 3: {str(e)}")
-                # Asegurar que el archivo temporal se elimina incluso si hay error
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    app.logger.info(f"Archivo temporal eliminado: {temp_path}")
+        rutas_imagenes, derivados, integridad = listas_imagenes(registro)
+
+        # Subir a la vez las imágenes recibidas en los campos imagen1, imagen2 e imagen3
+        archivos = {}
+        for i in range(3):
+            imagen = request.files.get(f"imagen{i+1}")
+            if imagen and imagen.filename and allowed_file(imagen.filename):
+                archivos[i] = imagen
+        # Imágenes sustituidas por otras: pierden la referencia de este registro al guardarlo
+        reemplazadas = []
+        # Imágenes nuevas: pierden su referencia si el registro no se llega a guardar
+        nuevas = []
+        for i, (ruta, derivados_imagen, integridad_imagen) in subir_imagenes_formulario(
+                archivos, "para actualización", selected_table, registro["_id"]).items():
+            if ruta:
+                if rutas_imagenes[i]:
+                    reemplazadas.append(rutas_imagenes[i])
+                nuevas.append(ruta)
+                rutas_imagenes[i] = ruta
+                derivados[i] = derivados_imagen
+                integridad[i] = integridad_imagen
+        # Imágenes subidas directamente a S3 por el navegador (campos imagen1_s3, ...)
+        directas = {}
+        for i in range(3):
+            token = request.form.get(f"imagen{i+1}_s3")
+            if token and i not in archivos:
+                if rutas_imagenes[i]:
+                    reemplazadas.append(rutas_imagenes[i])
+                object_name, integridad[i], derivados[i] = claves_subidas_directas([token])[0]
+                rutas_imagenes[i] = f"s3://{S3_BUCKET_NAME}/{object_name}"
+                nuevas.append(rutas_imagenes[i])
+                if not derivados[i]:
+                    directas[i] = object_name
+
         # Manejar eliminación de imágenes
         for i in range(3):
             if request.form.get(f"remove_img{i+1}") == "on":
@@ -942,23 +1396,38 @@ def editar(id):
                 if ruta_actual:  # Solo intentar eliminar si hay una imagen
                     eliminar_archivo_imagen(ruta_actual)
                 rutas_imagenes[i] = None
+                derivados[i] = None
+                integridad[i] = None
+        # Las imágenes pendientes que no se han cambiado pueden haberse subido mientras
+        # tanto: se conserva el valor actual en lugar de volver a escribir la marca
+        if any(es_pendiente(ruta) for ruta in rutas_imagenes):
+            actual = catalog_collection.find_one(
+                {"_id": registro["_id"]}, {"Imagenes": 1, CAMPO_DERIVADOS: 1, CAMPO_INTEGRIDAD: 1}
+            ) or {}
+            imagenes_actuales = actual.get("Imagenes") or []
+            for i, ruta in enumerate(rutas_imagenes):
+                if es_pendiente(ruta) and i not in archivos and i < len(imagenes_actuales):
+                    rutas_imagenes[i] = imagenes_actuales[i]
+                    for lista, campo in ((derivados, CAMPO_DERIVADOS), (integridad, CAMPO_INTEGRIDAD)):
+                        actuales = actual.get(campo) or []
+                        lista[i] = actuales[i] if i < len(actuales) else None
         update_data["Imagenes"] = rutas_imagenes
+        update_data[CAMPO_DERIVADOS] = derivados
+        update_data[CAMPO_INTEGRIDAD] = integridad
         # Actualizar en MongoDB usando replace_one en lugar de update_one
-        # Usar el mismo criterio por el que se encontró el registro originalmente
-        if encontrado_por_numero:
-            # Si se encontró por "Número", actualizamos usando ese campo
-            result = catalog_collection.replace_one(
-                {"Número": int(id), "table": selected_table},
-                update_data
-            )
-        else:
-            # Si se encontró por safe_id_field, actualizamos usando ese campo
-            result = catalog_collection.replace_one(
-                {safe_id_field: id, "table": selected_table},
-                update_data
-            )
-
+        try:
+            result = catalog_collection.replace_one({"_id": registro["_id"]}, update_data)
+        except DuplicateKeyError:
+            for ruta in nuevas:
+                eliminar_archivo_imagen(ruta)
+            flash(f"Error: Ese {id_field} ya existe en la tabla.", "error")
+            return redirect(url_for("catalog"))
+        for ruta in reemplazadas:
+            eliminar_archivo_imagen(ruta)
         if result.modified_count > 0:
+            registrar_cambio(counters_collection, selected_table)
+            cache_filas.invalidar(registro["_id"])
+            programar_derivados_directos(registro["_id"], selected_table, directas)
             flash("Registro actualizado exitosamente.", "success")
         else:
             flash("No se detectaron cambios en el registro.", "info")
@@ -990,7 +1459,11 @@ def delete_table(table_id):
             return redirect(url_for("tables"))
     
     # Eliminamos el documento de la colección en MongoDB
+    # Los registros de la tabla no se eliminan, así que sus imágenes conservan sus
+    # referencias en el registro de imágenes
     spreadsheets_collection.delete_one({"_id": ObjectId(table_id)})
+    counters_collection.delete_one({"_id": table["filename"]})
+    cache_tablas.invalidar(table["filename"])
     
     # Si la tabla eliminada era la seleccionada en sesión, la removemos de la sesión.
     if session.get("selected_table") == table["filename"]:
@@ -999,56 +1472,217 @@ def delete_table(table_id):
     flash("Tabla eliminada exitosamente.", "success")
     return redirect(url_for("tables"))
 
+@app.route("/table_numbering/<table_id>", methods=["POST"])
+def table_numbering(table_id):
+    """Cambia el modo de numeración de una tabla del usuario"""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+
+    modo = request.form.get("numeracion")
+    if modo not in MODOS_NUMERACION:
+        flash("Modo de numeración no válido.", "error")
+        return redirect(url_for("tables"))
+
+    table = spreadsheets_collection.find_one({"_id": ObjectId(table_id), "owner": session["usuario"]})
+    if not table:
+        flash("Tabla no encontrada o no tienes permiso para modificarla.", "error")
+        return redirect(url_for("tables"))
+
+    spreadsheets_collection.update_one({"_id": table["_id"]}, {"$set": {"numeracion": modo}})
+    cache_tablas.invalidar(table["filename"])
+
+    # Al volver a la numeración continua se eliminan los huecos acumulados
+    if modo == NUMERACION_CONTINUA and modo_numeracion(table) != NUMERACION_CONTINUA:
+        try:
+            renumerar_registros(table["filename"])
+        except TablaBloqueada:
+            flash("Hay una renumeración en curso; los huecos se eliminarán al terminar la siguiente.", "warning")
+
+    flash("Modo de numeración actualizado.", "success")
+    return redirect(url_for("tables"))
+
 @app.route("/descargar-excel")
 def descargar_excel():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    spreadsheet_path = get_current_spreadsheet()
-    if not spreadsheet_path or not os.path.exists(spreadsheet_path):
+    selected_table = session.get("selected_table")
+    table_info = obtener_tabla(selected_table) if selected_table else None
+    if not table_info:
         return "El Excel no existe aún."
+    headers = table_info.get("headers", [])
+
+    # Los registros se leen de MongoDB en orden y solo con los campos que se exportan
+    registros = catalog_collection.find(
+        filtro_tabla(selected_table),
+        proyeccion_registros(headers),
+        collation=COLACION_NUMERICA
+    ).sort(ORDEN_REGISTROS).batch_size(500)
+
     temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-    with zipfile.ZipFile(temp_zip.name, "w") as zf:
-        zf.write(spreadsheet_path, arcname=os.path.basename(spreadsheet_path))
-        data = leer_datos_excel(spreadsheet_path)
-        image_paths = set()
-        for row in data:
-            for ruta in row["imagenes"]:
-                if ruta:
-                    if ruta.startswith('s3://'):
-                        # Para imágenes en S3, intentar descargarlas al archivo temporal para incluirlas en el ZIP
-                        try:
-                            s3_parts = ruta[5:].split('/', 1)
-                            if len(s3_parts) == 2:
-                                bucket_name, object_key = s3_parts
-                                if bucket_name == S3_BUCKET_NAME:
-                                    filename = os.path.basename(object_key)
-                                    temp_download_path = os.path.join(tempfile.gettempdir(), filename)
-                                    s3_client.download_file(S3_BUCKET_NAME, object_key, temp_download_path)
-                                    # Agregar la ruta temporal a la lista de imágenes para incluir en el ZIP
-                                    image_paths.add(temp_download_path)
-                        except Exception as e:
-                            print(f"Error al descargar imagen de S3: {str(e)}")
-                    else:
-                        # Comportamiento anterior para archivos locales
-                        absolute_path = os.path.join(app.root_path, ruta)
-                        if os.path.exists(absolute_path):
-                            image_paths.add(absolute_path)
-            arcname = os.path.join("imagenes", os.path.basename(img_path))
-            zf.write(img_path, arcname=arcname)
+    temp_excel = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
+    temp_excel.close()
+    incluidas = set()
+
+    def registros_con_imagenes(zf):
+        """Recorre los registros añadiendo al ZIP sus imágenes a medida que aparecen"""
+        for row in registros:
+            for ruta in row.get("Imagenes") or []:
+                if not ruta:
+                    continue
+                if ruta.startswith('s3://'):
+                    # Las imágenes de S3 se leen de la caché local (solo se descargan si no están o han cambiado)
+                    try:
+                        s3_parts = ruta[5:].split('/', 1)
+                        if len(s3_parts) == 2:
+                            bucket_name, object_key = s3_parts
+                            if bucket_name == S3_BUCKET_NAME and ruta not in incluidas:
+                                with cache_s3.abrir(S3_BUCKET_NAME, object_key) as origen:
+                                    # Las claves por contenido no llevan extensión: se toma del Content-Type
+                                    nombre = os.path.basename(object_key)
+                                    if not os.path.splitext(nombre)[1]:
+                                        nombre += mimetypes.guess_extension(
+                                            cache_s3.tipo(S3_BUCKET_NAME, object_key) or "") or ""
+                                    with zf.open(os.path.join("imagenes", nombre), "w") as destino:
+                                        shutil.copyfileobj(origen, destino)
+                                incluidas.add(ruta)
+                    except Exception as e:
+                        print(f"Error al descargar imagen de S3: {str(e)}")
+                else:
+                    # Comportamiento anterior para archivos locales
+                    absolute_path = os.path.join(app.root_path, ruta.lstrip('/'))
+                    arcname = os.path.join("imagenes", os.path.basename(absolute_path))
+                    if os.path.exists(absolute_path) and ruta not in incluidas:
+                        zf.write(absolute_path, arcname=arcname)
+                        incluidas.add(ruta)
+            yield row
+
+    try:
+        with zipfile.ZipFile(temp_zip.name, "w") as zf:
+            escribir_datos_excel(registros_con_imagenes(zf), temp_excel.name, headers)
+            zf.write(temp_excel.name, arcname=selected_table)
+    finally:
+        os.remove(temp_excel.name)
     return send_from_directory(directory=os.path.dirname(temp_zip.name),
                                path=os.path.basename(temp_zip.name),
                                as_attachment=True,
                                download_name="catalogo.zip")
 
+# -------------------------------------------
+# SUBIDA DIRECTA A S3
+# -------------------------------------------
+@app.route("/api/uploads/presign", methods=["POST"])
+def politica_subida_directa():
+    """Política de POST prefirmada para que el navegador suba una imagen directamente a S3.
+
+    Cuerpo JSON: {"filename": ..., "size": ..., "sha256": ...}. La clave del objeto la fija el
+    servidor; la respuesta incluye la URL y los campos del POST y el token que
+    el formulario envía después en lugar del archivo.
+    """
+    if "usuario" not in session:
+        return jsonify({"error": "Autenticación requerida"}), 401
+    datos = request.get_json(silent=True) or {}
+    filename = datos.get("filename") or ""
+    tipo = tipo_contenido(filename)
+    if not allowed_file(filename) or not tipo:
+        return jsonify({"error": "Formato de imagen no permitido"}), 400
+    try:
+        tamano = int(datos.get("size") or 0)
+    except (TypeError, ValueError):
+        tamano = 0
+    if tamano > TAMANO_MAXIMO_SUBIDA:
+        return jsonify({"error": f"La imagen supera el tamaño máximo ({TAMANO_MAXIMO_SUBIDA} bytes)"}), 400
+
+    suma = datos.get("sha256") if isinstance(datos.get("sha256"), str) else None
+
+    if suma:
+        # Con la suma del navegador la clave es la del contenido; si este usuario ya la ha
+        # subido antes no hace falta repetirlo (a otros usuarios no se les revela si existe)
+        try:
+            object_name = clave_contenido(suma)
+        except ValueError:
+            return jsonify({"error": "Suma SHA-256 no válida"}), 400
+        if subida_de_usuario(images_collection, object_name, session["usuario"]):
+            return jsonify({"existente": True, "token": token_subida(serializador_subidas, object_name, session["usuario"])})
+    else:
+        object_name = nombre_unico_imagen(filename)
+    try:
+        politica = politica_subida(s3_client, S3_BUCKET_NAME, object_name, tipo, suma=suma)
+    except ClientError as e:
+        app.logger.error(f"Error al generar la política de subida para {object_name}: {e}")
+        return jsonify({"error": "No se pudo preparar la subida"}), 500
+    politica["token"] = token_subida(serializador_subidas, object_name, session["usuario"])
+    return jsonify(politica)
+
+# -------------------------------------------
+# API DE REGISTROS
+# -------------------------------------------
+@app.route("/api/tables/<table_id>/records")
+def api_table_records(table_id):
+    """Devuelve en streaming los registros de una tabla del usuario.
+
+    Parámetros de la query string:
+        format: "ndjson" (por defecto) o "json"
+        fields: Encabezados a devolver, separados por comas (por defecto, todos)
+        f.<encabezado>: Filtro de igualdad sobre un encabezado (repetible con distintos campos)
+        after: Cursor ("_cursor" de un registro) a partir del cual continuar
+        limit: Número máximo de registros a devolver
+    """
+    if "usuario" not in session:
+        return jsonify({"error": "Autenticación requerida"}), 401
+
+    try:
+        table = spreadsheets_collection.find_one({"_id": ObjectId(table_id), "owner": session["usuario"]})
+    except Exception:
+        table = None
+    if not table:
+        return jsonify({"error": "Tabla no encontrada"}), 404
+
+    headers = table.get("headers", [])
+    formato = request.args.get("format", "ndjson")
+    if formato not in FORMATOS:
+        return jsonify({"error": f"Formato no soportado: {formato}"}), 400
+    try:
+        campos = campos_solicitados(headers, request.args.get("fields"))
+        filtro = filtros_columnas(headers, request.args)
+        limite = int(request.args["limit"]) if request.args.get("limit") else None
+        if limite is not None and limite < 1:
+            raise ValueError("El parámetro limit debe ser un entero positivo")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filtro.update(filtro_tabla(table["filename"]))
+    despues = decodificar_cursor(request.args.get("after"))
+    if despues is not None and len(despues) == len(ORDEN_REGISTROS):
+        # $and evita que la condición del cursor sustituya a un $or de los filtros
+        filtro = {"$and": [filtro, condicion_keyset(ORDEN_REGISTROS, despues)]}
+
+    cursor = catalog_collection.find(
+        filtro,
+        proyeccion_registros([campo for campo in campos if campo != "Imagenes"]),
+        collation=COLACION_NUMERICA
+    ).sort(ORDEN_REGISTROS).batch_size(1000)
+
+    if formato == "json":
+        if limite is not None:
+            # Un registro de más indica si hay que devolver next_cursor
+            cursor = cursor.limit(limite + 1)
+        cuerpo, mimetype = generar_json(cursor, campos, limite), "application/json"
+    else:
+        if limite is not None:
+            cursor = cursor.limit(limite)
+        cuerpo, mimetype = generar_ndjson(cursor, campos), "application/x-ndjson"
+
+    return Response(stream_with_context(cuerpo), mimetype=mimetype)
+
 from flask import send_from_directory
 
-@app.route("/imagenes_subidas/<filename>")
+@app.route("/imagenes_subidas/<path:filename>")
 def uploaded_images(filename):
     # Verificar si se trata de una solicitud a un archivo almacenado en S3
     s3_param = request.args.get('s3')
     if s3_param == 'true':
-        # Generar una URL prefirmada para acceder al objeto en S3
-        url = get_s3_url(filename)
+        # URL prefirmada estable durante la ventana actual (ver s3_urls.py)
+        url = firmador_urls.url(filename)
         if url:
             return redirect(url)
         return "Error al acceder al archivo", 404
@@ -1083,6 +1717,20 @@ def debug_mongo():
     # Solo devolver las colecciones y el conteo para evitar respuestas extensas
     return {"colecciones": colecciones, "total_documentos": len(documentos)}
 
+@app.route("/debug_cache")
+def debug_cache():
+    """Contadores de las cachés de metadatos de tablas, filas, URLs y objetos de S3 de este proceso"""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    return {
+        "tablas": cache_tablas.estadisticas(),
+        "filas": cache_filas.estadisticas(),
+        "urls_s3": firmador_urls.estadisticas(),
+        "spool_subidas": spool_subidas.estadisticas() if spool_subidas else None,
+        "borrados_s3": cola_borrados.estadisticas() if cola_borrados else None,
+        "objetos_s3": cache_s3.estadisticas(),
+    }
+
 @app.route("/insert_test")
 def insert_test():
     nuevo_registro = {
@@ -1100,20 +1748,13 @@ def insert_test():
 # -------------------------------------------
 # ... código existente ... (mantenemos todo hasta la función renumerar_registros)
 def renumerar_registros(table_name):
-    """Renumera todos los registros de una tabla específica en orden secuencial"""
-    # Obtener todos los registros ordenados por el campo Número
-    registros = list(catalog_collection.find({"table": table_name}).sort("Número", 1))
-    
-    # Renumerar secuencialmente
-    for i, registro in enumerate(registros, 1):
-        # Solo actualizar si el número ha cambiado
-        if registro.get("Número") != i:
-            catalog_collection.update_one(
-                {"_id": registro["_id"]},
-                {"$set": {"Número": i}}
-            )
-    
-    return len(registros)
+    """Renumera todos los registros de una tabla específica en orden secuencial.
+
+    Raises:
+        TablaBloqueada: Si ya hay una renumeración en curso para la tabla
+    """
+    with bloqueo_tabla(locks_collection, table_name):
+        return renumerar_tabla(catalog_collection, counters_collection, table_name)
 
 @app.route("/renumerar/<table_name>")
 def renumerar(table_name):
@@ -1124,6 +1765,8 @@ def renumerar(table_name):
     try:
         total = renumerar_registros(table_name)
         flash(f"Se han renumerado {total} registros correctamente.", "success")
+    except TablaBloqueada:
+        flash("Ya hay una renumeración en curso para esta tabla. Inténtelo de nuevo en unos segundos.", "warning")
     except Exception as e:
         flash(f"Error al renumerar registros: {str(e)}", "error")
     
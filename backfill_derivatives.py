@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Generación de derivados para las imágenes ya existentes en S3
+
+Las imágenes subidas antes de existir los derivados (miniatura y tamaño medio)
+solo tienen el original. Este script:
+1. Busca los registros con imágenes "s3://" sin derivados (o solo los de --tabla)
+2. Descarga los originales en paralelo (a través de la caché local de S3) y genera los derivados en un pool de procesos
+3. Sube los derivados a S3, guarda sus rutas en "ImagenesDerivadas" y cambia la
+   versión de cada tabla modificada (para que las cachés de la aplicación se invaliden)
+4. Registra la operación en logs/backfill_derivatives.log
+
+Es idempotente: los registros que ya tienen derivados se omiten (salvo con --forzar).
+"""
+
+import os
+import sys
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from catalog_records import CAMPO_DERIVADOS, COLACION_NUMERICA, registrar_cambio
+from image_derivatives import enviar_a_procesar, subir_derivados
+from mongo_indexes import CATALOG_COLLECTION
+from s3_object_cache import CacheObjetosS3
+from s3_urls import clave_s3
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, "logs", "backfill_derivatives.log")
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+
+# Logger del módulo (setup_logging le añade los handlers al ejecutarlo como script)
+logger = logging.getLogger("backfill_derivatives")
+
+
+def setup_logging():
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in (logging.FileHandler(LOG_FILE), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def imagenes_pendientes(registro, forzar=False):
+    """Índices de las imágenes "s3://" de un registro que no tienen derivados"""
+    derivados = registro.get(CAMPO_DERIVADOS) or []
+    return [
+        i for i, ruta in enumerate(registro.get("Imagenes") or [])
+        if clave_s3(ruta) and (forzar or i >= len(derivados) or not derivados[i])
+    ]
+
+
+def procesar_lote(s3_client, catalog_collection, lote, forzar=False, descargas=8, cache=None, tablas=None):
+    """Genera y guarda los derivados de un lote de registros.
+
+    Args:
+        tablas: Conjunto al que se añaden las tablas de los registros actualizados (opcional)
+
+    Returns:
+        dict: Contadores {"imagenes": n, "errores": n}
+    """
+    stats = {"imagenes": 0, "errores": 0}
+    trabajos = [(registro, i) for registro in lote for i in imagenes_pendientes(registro, forzar)]
+
+    def descargar(trabajo):
+        registro, i = trabajo
+        bucket, clave = clave_s3(registro["Imagenes"][i])
+        if cache:
+            return cache.leer(bucket, clave)
+        return s3_client.get_object(Bucket=bucket, Key=clave)["Body"].read()
+
+    # Descargas en paralelo (E/S) y generación en el pool de procesos (CPU)
+    with ThreadPoolExecutor(max_workers=descargas) as hilos:
+        futuros_descarga = [hilos.submit(descargar, trabajo) for trabajo in trabajos]
+        futuros = []
+        for trabajo, futuro in zip(trabajos, futuros_descarga):
+            try:
+                futuros.append((trabajo, enviar_a_procesar(futuro.result())))
+            except Exception as e:
+                logger.error(f"No se pudo descargar {trabajo[0]['Imagenes'][trabajo[1]]}: {str(e)}")
+                stats["errores"] += 1
+
+    nuevos = {}
+    for (registro, i), futuro in futuros:
+        ruta = registro["Imagenes"][i]
+        try:
+            bucket, clave = clave_s3(ruta)
+            derivados = list(nuevos.get(registro["_id"]) or registro.get(CAMPO_DERIVADOS) or [])
+            derivados += [None] * (len(registro["Imagenes"]) - len(derivados))
+            derivados[i] = subir_derivados(s3_client, bucket, clave, futuro.result())
+            nuevos[registro["_id"]] = derivados
+            stats["imagenes"] += 1
+        except Exception as e:
+            logger.error(f"No se pudieron generar los derivados de {ruta}: {str(e)}")
+            stats["errores"] += 1
+
+    for registro in lote:
+        if registro["_id"] in nuevos:
+            # Solo si las imágenes no han cambiado mientras tanto
+            resultado = catalog_collection.update_one(
+                {"_id": registro["_id"], "Imagenes": registro["Imagenes"]},
+                {"$set": {CAMPO_DERIVADOS: nuevos[registro["_id"]]}}
+            )
+            if resultado.modified_count and tablas is not None and registro.get("table"):
+                tablas.add(registro["table"])
+    return stats
+
+
+def generar(db, s3_client, tablas=None, forzar=False, tamano_lote=20):
+    """Recorre los registros con imágenes en S3 y genera los derivados que falten.
+
+    La versión de cada tabla modificada se cambia una sola vez, al terminar.
+    """
+    catalog_collection = db[CATALOG_COLLECTION]
+    filtro = {"Imagenes": {"$regex": "^s3://"}}
+    if tablas:
+        filtro["table"] = {"$in": tablas}
+
+    stats = {"registros": 0, "imagenes": 0, "errores": 0}
+    # Los originales se leen a través de la caché en disco compartida con la aplicación
+    cache = CacheObjetosS3(s3_client)
+    modificadas = set()
+    lote = []
+    cursor = catalog_collection.find(
+        filtro, {"table": 1, "Imagenes": 1, CAMPO_DERIVADOS: 1}, collation=COLACION_NUMERICA
+    ).batch_size(500)
+    try:
+        for registro in cursor:
+            if not imagenes_pendientes(registro, forzar):
+                continue
+            lote.append(registro)
+            if len(lote) >= tamano_lote:
+                resultado = procesar_lote(s3_client, catalog_collection, lote, forzar, cache=cache, tablas=modificadas)
+                for clave, valor in resultado.items():
+                    stats[clave] += valor
+                stats["registros"] += len(lote)
+                logger.info(f"Registros procesados: {stats['registros']}")
+                lote = []
+        if lote:
+            resultado = procesar_lote(s3_client, catalog_collection, lote, forzar, cache=cache, tablas=modificadas)
+            for clave, valor in resultado.items():
+                stats[clave] += valor
+            stats["registros"] += len(lote)
+    finally:
+        # También si el recorrido se interrumpe: los registros ya actualizados no deben servirse de caché
+        for tabla in modificadas:
+            registrar_cambio(db["table_counters"], tabla)
+    return stats
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Genera los derivados de las imágenes existentes en S3")
+    parser.add_argument("--tabla", action="append", help="Nombre de fichero de una tabla a procesar (repetible)")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar también los derivados existentes")
+    parser.add_argument("--lote", type=int, default=20, help="Registros procesados en cada lote")
+    args = parser.parse_args()
+
+    try:
+        client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            region_name=os.getenv('AWS_REGION')
+        )
+        stats = generar(client[MONGO_DB], s3_client, args.tabla, args.forzar, args.lote)
+        logger.info(f"=== Generación de derivados finalizada: {stats} ===")
+    except Exception as e:
+        logger.error(f"Error general en la ejecución: {str(e)}", exc_info=True)
+        sys.exit(1)
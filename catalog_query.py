@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Filtros y ordenación del catálogo por columnas arbitrarias.
+
+Los parámetros de la query string se validan contra los encabezados de la
+tabla y se traducen a etapas $match/$sort que se ejecutan en MongoDB:
+
+    ?f.Peso[gte]=5&f.Descripción[contiene]=oro&orden=Valor&dir=desc
+
+Los valores de los registros se guardan como texto (vienen de formularios) y
+la igualdad usa la colación `numericOrdering`, de modo que "05" == "5". En los
+rangos (gt, gte, lt, lte) la colación no basta: "N/A" es mayor que "5" y
+"2.75" menor que "2.8" no se cumple. Por eso, si el valor del filtro es
+numérico, solo se compara con los valores numéricos (números y textos que se
+leen como número, convertidos en el servidor); si no lo es, solo con textos.
+
+La ordenación por columna usa la misma regla: se calcula en el servidor una
+clave tipada (un rango, números < textos < vacíos, y el valor convertido) y se
+ordena y pagina por ella, de modo que "2.75" < "2.8", "N/A" no se mezcla con
+los números y el cursor de página nunca compara valores de tipos distintos.
+"""
+
+import math
+import re
+
+from catalog_records import CAMPO_ORDEN, ORDEN_REGISTROS, campo_seguro
+
+# Prefijo de los parámetros de filtro: ?f.Descripción=Anillo o ?f.Peso[gte]=5
+PREFIJO_FILTRO = "f."
+
+# Operadores admitidos en los filtros: ?f.<encabezado>[<operador>]=valor
+OPERADORES = {
+    "eq": "$eq",
+    "ne": "$ne",
+    "gt": "$gt",
+    "gte": "$gte",
+    "lt": "$lt",
+    "lte": "$lte",
+    "contiene": "$regex",
+}
+
+DIRECCIONES = {"asc": 1, "desc": -1}
+
+# Textos que se leen como número en los rangos (admite signo y coma decimal)
+TEXTO_NUMERICO = r"^\s*[-+]?[0-9]+([.,][0-9]+)?\s*$"
+
+# Campos calculados de la clave tipada de la ordenación por columna
+CAMPO_RANGO_ORDEN = "_rango_orden"
+CAMPO_VALOR_ORDEN = "_valor_orden"
+RANGO_NUMERO, RANGO_TEXTO, RANGO_VACIO = 0, 1, 2
+
+
+def valor_numerico(valor):
+    """Devuelve el valor como número (admite coma decimal) o None si no es numérico"""
+    texto = valor.strip().replace(",", ".")
+    try:
+        return int(texto)
+    except ValueError:
+        pass
+    try:
+        numero = float(texto)
+    except ValueError:
+        return None
+    # "nan" e "inf" no son valores que se puedan comparar
+    return numero if math.isfinite(numero) else None
+
+
+def _texto_a_numero(expresion):
+    """Expresión que convierte un texto numérico (con coma decimal) en double, o null"""
+    return {"$convert": {
+        "input": {"$replaceAll": {"input": {"$trim": {"input": expresion}}, "find": ",", "replacement": "."}},
+        "to": "double", "onError": None, "onNull": None,
+    }}
+
+
+def _rango_numerico(campo, operador, numero):
+    """Condición de rango que compara un número con los valores numéricos del campo.
+
+    Los números se comparan directamente; los textos que se leen como número se
+    convierten en el servidor ($convert con coma decimal) y el resto se descarta.
+    """
+    convertido = _texto_a_numero(f"${campo}")
+    texto = {"$and": [
+        {campo: {"$type": "string", "$regex": TEXTO_NUMERICO}},
+        # $cond evita convertir valores que no son texto si el servidor evalúa $expr primero
+        {"$expr": {"$let": {
+            "vars": {"n": {"$cond": [{"$eq": [{"$type": f"${campo}"}, "string"]}, convertido, None]}},
+            "in": {"$and": [{"$ne": ["$$n", None]}, {OPERADORES[operador]: ["$$n", numero]}]},
+        }}},
+    ]}
+    return {"$or": [{campo: {"$type": "number", OPERADORES[operador]: numero}}, texto]}
+
+
+def condicion_columna(campo, operador, valor):
+    """Construye la condición de MongoDB de un filtro sobre un campo.
+
+    Args:
+        campo: Nombre (saneado) del campo
+        operador: Clave de OPERADORES
+        valor: Valor recibido en la query string
+
+    Returns:
+        dict: Condición para $match
+    """
+    if operador == "contiene":
+        return {campo: {"$regex": re.escape(valor), "$options": "i"}}
+
+    numero = valor_numerico(valor)
+    valores = [valor] if numero is None else [valor, numero]
+    if operador == "eq":
+        return {campo: {"$in": valores}}
+    if operador == "ne":
+        return {campo: {"$nin": valores}}
+    if numero is not None:
+        return _rango_numerico(campo, operador, numero)
+    return {campo: {"$type": "string", OPERADORES[operador]: valor}}
+
+
+def _parametro_filtro(nombre):
+    """Separa "f.<encabezado>[<operador>]" en (encabezado, operador)"""
+    parametro = nombre[len(PREFIJO_FILTRO):]
+    if parametro.endswith("]") and "[" in parametro:
+        header, operador = parametro[:-1].rsplit("[", 1)
+        return header, operador
+    return parametro, "eq"
+
+
+def filtros_columnas(headers, args):
+    """Traduce los parámetros `f.<encabezado>[<operador>]=valor` a un filtro de MongoDB.
+
+    Los parámetros con valor vacío se ignoran (los envía el formulario de filtros).
+
+    Args:
+        headers: Encabezados de la tabla (table_info["headers"])
+        args: Parámetros de la query string
+
+    Returns:
+        dict: Filtro para $match (vacío si no hay filtros)
+
+    Raises:
+        ValueError: Si el encabezado o el operador no son válidos
+    """
+    condiciones = []
+    for nombre, valor in args.items():
+        if not nombre.startswith(PREFIJO_FILTRO) or valor == "":
+            continue
+        header, operador = _parametro_filtro(nombre)
+        if header not in headers:
+            raise ValueError(f"No se puede filtrar por un campo desconocido: {header}")
+        if operador not in OPERADORES:
+            raise ValueError(f"Operador de filtro no válido: {operador}")
+        condiciones.append(condicion_columna(campo_seguro(header), operador, valor))
+    if len(condiciones) > 1:
+        return {"$and": condiciones}
+    return condiciones[0] if condiciones else {}
+
+
+def campo_columna(headers, orden):
+    """Campo (saneado) de la columna por la que se ordena, o None para el orden natural.
+
+    Raises:
+        ValueError: Si la columna no es válida
+    """
+    if not orden or orden == "Número":
+        return None
+    if orden not in headers:
+        raise ValueError(f"No se puede ordenar por un campo desconocido: {orden}")
+    return campo_seguro(orden)
+
+
+def etapas_orden(campo):
+    """Etapas que calculan la clave tipada de la ordenación por `campo` (ninguna si es None).
+
+    Los números y los textos que se leen como número tienen RANGO_NUMERO y su
+    valor como double; el resto de textos, RANGO_TEXTO y su valor como texto; los
+    valores vacíos o ausentes, RANGO_VACIO y null.
+    """
+    if campo is None:
+        return []
+    valor = f"${campo}"
+    es_texto = {"$eq": [{"$type": valor}, "string"]}
+    numero = {"$switch": {"branches": [
+        {"case": {"$isNumber": valor}, "then": {"$toDouble": valor}},
+        # $and no evalúa $regexMatch si el valor no es texto
+        {"case": {"$and": [es_texto, {"$regexMatch": {"input": valor, "regex": TEXTO_NUMERICO}}]},
+         "then": _texto_a_numero(valor)},
+    ], "default": None}}
+    vacio = {"$or": [
+        {"$in": [{"$type": valor}, ["missing", "null"]]},
+        {"$and": [es_texto, {"$eq": [{"$trim": {"input": valor}}, ""]}]},
+    ]}
+    return [
+        {"$addFields": {CAMPO_VALOR_ORDEN: numero}},
+        {"$addFields": {
+            CAMPO_RANGO_ORDEN: {"$switch": {"branches": [
+                {"case": {"$ne": [f"${CAMPO_VALOR_ORDEN}", None]}, "then": RANGO_NUMERO},
+                {"case": vacio, "then": RANGO_VACIO},
+            ], "default": RANGO_TEXTO}},
+            CAMPO_VALOR_ORDEN: {"$cond": [
+                {"$ne": [f"${CAMPO_VALOR_ORDEN}", None]},
+                f"${CAMPO_VALOR_ORDEN}",
+                {"$cond": [vacio, None, {"$convert": {"input": valor, "to": "string", "onError": None}}]},
+            ]},
+        }},
+    ]
+
+
+def orden_columna(headers, orden, direccion=None):
+    """Devuelve los campos de ordenación del listado para la columna pedida.
+
+    Por columna se ordena por la clave tipada de `etapas_orden` (el rango siempre
+    ascendente: los vacíos quedan al final en ambos sentidos) y el orden natural
+    (NumeroOrdenacion) se añade como desempate con la misma dirección, de modo
+    que la clave es única (necesario para los cursores de página).
+
+    Args:
+        headers: Encabezados de la tabla
+        orden: Encabezado por el que ordenar (None o "" para el orden natural)
+        direccion: "asc" (por defecto) o "desc"
+
+    Returns:
+        list: Tuplas (campo, dirección) para `obtener_pagina`
+
+    Raises:
+        ValueError: Si la columna o la dirección no son válidas
+    """
+    if direccion not in (None, "") and direccion not in DIRECCIONES:
+        raise ValueError(f"Dirección de ordenación no válida: {direccion}")
+    sentido = DIRECCIONES.get(direccion, 1)
+    if campo_columna(headers, orden) is None:
+        return [(campo, sentido) for campo, _ in ORDEN_REGISTROS]
+    return [(CAMPO_RANGO_ORDEN, 1), (CAMPO_VALOR_ORDEN, sentido), (CAMPO_ORDEN, sentido)]
+
+
+def parametros_consulta(args):
+    """Parámetros de filtro y orden de la query string, para conservarlos en los enlaces de página"""
+    return {
+        nombre: valor for nombre, valor in args.items()
+        if valor != "" and (nombre.startswith(PREFIJO_FILTRO) or nombre in ("orden", "dir"))
+    }
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+Utilidades de acceso a los registros del catálogo en MongoDB.
+
+Los registros de todas las tablas viven en la misma colección y se distinguen
+por el campo "table". El orden natural de una tabla lo da el campo persistido
+"NumeroOrdenacion" (el identificador del registro como texto) comparado con
+una colación con `numericOrdering`, de modo que "9" < "10" y "A-9" < "A-10"
+y la ordenación puede servirse desde un índice.
+"""
+
+import secrets
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Colación usada en las consultas e índices que ordenan por identificador
+COLACION_NUMERICA = {"locale": "es", "numericOrdering": True}
+
+# Campo persistido por el que se ordenan los registros de una tabla
+CAMPO_ORDEN = "NumeroOrdenacion"
+
+# Clave de ordenación de los listados (única por tabla gracias al índice único)
+ORDEN_REGISTROS = [(CAMPO_ORDEN, 1)]
+
+# Copia normalizada del identificador de las tablas cuyo primer encabezado no es
+# "Número"; su unicidad por tabla la garantiza un índice único
+CAMPO_IDENTIFICADOR = "IdentificadorTabla"
+
+# Rutas de los derivados (miniatura, tamaño medio) de cada imagen, alineadas con "Imagenes"
+CAMPO_DERIVADOS = "ImagenesDerivadas"
+
+# Suma SHA-256 y tamaño de cada imagen subida, alineados con "Imagenes" (ver s3_checksums.py)
+CAMPO_INTEGRIDAD = "ImagenesIntegridad"
+
+# Campo con el texto de los encabezados de un registro, cubierto por el índice de texto
+CAMPO_BUSQUEDA = "TextoBusqueda"
+
+# Orden de los resultados de búsqueda: relevancia descendente y _id para desempatar
+ORDEN_BUSQUEDA = [("puntuacion", -1), ("_id", 1)]
+
+# Modos de numeración de una tabla (campo "numeracion" de la colección spreadsheets):
+# - continua: cada eliminación renumera la tabla para que "Número" no tenga huecos
+# - con_huecos: los números guardados no se reescriben nunca al eliminar; la posición
+#   de cada fila se calcula al leer y la compactación es una tarea aparte (compact_tables.py)
+NUMERACION_CONTINUA = "continua"
+NUMERACION_CON_HUECOS = "con_huecos"
+MODOS_NUMERACION = (NUMERACION_CONTINUA, NUMERACION_CON_HUECOS)
+
+
+def campo_seguro(header):
+    """Nombre del campo de MongoDB en el que se guarda el valor de un encabezado"""
+    return header.replace(" ", "_").replace(".", "_")
+
+
+def proyeccion_registros(headers, *extra):
+    """Proyección con los campos de un registro que se muestran para una tabla.
+
+    Incluye los campos de los encabezados (con su nombre saneado), "Número",
+    las imágenes con sus derivados y la clave de ordenación (necesaria para los cursores de página).
+
+    Args:
+        headers: Encabezados de la tabla (table_info["headers"])
+        *extra: Campos adicionales que se quieran incluir
+
+    Returns:
+        dict: Proyección para find()/$project
+    """
+    proyeccion = {campo_seguro(header): 1 for header in headers if header}
+    for campo in ("Número", "Imagenes", CAMPO_DERIVADOS, CAMPO_ORDEN) + extra:
+        proyeccion[campo] = 1
+    return proyeccion
+
+
+def proyeccion_edicion(headers):
+    """Proyección de un registro que se edita y se vuelve a guardar entero (replace_one).
+
+    Además de los campos que se muestran incluye la integridad de las imágenes, que
+    el formulario no envía y debe conservarse para las imágenes que no cambian.
+    """
+    return proyeccion_registros(headers, CAMPO_INTEGRIDAD)
+
+
+def listas_imagenes(registro, total=3):
+    """Rutas, derivados e integridad de las imágenes de un registro, alineados.
+
+    Returns:
+        tuple: (rutas, derivados, integridad), con al menos `total` posiciones
+    """
+    rutas = list(registro.get("Imagenes") or [])
+    rutas += [None] * (total - len(rutas))
+    listas = [rutas]
+    for campo in (CAMPO_DERIVADOS, CAMPO_INTEGRIDAD):
+        lista = list(registro.get(campo) or [])
+        lista += [None] * (len(rutas) - len(lista))
+        listas.append(lista)
+    return tuple(listas)
+
+
+def clave_ordenacion(numero):
+    """Devuelve el valor que se guarda en "NumeroOrdenacion" para un identificador.
+
+    Args:
+        numero: Valor de "Número" del registro (entero o texto como "A-10")
+
+    Returns:
+        str: Identificador normalizado como texto (None si no tiene: el registro
+        queda fuera del índice único parcial {table, NumeroOrdenacion})
+    """
+    if numero is None:
+        return None
+    return str(numero).strip() or None
+
+
+def clave_identificador(headers, registro):
+    """Valor de "IdentificadorTabla" de un registro.
+
+    Args:
+        headers: Encabezados de la tabla; el primero es el identificador
+        registro: Registro con los campos de los encabezados (nombres saneados)
+
+    Returns:
+        str: Identificador normalizado, o None si la tabla se identifica por "Número"
+        (ya lo cubre el índice único {table, NumeroOrdenacion}) o no tiene valor
+    """
+    if not headers or headers[0] == "Número":
+        return None
+    return clave_ordenacion(registro.get(campo_seguro(headers[0])))
+
+
+def filtro_tabla(tabla, orden=None):
+    """Filtro de los registros de una tabla con identificador.
+
+    El índice único {table, NumeroOrdenacion} es parcial (solo cubre los registros
+    cuyo "NumeroOrdenacion" es texto) y MongoDB solo lo usa en las consultas que
+    incluyen esa misma condición.
+
+    Args:
+        tabla: Nombre de fichero de la tabla
+        orden: Condiciones adicionales sobre "NumeroOrdenacion" (p. ej. {"$lt": "10"})
+
+    Returns:
+        dict: Filtro de MongoDB
+    """
+    return {"table": tabla, CAMPO_ORDEN: {"$type": "string", **(orden or {})}}
+
+
+def modo_numeracion(table_info):
+    """Devuelve el modo de numeración de una tabla (por defecto, continua)"""
+    modo = (table_info or {}).get("numeracion")
+    return modo if modo in MODOS_NUMERACION else NUMERACION_CONTINUA
+
+
+def posicion_inicial(registros, tabla, primer_registro):
+    """Calcula la posición (desde 1) del primer registro de una página en el orden natural.
+
+    Es un conteo sobre el índice {table, NumeroOrdenacion}, sin leer los documentos.
+
+    Args:
+        registros: Colección de registros del catálogo
+        tabla: Nombre de fichero de la tabla
+        primer_registro: Primer registro de la página (o None si está vacía)
+
+    Returns:
+        int: Posición del primer registro de la página
+    """
+    if not primer_registro:
+        return 1
+    anteriores = registros.count_documents(
+        filtro_tabla(tabla, {"$lt": primer_registro.get(CAMPO_ORDEN, "")}),
+        collation=COLACION_NUMERICA
+    )
+    return anteriores + 1
+
+
+def mayor_numero(registros, tabla):
+    """Mayor "Número" numérico de los registros de una tabla (0 si no hay ninguno)"""
+    maximo = next(registros.aggregate([
+        {"$match": {"table": tabla, "Número": {"$type": "number"}}},
+        {"$group": {"_id": None, "maximo": {"$max": "$Número"}}}
+    ], collation=COLACION_NUMERICA), {}).get("maximo", 0)
+    return int(maximo)
+
+
+def siguiente_numero(contadores, registros, tabla, cantidad=1):
+    """Reserva de forma atómica el siguiente "Número" (o los `cantidad` siguientes) de una tabla.
+
+    El contador de cada tabla es un documento {_id: <tabla>, seq: <último número>}
+    que se incrementa con find_one_and_update, de modo que dos inserciones
+    concurrentes nunca obtienen el mismo número. La primera vez que se usa el
+    contador de una tabla existente se inicializa con el mayor "Número" numérico
+    de sus registros.
+
+    Args:
+        contadores: Colección de contadores por tabla
+        registros: Colección de registros del catálogo
+        tabla: Nombre de fichero de la tabla (campo "table" de los registros)
+        cantidad: Números consecutivos a reservar
+
+    Returns:
+        int: Número reservado para el nuevo registro (el último, si se reservan varios)
+    """
+    # El documento del contador puede existir solo con la versión de la tabla (sin "seq")
+    contador = contadores.find_one_and_update(
+        {"_id": tabla, "seq": {"$exists": True}}, {"$inc": {"seq": cantidad}}, return_document=ReturnDocument.AFTER
+    )
+    if contador is None:
+        # $max es idempotente: varias inicializaciones concurrentes dejan el mismo valor
+        contadores.update_one({"_id": tabla}, {"$max": {"seq": mayor_numero(registros, tabla)}}, upsert=True)
+        contador = contadores.find_one_and_update(
+            {"_id": tabla}, {"$inc": {"seq": cantidad}}, return_document=ReturnDocument.AFTER
+        )
+    return contador["seq"]
+
+
+# -------------------------------------------
+# VERSIÓN DE LAS TABLAS
+# -------------------------------------------
+# Actualización que registra un cambio en los registros de una tabla. La versión
+# y la fecha de modificación se guardan en el documento del contador de la tabla.
+CAMBIO_TABLA = {"$inc": {"version": 1}, "$currentDate": {"modificado": True}}
+
+
+def registrar_cambio(contadores, tabla):
+    """Incrementa la versión de una tabla tras insertar, editar, eliminar o renumerar registros"""
+    contadores.update_one({"_id": tabla}, CAMBIO_TABLA, upsert=True)
+
+
+def version_tabla(contadores, tabla):
+    """Devuelve la versión de una tabla y la fecha de su último cambio.
+
+    Es una lectura por _id de la colección de contadores, sin consultar los registros.
+
+    Returns:
+        tuple: (versión, fecha de modificación o None si la tabla no ha cambiado nunca)
+    """
+    contador = contadores.find_one({"_id": tabla}, {"version": 1, "modificado": 1}) or {}
+    return contador.get("version", 0), contador.get("modificado")
+
+
+# -------------------------------------------
+# BLOQUEOS POR TABLA
+# -------------------------------------------
+class TablaBloqueada(Exception):
+    """La tabla está bloqueada por otra operación en curso"""
+
+
+@contextmanager
+def bloqueo_tabla(bloqueos, tabla, operacion="renumerar", duracion=300):
+    """Bloqueo exclusivo de una operación sobre una tabla, compartido entre procesos.
+
+    El bloqueo es un documento {_id: "<operacion>:<tabla>"} con fecha de caducidad,
+    para que un proceso que muera sin liberarlo no bloquee la tabla para siempre.
+
+    Args:
+        bloqueos: Colección de bloqueos
+        tabla: Nombre de fichero de la tabla
+        operacion: Nombre de la operación protegida
+        duracion: Segundos tras los que el bloqueo caduca
+
+    Raises:
+        TablaBloqueada: Si otro proceso tiene el bloqueo vigente
+    """
+    clave = f"{operacion}:{tabla}"
+    token = secrets.token_hex(8)
+    ahora = datetime.utcnow()
+    try:
+        # Solo se adquiere si no existe o si el anterior ha caducado; en otro caso
+        # el upsert intenta insertar el mismo _id y falla por clave duplicada
+        bloqueos.update_one(
+            {"_id": clave, "expira": {"$lt": ahora}},
+            {"$set": {"token": token, "expira": ahora + timedelta(seconds=duracion)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        raise TablaBloqueada(f"La operación '{operacion}' ya está en curso para la tabla {tabla}")
+    try:
+        yield
+    finally:
+        bloqueos.delete_one({"_id": clave, "token": token})
+
+
+# -------------------------------------------
+# RENUMERACIÓN
+# -------------------------------------------
+def renumerar_tabla(registros, contadores, tabla):
+    """Renumera los registros de una tabla (1..N en su orden natural) en el servidor.
+
+    El cálculo de los nuevos números se hace con $setWindowFields y los cambios
+    se escriben con $merge, de modo que el coste en viajes de ida y vuelta es
+    constante sea cual sea el tamaño de la tabla:
+
+    1. Se calcula el nuevo número de los registros que cambian y se guarda en
+       una colección temporal
+    2. Se escribe el nuevo "Número" con un "NumeroOrdenacion" provisional y único
+       (así el índice único no ve colisiones transitorias entre registros)
+    3. Se escribe el "NumeroOrdenacion" definitivo
+
+    Los bloqueos entre renumeraciones concurrentes son responsabilidad del
+    llamante (ver `bloqueo_tabla`). Las inserciones no toman el bloqueo: si una
+    reserva un número durante la renumeración, el contador no se rebaja (quedan
+    huecos, pero ningún número reservado se vuelve a entregar). Requiere MongoDB
+    5.0 o superior.
+
+    Args:
+        registros: Colección de registros del catálogo
+        contadores: Colección de contadores por tabla
+        tabla: Nombre de fichero de la tabla
+
+    Returns:
+        int: Número total de registros de la tabla
+    """
+    db = registros.database
+    token = secrets.token_hex(8)
+    temporal = db[f"renumeracion_{token}"]
+    inicial = (contadores.find_one({"_id": tabla}, {"seq": 1}) or {}).get("seq")
+
+    try:
+        registros.aggregate([
+            {"$match": {"table": tabla}},
+            {"$setWindowFields": {
+                "sortBy": {CAMPO_ORDEN: 1},
+                "output": {"nuevo": {"$documentNumber": {}}}
+            }},
+            {"$match": {"$expr": {"$ne": ["$Número", "$nuevo"]}}},
+            {"$project": {"_id": 1, "nuevo": 1}},
+            {"$merge": {"into": temporal.name}}
+        ], collation=COLACION_NUMERICA, allowDiskUse=True)
+
+        destino = {"into": registros.name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}
+        temporal.aggregate([
+            {"$project": {
+                "Número": "$nuevo",
+                CAMPO_ORDEN: {"$concat": [token, ":", {"$toString": "$nuevo"}]}
+            }},
+            {"$merge": destino}
+        ])
+        temporal.aggregate([
+            {"$project": {CAMPO_ORDEN: {"$toString": "$nuevo"}}},
+            {"$merge": destino}
+        ])
+    finally:
+        temporal.drop()
+
+    total = registros.count_documents({"table": tabla}, collation=COLACION_NUMERICA)
+    registrar_cambio(contadores, tabla)
+    # El contador continúa a partir del mayor número asignado, pero solo si ninguna
+    # inserción ha reservado otro número mientras tanto ({"seq": None} también
+    # coincide si el contador aún no existía)
+    contadores.update_one({"_id": tabla, "seq": inicial}, {"$set": {"seq": mayor_numero(registros, tabla)}})
+    return total
+
+
+# -------------------------------------------
+# BÚSQUEDA DE TEXTO
+# -------------------------------------------
+def campos_texto(headers):
+    """Encabezados cuyo valor se indexa para la búsqueda de texto ("Número" e imágenes no)"""
+    return [header for header in headers if header and header != "Número" and header.lower() != "imagenes"]
+
+
+def texto_busqueda(registro, headers):
+    """Devuelve el valor de "TextoBusqueda" de un registro: sus campos de texto unidos por espacios.
+
+    Como los encabezados de cada tabla son distintos y MongoDB admite un único
+    índice de texto por colección, el índice cubre este campo calculado al escribir.
+
+    Args:
+        registro: Registro con los campos de los encabezados (nombres saneados)
+        headers: Encabezados de la tabla
+
+    Returns:
+        str: Texto a indexar
+    """
+    valores = (registro.get(campo_seguro(header)) for header in campos_texto(headers))
+    return " ".join(str(valor).strip() for valor in valores if valor not in (None, ""))
+
+
+def expresion_texto_busqueda(headers):
+    """Expresión de agregación equivalente a `texto_busqueda`, para rellenar el campo en el servidor"""
+    partes = [
+        {"$trim": {"input": {"$toString": {"$ifNull": [f"${campo_seguro(header)}", ""]}}}}
+        for header in campos_texto(headers)
+    ]
+    if not partes:
+        return ""
+    # Se unen con espacios las partes no vacías
+    return {"$reduce": {
+        "input": {"$filter": {"input": partes, "cond": {"$ne": ["$$this", ""]}}},
+        "initialValue": "",
+        "in": {"$concat": ["$$value", {"$cond": [{"$eq": ["$$value", ""]}, "", " "]}, "$$this"]},
+    }}
+
+
+def etapas_busqueda(texto, tablas, coleccion):
+    """Etapas iniciales del pipeline de búsqueda de texto en una o varias tablas.
+
+    Los resultados llevan su relevancia en "puntuacion" para ordenarlos y
+    paginarlos por cursor con ORDEN_BUSQUEDA.
+
+    El índice de texto empieza por "table" y MongoDB solo lo usa con una
+    igualdad sobre ese prefijo (rechaza $in), así que cada tabla es una
+    búsqueda propia y las demás se añaden con $unionWith. La relevancia no
+    depende del resto de documentos, por lo que se puede comparar entre tablas.
+
+    Args:
+        texto: Texto buscado (sintaxis de $text: palabras, "frases" y -exclusiones)
+        tablas: Nombres de fichero de las tablas en las que buscar
+        coleccion: Nombre de la colección del catálogo (para $unionWith)
+
+    Returns:
+        list: Etapas para `obtener_pagina`
+    """
+    def busqueda(tabla):
+        return [
+            {"$match": {"table": tabla, "$text": {"$search": texto}}},
+            {"$addFields": {"puntuacion": {"$meta": "textScore"}}},
+        ]
+
+    primera, *resto = tablas
+    return busqueda(primera) + [
+        {"$unionWith": {"coll": coleccion, "pipeline": busqueda(tabla)}} for tabla in resto
+    ]
@@ -6,8 +6,10 @@ Script de limpieza periódica de imágenes no utilizadas
 
 Este script:
 1. Se conecta a MongoDB
-2. Verifica qué imágenes locales en 'imagenes_subidas' no están siendo referenciadas
-3. Mueve las imágenes no utilizadas a 'unused_images' o las elimina según configuración
+2. Consulta en el registro de imágenes las que llevan un tiempo sin referencias
+   (sin recorrer el catálogo; ver image_store.py y migrate_image_registry.py)
+3. Mueve las imágenes locales no utilizadas a 'unused_images' o las elimina según
+   configuración, y encola en la cola de borrados de S3 los objetos no utilizados
 4. Registra toda la operación en un archivo de log específico
 5. Envía un correo con el resumen si se configuró para ello
 """
@@ -26,6 +28,11 @@ from pymongo.server_api import ServerApi
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 
+from image_derivatives import VARIANTES, clave_derivado
+from image_store import MARGEN_RECOGIDA, sin_referencias, retirar_sin_referencias
+from mongo_indexes import IMAGES_COLLECTION, S3_DELETIONS_COLLECTION
+from s3_deletion_queue import ColaBorrados
+
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
@@ -53,6 +60,9 @@ class Config:
     # Modo: 'move' para mover archivos, 'delete' para eliminarlos directamente
     CLEANUP_MODE = os.getenv("CLEANUP_MODE", "move")
     
+    # Segundos sin referencias antes de recoger una imagen
+    GC_GRACE = MARGEN_RECOGIDA
+    
     # Configuración de correo
     SEND_EMAIL = os.getenv("SEND_EMAIL", "False").lower() == "true"
     EMAIL_FROM = os.getenv("EMAIL_FROM", "")
@@ -117,108 +127,58 @@ def connect_to_mongodb():
         logger.error(f"Error al conectar a MongoDB: {str(e)}")
         sys.exit(1)
 
-# Obtener todas las imágenes referenciadas en MongoDB
-def get_referenced_images(db):
-    referenced_images = set()
-    total_documents = 0
-    documents_with_images = 0
-    
-    logger.info("Buscando imágenes referenciadas en la base de datos...")
-    
-    # Colección principal de catálogo (específica para esta aplicación)
-    catalog_collection_name = '67b8c24a7fdc72dd4d8703cf'
-    
-    # Iterar por todas las colecciones, pero priorizar la colección de catálogo
-    for collection_name in db.list_collection_names():
-        collection = db[collection_name]
-        
-        # Información adicional para la colección de catálogo
-        if collection_name == catalog_collection_name:
-            logger.info(f"Procesando colección principal de catálogo: {collection_name}")
-        
-        # Contar documentos en la colección
-        collection_count = collection.count_documents({})
-        total_documents += collection_count
-        
-        # Buscar documentos con imágenes
-        # Buscar documentos con imágenes
-        for doc in collection.find({}, {"Imagenes": 1}):
-            if "Imagenes" in doc and doc["Imagenes"]:
-                documents_with_images += 1
-                
-                if collection_name == catalog_collection_name:
-                    logger.debug(f"Encontrado documento con imágenes en catálogo: {doc['_id']}")
-                # Procesar cada imagen
-                for img_path in doc["Imagenes"]:
-                    # Ignorar valores None o imágenes en S3
-                    if img_path is None:
-                        continue
-                    if img_path.startswith("s3://"):
-                        continue
-                    
-                    # Extraer solo el nombre del archivo
-                    if "/" in img_path:
-                        img_name = img_path.split("/")[-1]
-                    else:
-                        img_name = img_path
-                    
-                    referenced_images.add(img_name)
-    
-    logger.info(f"Total de documentos analizados: {total_documents}")
-    logger.info(f"Documentos con imágenes: {documents_with_images}")
-    logger.info(f"Imágenes locales referenciadas: {len(referenced_images)}")
-    
-    return referenced_images
+# Recoger las imágenes sin referencias del registro de imágenes
+def collect_unreferenced_images(db):
+    """Retira del registro las imágenes sin referencias y borra sus archivos u objetos.
 
-# Obtener todas las imágenes existentes en el directorio local
-def get_local_images():
-    local_images = set()
-    
-    # Verificar que el directorio de imágenes exista
-    if not os.path.exists(Config.UPLOAD_FOLDER):
-        logger.warning(f"El directorio {Config.UPLOAD_FOLDER} no existe. Creándolo...")
-        os.makedirs(Config.UPLOAD_FOLDER)
-        return local_images
-    
-    # Listar todos los archivos en el directorio
-    for filename in os.listdir(Config.UPLOAD_FOLDER):
-        if os.path.isfile(os.path.join(Config.UPLOAD_FOLDER, filename)):
-            local_images.add(filename)
-    
-    logger.info(f"Total de archivos encontrados en {Config.UPLOAD_FOLDER}: {len(local_images)}")
-    return local_images
+    No recorre el catálogo: el registro (image_store.py) lleva la cuenta de los
+    registros que usan cada imagen y esto es una consulta indexada de las que
+    llevan más de IMAGE_GC_GRACE segundos sin ninguna.
 
-# Limpiar imágenes no utilizadas
-def clean_unused_images(referenced_images, local_images):
-    if not local_images:
-        logger.info("No hay imágenes locales para procesar.")
-        return {"moved": 0, "deleted": 0, "errors": 0, "details": []}
-    
-    # Preparar directorio para imágenes no utilizadas si el modo es 'move'
-    if Config.CLEANUP_MODE == "move" and not os.path.exists(Config.UNUSED_IMAGES_FOLDER):
-        os.makedirs(Config.UNUSED_IMAGES_FOLDER)
-        logger.info(f"Directorio creado: {Config.UNUSED_IMAGES_FOLDER}")
-    
-    # Identificar imágenes no utilizadas
-    unused_images = local_images - referenced_images
-    logger.info(f"Imágenes no utilizadas: {len(unused_images)}")
-    
-    # Verificación adicional para estadísticas
-    unused_count = max(0, len(local_images) - len(referenced_images))
-    
-    # Estadísticas
+    Las imágenes locales se mueven a 'unused_images' o se eliminan según
+    CLEANUP_MODE; las de S3 (original y derivados) pasan a la cola de borrados.
+    """
     stats = {
+        "candidates": 0,
         "moved": 0,
         "deleted": 0,
+        "queued": 0,
         "errors": 0,
         "details": []
     }
-    
-    # Procesar cada imagen no utilizada
-    for img_name in unused_images:
-        src_path = os.path.join(Config.UPLOAD_FOLDER, img_name)
-        
+
+    imagenes = db[IMAGES_COLLECTION]
+    cola = ColaBorrados(db[S3_DELETIONS_COLLECTION])
+
+    # Preparar directorio para imágenes no utilizadas si el modo es 'move'
+    if Config.CLEANUP_MODE == "move" and not os.path.exists(Config.UNUSED_IMAGES_FOLDER):
+        os.makedirs(Config.UNUSED_IMAGES_FOLDER)
+        logger.info(f"Directorio creado: {Config.UNUSED_IMAGES_FOLDER}")
+
+    logger.info("Buscando imágenes sin referencias en el registro de imágenes...")
+    for entrada in sin_referencias(imagenes, Config.GC_GRACE):
+        stats["candidates"] += 1
+        # Si alguien ha vuelto a usar la imagen desde la consulta, no se retira
+        if not retirar_sin_referencias(imagenes, entrada):
+            continue
+
         try:
+            if entrada.get("ubicacion") == "s3":
+                clave = entrada["_id"]
+                claves = [clave] + [clave_derivado(clave, variante) for variante in VARIANTES]
+                # El trabajador de la cola no las borra si la imagen vuelve al registro entretanto
+                # (otra subida del mismo contenido entre la retirada y el borrado)
+                cola.encolar(entrada["bucket"], claves, imagen=clave)
+                logger.info(f"Objeto de S3 encolado para borrar: {clave}")
+                stats["queued"] += 1
+                stats["details"].append(f"Encolada (S3): {clave}")
+                continue
+
+            img_name = os.path.basename(entrada["_id"])
+            src_path = os.path.join(Config.UPLOAD_FOLDER, img_name)
+            if not os.path.exists(src_path):
+                continue
+
             # Modo 'move': mover a directorio de imágenes no utilizadas
             if Config.CLEANUP_MODE == "move":
                 dst_path = os.path.join(Config.UNUSED_IMAGES_FOLDER, img_name)
@@ -226,24 +186,25 @@ def clean_unused_images(referenced_images, local_images):
                 logger.info(f"Imagen movida: {img_name}")
                 stats["moved"] += 1
                 stats["details"].append(f"Movida: {img_name}")
-            
+
             # Modo 'delete': eliminar directamente
             elif Config.CLEANUP_MODE == "delete":
                 os.remove(src_path)
                 logger.info(f"Imagen eliminada: {img_name}")
                 stats["deleted"] += 1
                 stats["details"].append(f"Eliminada: {img_name}")
-        
+
         except Exception as e:
-            error_msg = f"Error al procesar {img_name}: {str(e)}"
+            error_msg = f"Error al procesar {entrada['_id']}: {str(e)}"
             logger.error(error_msg)
             stats["errors"] += 1
             stats["details"].append(error_msg)
-    
+
+    logger.info(f"Imágenes sin referencias: {stats['candidates']}")
     return stats
 
 # Enviar correo con el resumen
-def send_email_summary(stats, referenced_images, local_images):
+def send_email_summary(stats):
     if not Config.SEND_EMAIL:
         logger.info("Envío de correo desactivado.")
         return
@@ -277,15 +238,15 @@ def send_email_summary(stats, referenced_images, local_images):
             <h2>Reporte de limpieza de imágenes</h2>
             
             <div class="stats">
-                <p><strong>Imágenes referenciadas:</strong> {len(referenced_images)}</p>
-                <p><strong>Imágenes locales encontradas:</strong> {len(local_images)}</p>
-                <p><strong>Imágenes no utilizadas:</strong> {len(local_images) - len(referenced_images)}</p>
+                <p><strong>Imágenes sin referencias:</strong> {stats['candidates']}</p>
+                <p><strong>Margen de seguridad:</strong> {Config.GC_GRACE} segundos</p>
             </div>
             
             <div class="stats">
                 <p><strong>Modo de limpieza:</strong> {Config.CLEANUP_MODE}</p>
                 <p class="success"><strong>Imágenes movidas:</strong> {stats['moved']}</p>
                 <p class="warning"><strong>Imágenes eliminadas:</strong> {stats['deleted']}</p>
+                <p class="warning"><strong>Objetos de S3 encolados para borrar:</strong> {stats['queued']}</p>
                 <p class="error"><strong>Errores:</strong> {stats['errors']}</p>
             </div>
             
@@ -328,26 +289,19 @@ def main():
     # Conectar a MongoDB
     db = connect_to_mongodb()
     
-    # Obtener imágenes referenciadas
-    referenced_images = get_referenced_images(db)
-    
-    # Obtener imágenes locales
-    local_images = get_local_images()
-    
-    # Limpiar imágenes no utilizadas
-    stats = clean_unused_images(referenced_images, local_images)
+    # Recoger las imágenes sin referencias
+    stats = collect_unreferenced_images(db)
     
     # Resumen final
     logger.info("=== Resumen de la operación ===")
-    logger.info(f"Imágenes referenciadas: {len(referenced_images)}")
-    logger.info(f"Imágenes locales: {len(local_images)}")
-    logger.info(f"Imágenes no utilizadas: {max(0, len(local_images) - len(referenced_images))}")
+    logger.info(f"Imágenes sin referencias: {stats['candidates']}")
     logger.info(f"Imágenes movidas: {stats['moved']}")
     logger.info(f"Imágenes eliminadas: {stats['deleted']}")
+    logger.info(f"Objetos de S3 encolados para borrar: {stats['queued']}")
     logger.info(f"Errores: {stats['errors']}")
     
     # Enviar correo con el resumen
-    send_email_summary(stats, referenced_images, local_images)
+    send_email_summary(stats)
     
     logger.info("=== Proceso de limpieza finalizado ===")
 
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compactación periódica de la numeración de las tablas
+
+Las tablas en modo de numeración "con huecos" no se renumeran al eliminar
+registros. Este script, pensado para ejecutarse como tarea programada:
+1. Busca las tablas con numeración con huecos (o la indicada con --tabla)
+2. Renumera en el servidor las que tienen huecos, bajo el mismo bloqueo por
+   tabla que usa la aplicación
+3. Registra la operación en logs/compact_tables.log
+"""
+
+import os
+import sys
+import logging
+import argparse
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from catalog_records import COLACION_NUMERICA, NUMERACION_CON_HUECOS, TablaBloqueada, bloqueo_tabla, renumerar_tabla
+from mongo_indexes import CATALOG_COLLECTION, SPREADSHEETS_COLLECTION
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, "logs", "compact_tables.log")
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+
+# Logger del módulo (setup_logging le añade los handlers al ejecutarlo como script)
+logger = logging.getLogger("compact_tables")
+
+
+def setup_logging():
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in (logging.FileHandler(LOG_FILE), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def tiene_huecos(catalog_collection, counters_collection, tabla):
+    """Indica si la numeración de la tabla tiene huecos.
+
+    Compara el número de registros con el último número asignado por el
+    contador de la tabla; ambos datos se obtienen sin leer los registros.
+    """
+    contador = counters_collection.find_one({"_id": tabla}) or {}
+    return contador.get("seq", 0) != catalog_collection.count_documents({"table": tabla}, collation=COLACION_NUMERICA)
+
+
+def compactar(db, tablas=None):
+    """Renumera las tablas con numeración con huecos que lo necesiten"""
+    catalog_collection = db[CATALOG_COLLECTION]
+    counters_collection = db["table_counters"]
+    locks_collection = db["table_locks"]
+
+    filtro = {"filename": {"$in": tablas}} if tablas else {"numeracion": NUMERACION_CON_HUECOS}
+    stats = {"compactadas": 0, "sin_cambios": 0, "bloqueadas": 0}
+
+    for tabla in db[SPREADSHEETS_COLLECTION].find(filtro, {"filename": 1}):
+        nombre = tabla["filename"]
+        if not tablas and not tiene_huecos(catalog_collection, counters_collection, nombre):
+            stats["sin_cambios"] += 1
+            continue
+        try:
+            with bloqueo_tabla(locks_collection, nombre):
+                total = renumerar_tabla(catalog_collection, counters_collection, nombre)
+            logger.info(f"Tabla compactada: {nombre} ({total} registros)")
+            stats["compactadas"] += 1
+        except TablaBloqueada:
+            logger.warning(f"Tabla omitida, hay otra renumeración en curso: {nombre}")
+            stats["bloqueadas"] += 1
+
+    return stats
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Compacta la numeración de las tablas con huecos")
+    parser.add_argument("--tabla", action="append", help="Nombre de fichero de una tabla a compactar (repetible)")
+    args = parser.parse_args()
+
+    try:
+        client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+        stats = compactar(client[MONGO_DB], args.tabla)
+        logger.info(f"=== Compactación finalizada: {stats} ===")
+    except Exception as e:
+        logger.error(f"Error general en la ejecución: {str(e)}", exc_info=True)
+        sys.exit(1)
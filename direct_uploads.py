@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Subida de imágenes directamente desde el navegador a S3 (POST prefirmado).
+
+En lugar de enviar los bytes de las imágenes al servidor Flask, el navegador
+pide una política de POST prefirmada (/api/uploads/presign), sube el archivo
+al bucket con ella y envía en el formulario solo un token firmado con la clave
+del objeto. La política limita el tipo de contenido y el tamaño, y al guardar
+el registro la aplicación comprueba el token (emitido para ese usuario) y que
+el objeto existe en S3 con un tipo y tamaño válidos. Si el navegador envía el
+SHA-256 del archivo, la política lo exige y S3 rechaza un contenido distinto.
+"""
+
+import mimetypes
+import os
+
+from botocore.exceptions import ClientError
+from itsdangerous import BadSignature
+
+TAMANO_MAXIMO_SUBIDA = int(os.getenv("S3_DIRECT_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Segundos de validez de la política de POST
+CADUCIDAD_POLITICA = int(os.getenv("S3_DIRECT_UPLOAD_EXPIRES", "600"))
+# Segundos de validez del token que se envía con el formulario
+VALIDEZ_TOKEN = int(os.getenv("S3_DIRECT_UPLOAD_TOKEN_AGE", "86400"))
+
+SAL_TOKEN = "subida-directa"
+
+
+def tipo_contenido(filename):
+    """Tipo MIME de imagen correspondiente a un nombre de archivo, o None si no es una imagen"""
+    tipo, _ = mimetypes.guess_type(filename or "")
+    return tipo if tipo and tipo.startswith("image/") else None
+
+
+def politica_subida(cliente, bucket, clave, tipo, maximo=TAMANO_MAXIMO_SUBIDA, caducidad=CADUCIDAD_POLITICA,
+                    suma=None):
+    """Genera la política de POST prefirmada para subir un objeto al bucket.
+
+    Args:
+        cliente: Cliente de boto3 para S3
+        bucket: Bucket de destino
+        clave: Clave del objeto (fijada por el servidor)
+        tipo: Content-Type que debe enviar el navegador
+        maximo: Tamaño máximo del archivo en bytes
+        caducidad: Segundos de validez de la política
+        suma: SHA-256 del archivo en base64 calculado por el navegador (opcional)
+
+    Returns:
+        dict: {"url": ..., "fields": {...}} para construir el formulario de subida
+    """
+    campos = {"Content-Type": tipo}
+    if suma:
+        campos.update({"x-amz-checksum-algorithm": "SHA256", "x-amz-checksum-sha256": suma})
+    condiciones = [{campo: valor} for campo, valor in campos.items()]
+    return cliente.generate_presigned_post(
+        Bucket=bucket,
+        Key=clave,
+        Fields=campos,
+        Conditions=condiciones + [["content-length-range", 1, maximo]],
+        ExpiresIn=caducidad,
+    )
+
+
+def token_subida(serializador, clave, usuario):
+    """Token firmado que identifica un objeto subido por un usuario"""
+    return serializador.dumps({"clave": clave, "usuario": usuario}, salt=SAL_TOKEN)
+
+
+def clave_de_token(serializador, token, usuario, validez=VALIDEZ_TOKEN):
+    """Devuelve la clave de S3 de un token de subida.
+
+    Raises:
+        ValueError: Si el token no es válido, ha caducado o es de otro usuario
+    """
+    try:
+        datos = serializador.loads(token, salt=SAL_TOKEN, max_age=validez)
+    except BadSignature:
+        raise ValueError("Token de subida no válido o caducado")
+    if datos.get("usuario") != usuario:
+        raise ValueError("El token de subida pertenece a otro usuario")
+    return datos["clave"]
+
+
+def verificar_objeto(cliente, bucket, clave, maximo=TAMANO_MAXIMO_SUBIDA):
+    """Comprueba que un objeto subido por el navegador existe y es una imagen válida.
+
+    Returns:
+        dict: Respuesta de head_object
+
+    Raises:
+        ValueError: Si el objeto no existe, no es una imagen o supera el tamaño máximo
+    """
+    try:
+        cabecera = cliente.head_object(Bucket=bucket, Key=clave, ChecksumMode="ENABLED")
+    except ClientError:
+        raise ValueError(f"La imagen {clave} no se encuentra en S3")
+    if not (cabecera.get("ContentType") or "").startswith("image/"):
+        raise ValueError(f"El objeto {clave} no es una imagen")
+    if not 0 < cabecera.get("ContentLength", 0) <= maximo:
+        raise ValueError(f"La imagen {clave} no tiene un tamaño válido")
+    return cabecera
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Derivados de las imágenes del catálogo (miniatura y tamaño medio).
+
+Las fotos originales (a menudo varios MB desde un móvil) no se muestran en los
+listados: al subirlas se generan versiones reducidas en JPEG, con la orientación
+EXIF aplicada y sin metadatos, que se guardan en S3 bajo un prefijo propio:
+
+    s3://<bucket>/derivados/thumb/<clave sin extensión>.jpg
+    s3://<bucket>/derivados/medium/<clave sin extensión>.jpg
+
+La decodificación y el redimensionado se hacen en un pool de procesos para no
+ocupar la CPU del proceso web mientras se sube el original. Las rutas de los
+derivados se guardan en el registro, en "ImagenesDerivadas", alineadas con
+"Imagenes" (una entrada {"thumb": ..., "medium": ...} o None por imagen).
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from catalog_records import CAMPO_DERIVADOS
+
+# Variantes generadas: nombre -> lado mayor en píxeles
+VARIANTES = {
+    "thumb": int(os.getenv("IMAGE_THUMB_SIZE", "320")),
+    "medium": int(os.getenv("IMAGE_MEDIUM_SIZE", "1280")),
+}
+CALIDAD_JPEG = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+PREFIJO_DERIVADOS = os.getenv("S3_DERIVATIVES_PREFIX", "derivados").strip("/")
+TRABAJADORES_IMAGENES = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Los derivados nunca cambian (la clave del original es única)
+CACHE_CONTROL_DERIVADOS = "public, max-age=31536000, immutable"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def clave_derivado(clave, variante):
+    """Clave de S3 del derivado de un objeto original"""
+    return f"{PREFIJO_DERIVADOS}/{variante}/{os.path.splitext(clave)[0]}.jpg"
+
+
+def generar_derivados(datos, variantes=None):
+    """Genera los derivados JPEG de una imagen.
+
+    Se ejecuta en los procesos del pool, por lo que solo recibe y devuelve bytes.
+
+    Args:
+        datos: Contenido de la imagen original
+        variantes: Dict nombre -> lado mayor (por defecto, VARIANTES)
+
+    Returns:
+        dict: nombre de la variante -> bytes del JPEG
+    """
+    variantes = variantes or VARIANTES
+    with Image.open(io.BytesIO(datos)) as imagen:
+        # En JPEG, draft() decodifica directamente a una escala reducida (mucho más rápido)
+        imagen.draft("RGB", (max(variantes.values()),) * 2)
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode != "RGB":
+            fondo = Image.new("RGB", imagen.size, (255, 255, 255))
+            if imagen.mode in ("RGBA", "LA", "P"):
+                imagen = imagen.convert("RGBA")
+                fondo.paste(imagen, mask=imagen.getchannel("A"))
+            else:
+                fondo.paste(imagen.convert("RGB"))
+            imagen = fondo
+
+        derivados = {}
+        # De mayor a menor, para reducir cada variante a partir de la anterior
+        for nombre, lado in sorted(variantes.items(), key=lambda v: -v[1]):
+            imagen = imagen.copy()
+            imagen.thumbnail((lado, lado), Image.LANCZOS)
+            salida = io.BytesIO()
+            # Sin exif=...: el JPEG resultante no lleva metadatos
+            imagen.save(salida, "JPEG", quality=CALIDAD_JPEG, optimize=True, progressive=True)
+            derivados[nombre] = salida.getvalue()
+    return derivados
+
+
+def pool_imagenes():
+    """Pool de procesos compartido para generar derivados (se crea al primer uso).
+
+    Se crea desde hilos del proceso web (con locks de MongoDB, boto3 o logging
+    tomados por otros hilos), así que los procesos no se crean con fork, que
+    copiaría esos locks bloqueados: se usa forkserver, o spawn donde no existe.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(
+                max_workers=TRABAJADORES_IMAGENES, mp_context=multiprocessing.get_context(metodo)
+            )
+        return _pool
+
+
+def enviar_a_procesar(datos):
+    """Encola la generación de los derivados de una imagen.
+
+    Returns:
+        concurrent.futures.Future: Futuro con el resultado de `generar_derivados`
+    """
+    return pool_imagenes().submit(generar_derivados, datos)
+
+
+def subir_derivados(cliente, bucket, clave, derivados):
+    """Sube los derivados de un objeto a S3.
+
+    Returns:
+        dict: nombre de la variante -> ruta "s3://" del derivado
+    """
+    rutas = {}
+    for variante, datos in derivados.items():
+        clave_variante = clave_derivado(clave, variante)
+        cliente.put_object(
+            Bucket=bucket, Key=clave_variante, Body=datos,
+            ContentType="image/jpeg", CacheControl=CACHE_CONTROL_DERIVADOS
+        )
+        rutas[variante] = f"s3://{bucket}/{clave_variante}"
+    return rutas
+
+
+def rutas_mostradas(registro):
+    """Rutas de las imágenes de un registro que muestra el listado (derivados o, si no hay, el original)"""
+    derivados = registro.get(CAMPO_DERIVADOS) or []
+    for i, ruta in enumerate(registro.get("Imagenes") or []):
+        if not ruta:
+            continue
+        variantes = derivados[i] if i < len(derivados) and derivados[i] else {}
+        yield variantes.get("thumb") or ruta
+        yield variantes.get("medium") or ruta
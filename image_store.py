@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento de imágenes en S3 direccionado por contenido, con deduplicación,
+y registro de imágenes con recuento de referencias.
+
+La clave de cada imagen es el SHA-256 de su contenido (calculado al leer la
+subida), no un nombre aleatorio:
+
+    s3://<bucket>/sha256/<hash hex>
+
+La clave no lleva la extensión del archivo del usuario (la misma foto subida
+como ".jpg" y como ".jpeg" es un solo objeto, con un solo juego de derivados);
+el tipo MIME se guarda como Content-Type del objeto y en el registro ("tipo").
+
+Si la misma foto se adjunta a varios registros o se vuelve a subir, el objeto
+ya existe y no se repite la subida (ni la generación de derivados).
+
+Cada imagen (de S3 o local) tiene un documento en el registro de imágenes con
+el número de registros que la usan. Las rutas de escritura (alta, edición y
+borrado de registros) lo mantienen al día, así que la recogida de basura no
+recorre el catálogo: es una consulta indexada de las imágenes sin referencias
+desde hace más de un margen de seguridad.
+
+    {"_id": "<clave de S3 o ruta local>", "refcount": 2, "ubicacion": "s3", "bucket": ...,
+     "almacenada": True, "sha256": ..., "tamano": ..., "tipo": "image/jpeg", "derivados": {"thumb": ..., "medium": ...},
+     "usuarios": [<usuarios que han subido el contenido>],
+     "creado": <fecha>, "ultimo_cambio": <fecha del último cambio de refcount>}
+"""
+
+import base64
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from s3_urls import clave_s3
+
+PREFIJO_CONTENIDO = os.getenv("S3_CONTENT_PREFIX", "sha256").strip("/")
+
+# Segundos que una imagen sin referencias se conserva antes de borrarla
+# (evita carreras con una subida o edición que vuelva a usarla)
+MARGEN_RECOGIDA = int(os.getenv("IMAGE_GC_GRACE", str(24 * 3600)))
+
+
+def clave_contenido(suma):
+    """Clave de S3 de una imagen a partir de su SHA-256 (en base64, como lo usa S3).
+
+    Raises:
+        ValueError: Si `suma` no es un SHA-256 en base64
+    """
+    resumen = base64.b64decode(suma, validate=True)
+    if len(resumen) != 32:
+        raise ValueError("La suma no es un SHA-256")
+    return f"{PREFIJO_CONTENIDO}/{resumen.hex()}"
+
+
+def es_clave_contenido(clave):
+    """Indica si una clave de S3 es direccionada por contenido"""
+    return bool(clave) and clave.startswith(f"{PREFIJO_CONTENIDO}/")
+
+
+def id_imagen(ruta):
+    """Identificador en el registro de la imagen de una ruta de "Imagenes".
+
+    Es la clave para las rutas "s3://" y la propia ruta para las imágenes locales.
+    """
+    partes = clave_s3(ruta)
+    return partes[1] if partes else ruta
+
+
+def reservar(imagenes, clave, integridad=None, bucket=None, tipo=None, usuario=None):
+    """Suma una referencia a una imagen (creando su entrada si no existe).
+
+    Args:
+        imagenes: Colección del registro de imágenes
+        clave: Clave de S3 de la imagen (o ruta, si es local)
+        integridad: {"sha256": ..., "tamano": ...} del contenido
+        bucket: Bucket de S3 (None para imágenes locales)
+        tipo: Tipo MIME de la imagen
+        usuario: Usuario que ha subido el contenido (ver `subida_de_usuario`)
+
+    Returns:
+        dict: Entrada anterior a la reserva, o None si la imagen es nueva. Si tiene
+        "almacenada", el objeto ya está en S3 y no hace falta subirlo.
+    """
+    nueva = dict(integridad or {}, ubicacion="s3" if bucket else "local", bucket=bucket, tipo=tipo,
+                 creado=datetime.utcnow())
+    cambios = {"$inc": {"refcount": 1}, "$currentDate": {"ultimo_cambio": True}, "$setOnInsert": nueva}
+    if usuario:
+        cambios["$addToSet"] = {"usuarios": usuario}
+    return imagenes.find_one_and_update(
+        {"_id": clave},
+        cambios,
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+def subida_de_usuario(imagenes, clave, usuario):
+    """Indica si un usuario ya ha subido (y el servidor ha verificado) el contenido de una clave.
+
+    Solo a ellos se les permite usar la imagen sin volver a subirla: a cualquier otro
+    usuario le bastaría con conocer la suma para saber si existe y enlazarla.
+    """
+    return imagenes.find_one({"_id": clave, "almacenada": True, "usuarios": usuario}, {"_id": 1}) is not None
+
+
+def marcar_almacenada(imagenes, clave, derivados=None):
+    """Marca una imagen como subida a S3 y guarda las rutas de sus derivados"""
+    imagenes.update_one({"_id": clave}, {"$set": {"almacenada": True, "derivados": derivados}})
+
+
+def liberar(imagenes, clave):
+    """Resta una referencia a una imagen.
+
+    La imagen no se borra aquí: cuando llega a cero referencias la recoge
+    `retirar_sin_referencias` pasado MARGEN_RECOGIDA.
+
+    Returns:
+        int: Referencias que le quedan, o None si la imagen no está en el registro
+    """
+    entrada = imagenes.find_one_and_update(
+        {"_id": clave},
+        {"$inc": {"refcount": -1}, "$currentDate": {"ultimo_cambio": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return None if entrada is None else entrada["refcount"]
+
+
+def sin_referencias(imagenes, margen=MARGEN_RECOGIDA, ahora=None):
+    """Imágenes sin referencias desde hace más de `margen` segundos.
+
+    Usa el índice {refcount, ultimo_cambio}: el coste depende de la basura, no del catálogo.
+    """
+    limite = (ahora or datetime.utcnow()) - timedelta(seconds=margen)
+    return imagenes.find({"refcount": {"$lte": 0}, "ultimo_cambio": {"$lt": limite}})
+
+
+def retirar_sin_referencias(imagenes, entrada):
+    """Elimina del registro una imagen sin referencias, si nadie la ha vuelto a usar.
+
+    Sus claves de S3 se encolan después indicando la imagen ("imagen" en la cola de
+    borrados): si entre ambos pasos una subida vuelve a crear la entrada, el
+    trabajador de la cola lo ve justo antes de borrar y no las borra.
+
+    Returns:
+        bool: True si se ha retirado (su objeto o archivo ya se puede borrar)
+    """
+    filtro = {"_id": entrada["_id"], "refcount": {"$lte": 0}, "ultimo_cambio": entrada["ultimo_cambio"]}
+    return imagenes.delete_one(filtro).deleted_count == 1
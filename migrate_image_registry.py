@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Creación (o recuento) del registro de imágenes con sus referencias.
+
+Este script:
+1. Cuenta en el servidor cuántos registros del catálogo usan cada imagen y
+   guarda ese número como "refcount" en el registro de imágenes
+2. Pone a cero las entradas que ya no usa ningún registro
+3. Registra con cero referencias los archivos de 'imagenes_subidas' que no usa
+   ningún registro, para que la recogida de basura los encuentre
+4. Crea los índices del registro (declarados en mongo_indexes.py)
+
+La aplicación mantiene el registro al crear, editar y eliminar registros y
+tablas; este script solo es necesario una vez para las imágenes anteriores (o
+para corregir el recuento). Conviene ejecutarlo sin escrituras en curso.
+"""
+
+import os
+import sys
+import secrets
+import certifi
+from datetime import datetime
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+from pymongo.server_api import ServerApi
+
+from image_store import id_imagen
+from mongo_indexes import CATALOG_COLLECTION, IMAGES_COLLECTION, sincronizar_indices
+from s3_urls import clave_s3
+from upload_spool import PREFIJO_PENDIENTE
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_FOLDER = os.path.join(BASE_DIR, "imagenes_subidas")
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+TAMANO_LOTE = 1000
+
+
+def _escribir(coleccion, operaciones):
+    if operaciones:
+        coleccion.bulk_write(operaciones, ordered=False)
+    return []
+
+
+def migrar(db):
+    """Recalcula las referencias de todas las imágenes del catálogo"""
+    imagenes = db[IMAGES_COLLECTION]
+    recuento = secrets.token_hex(8)
+    ahora = datetime.utcnow()
+
+    conteo = db[CATALOG_COLLECTION].aggregate([
+        {"$project": {"Imagenes": 1}},
+        {"$unwind": "$Imagenes"},
+        {"$match": {"Imagenes": {"$type": "string", "$not": {"$regex": f"^{PREFIJO_PENDIENTE}"}}}},
+        {"$group": {"_id": "$Imagenes", "usos": {"$sum": 1}}},
+    ], allowDiskUse=True)
+
+    operaciones = []
+    referenciadas = 0
+    for grupo in conteo:
+        partes = clave_s3(grupo["_id"])
+        operaciones.append(UpdateOne(
+            {"_id": id_imagen(grupo["_id"])},
+            {"$set": {"refcount": grupo["usos"], "recuento": recuento, "ultimo_cambio": ahora},
+             "$setOnInsert": {"ubicacion": "s3" if partes else "local",
+                              "bucket": partes[0] if partes else None,
+                              "almacenada": True, "creado": ahora}},
+            upsert=True,
+        ))
+        referenciadas += 1
+        if len(operaciones) >= TAMANO_LOTE:
+            operaciones = _escribir(imagenes, operaciones)
+    _escribir(imagenes, operaciones)
+    print(f"Imágenes referenciadas: {referenciadas}")
+
+    sin_uso = imagenes.update_many(
+        {"recuento": {"$ne": recuento}, "refcount": {"$gt": 0}},
+        {"$set": {"refcount": 0, "ultimo_cambio": ahora}}
+    )
+    print(f"Entradas sin referencias puestas a cero: {sin_uso.modified_count}")
+
+    operaciones = []
+    locales = 0
+    if os.path.isdir(UPLOAD_FOLDER):
+        for nombre in os.listdir(UPLOAD_FOLDER):
+            if os.path.isfile(os.path.join(UPLOAD_FOLDER, nombre)):
+                operaciones.append(UpdateOne(
+                    {"_id": f"/imagenes_subidas/{nombre}"},
+                    {"$setOnInsert": {"refcount": 0, "ubicacion": "local", "bucket": None,
+                                      "almacenada": True, "creado": ahora, "ultimo_cambio": ahora}},
+                    upsert=True,
+                ))
+                locales += 1
+                if len(operaciones) >= TAMANO_LOTE:
+                    operaciones = _escribir(imagenes, operaciones)
+    _escribir(imagenes, operaciones)
+    print(f"Archivos locales revisados: {locales}")
+
+    informe = sincronizar_indices(db, colecciones=[IMAGES_COLLECTION])
+    print(f"Índices creados: {informe['creados'] or 'ninguno (ya existían)'}")
+    return True
+
+
+if __name__ == "__main__":
+    if not MONGO_URI:
+        print("Error: la variable de entorno MONGO_URI no está definida")
+        sys.exit(1)
+
+    client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+    migrar(client[MONGO_DB])
+    print("✅ Migración completada")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Migración del campo de ordenación de los registros del catálogo.
+
+Este script:
+1. Rellena "NumeroOrdenacion" (el "Número" del registro como texto) en todos
+   los registros de la colección del catálogo, con una única actualización
+   ejecutada en el servidor
+2. Numera los registros sin "Número" (vacío o ausente), que si no quedarían
+   fuera de los listados: reciben los siguientes números del contador de su
+   tabla, en el orden en que se crearon, y se informa de cada tabla afectada
+3. Rellena "IdentificadorTabla" (el valor del primer encabezado como texto) en
+   los registros de las tablas cuyo primer encabezado no es "Número"
+4. Informa de los conflictos antes de crear los índices: identificadores repetidos
+   dentro de una tabla (con numericOrdering, "01" y "1" son el mismo) y registros
+   que siguen sin identificador. Si hay alguno, termina sin crear los índices
+5. Crea los índices únicos parciales {table, NumeroOrdenacion} e
+   {table, IdentificadorTabla} con colación numericOrdering (declarados en
+   mongo_indexes.py), que garantizan identificadores únicos; el primero sirve
+   además la ordenación de los listados sin ordenar en memoria. Un índice
+   anterior con otra definición se sustituye
+
+Es idempotente: puede ejecutarse varias veces sin efectos adicionales.
+"""
+
+import os
+import sys
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from catalog_records import (
+    CAMPO_ORDEN, CAMPO_IDENTIFICADOR, COLACION_NUMERICA, campo_seguro, siguiente_numero, registrar_cambio
+)
+from mongo_indexes import (
+    CATALOG_COLLECTION, SPREADSHEETS_COLLECTION, INDICES, diferencias_indice, sincronizar_indices
+)
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+INDICE_NUMERO = "table_numero_unico"
+INDICE_IDENTIFICADOR = "table_identificador_unico"
+
+
+def repetidos(catalog_collection, indice, campo):
+    """Grupos de registros de una tabla con el mismo valor en el campo de un índice único.
+
+    Args:
+        catalog_collection: Colección del catálogo
+        indice: Nombre del índice en INDICES[CATALOG_COLLECTION]
+        campo: Campo del índice que debe ser único por tabla
+
+    Returns:
+        list: Documentos {_id: {table, numero}, valores, total} con total > 1
+    """
+    especificacion = INDICES[CATALOG_COLLECTION][indice]
+    # La colación del índice agrupa los identificadores que él consideraría iguales
+    return list(catalog_collection.aggregate([
+        {"$match": especificacion["partialFilterExpression"]},
+        {"$group": {"_id": {"table": "$table", "numero": f"${campo}"},
+                    "valores": {"$push": f"${campo}"}, "total": {"$sum": 1}}},
+        {"$match": {"total": {"$gt": 1}}}
+    ], collation=especificacion["collation"], allowDiskUse=True))
+
+
+def conflictos(catalog_collection):
+    """Busca los registros que impiden crear los índices o que quedarían fuera de los listados.
+
+    Returns:
+        tuple: (duplicados, sin_numero) con los grupos de identificadores repetidos
+        por tabla ("Número" o primer encabezado) y el número de registros sin
+        identificador de cada tabla
+    """
+    duplicados = (repetidos(catalog_collection, INDICE_NUMERO, CAMPO_ORDEN)
+                  + repetidos(catalog_collection, INDICE_IDENTIFICADOR, CAMPO_IDENTIFICADOR))
+    sin_numero = list(catalog_collection.aggregate([
+        {"$match": {"table": {"$type": "string"}, CAMPO_ORDEN: {"$not": {"$type": "string"}}}},
+        {"$group": {"_id": "$table", "total": {"$sum": 1}}}
+    ], allowDiskUse=True))
+    return duplicados, sin_numero
+
+
+def numerar_sin_identificador(db):
+    """Da a los registros sin "NumeroOrdenacion" los siguientes números de su tabla.
+
+    Los números se reservan de una vez en el contador de la tabla (así no
+    coinciden con los de inserciones concurrentes) y se escriben en el servidor
+    con $setWindowFields y $merge, en el orden de creación (_id).
+
+    Returns:
+        dict: Tabla -> (primer, último) número asignado
+    """
+    catalog_collection = db[CATALOG_COLLECTION]
+    contadores = db["table_counters"]
+    pendientes = list(catalog_collection.aggregate([
+        {"$match": {"table": {"$type": "string"}, CAMPO_ORDEN: {"$not": {"$type": "string"}}}},
+        {"$group": {"_id": "$table", "total": {"$sum": 1}}}
+    ], allowDiskUse=True))
+
+    asignados = {}
+    for tabla in pendientes:
+        nombre, total = tabla["_id"], tabla["total"]
+        primero = siguiente_numero(contadores, catalog_collection, nombre, cantidad=total) - total + 1
+        numero = {"$add": ["$posicion", primero - 1]}
+        catalog_collection.aggregate([
+            {"$match": {"table": nombre, CAMPO_ORDEN: {"$not": {"$type": "string"}}}},
+            {"$setWindowFields": {"sortBy": {"_id": 1}, "output": {"posicion": {"$documentNumber": {}}}}},
+            # Solo los reservados: si otro proceso ha añadido registros sin número, esperan a otra ejecución
+            {"$match": {"posicion": {"$lte": total}}},
+            {"$project": {"Número": numero, CAMPO_ORDEN: {"$toString": numero}}},
+            {"$merge": {"into": catalog_collection.name, "on": "_id",
+                        "whenMatched": "merge", "whenNotMatched": "discard"}}
+        ], collation=COLACION_NUMERICA, allowDiskUse=True)
+        registrar_cambio(contadores, nombre)
+        asignados[nombre] = (primero, primero + total - 1)
+    return asignados
+
+
+def rellenar_identificadores(db):
+    """Copia el primer encabezado de cada tabla que no se identifica por "Número" en "IdentificadorTabla".
+
+    Returns:
+        int: Registros modificados
+    """
+    catalog_collection = db[CATALOG_COLLECTION]
+    modificados = 0
+    tablas = db[SPREADSHEETS_COLLECTION].find(
+        {"headers.0": {"$exists": True, "$ne": "Número"}}, {"filename": 1, "headers": 1}
+    )
+    for tabla in tablas:
+        valor = {"$trim": {"input": {"$toString": {"$ifNull": [f"${campo_seguro(tabla['headers'][0])}", ""]}}}}
+        resultado = catalog_collection.update_many(
+            {"table": tabla["filename"]},
+            [{"$set": {CAMPO_IDENTIFICADOR: {"$let": {
+                "vars": {"valor": valor},
+                "in": {"$cond": [{"$eq": ["$$valor", ""]}, "$$REMOVE", "$$valor"]}
+            }}}}],
+            collation=COLACION_NUMERICA
+        )
+        modificados += resultado.modified_count
+    return modificados
+
+
+def migrar(db):
+    """Rellena los campos de ordenación e identificador y crea sus índices únicos.
+
+    Returns:
+        bool: True si los índices existen al terminar; False si hay conflictos o no se pudieron crear
+    """
+    catalog_collection = db[CATALOG_COLLECTION]
+    numero = {"$trim": {"input": {"$toString": {"$ifNull": ["$Número", ""]}}}}
+    resultado = catalog_collection.update_many(
+        {"table": {"$exists": True}},
+        [{"$set": {CAMPO_ORDEN: {"$let": {
+            "vars": {"numero": numero},
+            # Sin identificador el campo se elimina (el registro se numera a continuación)
+            "in": {"$cond": [{"$eq": ["$$numero", ""]}, "$$REMOVE", "$$numero"]}
+        }}}}]
+    )
+    print(f"Registros revisados: {resultado.matched_count}")
+    print(f"Registros actualizados: {resultado.modified_count}")
+
+    asignados = numerar_sin_identificador(db)
+    if asignados:
+        print("Registros sin identificador numerados (ahora aparecen en los listados):")
+        for tabla, (primero, ultimo) in asignados.items():
+            print(f"  - {tabla}: {primero} a {ultimo}")
+
+    print(f"Identificadores de tabla actualizados: {rellenar_identificadores(db)}")
+
+    duplicados, sin_numero = conflictos(catalog_collection)
+    if duplicados:
+        print("⚠️ Hay identificadores repetidos (numericOrdering compara \"01\" y \"1\" como iguales):")
+        for duplicado in duplicados:
+            valores = ", ".join(f"'{valor}'" for valor in duplicado["valores"])
+            print(f"  - {duplicado['_id']['table']}: {valores} ({duplicado['total']} registros)")
+    if sin_numero:
+        print("⚠️ Siguen quedando registros sin identificador, que no aparecen en los listados:")
+        for tabla in sin_numero:
+            print(f"  - {tabla['_id']}: {tabla['total']} registros")
+    if duplicados or sin_numero:
+        print("Corrige o renumera estas tablas (/renumerar/<tabla>) y vuelve a ejecutar la migración")
+        return False
+
+    # Un índice anterior sin filtro parcial (o con otra definición) se sustituye
+    existentes = {indice["name"]: indice for indice in catalog_collection.list_indexes()}
+    for nombre in (INDICE_NUMERO, INDICE_IDENTIFICADOR):
+        if nombre in existentes and diferencias_indice(INDICES[CATALOG_COLLECTION][nombre], existentes[nombre]):
+            catalog_collection.drop_index(nombre)
+            print(f"Índice anterior eliminado: {nombre}")
+
+    informe = sincronizar_indices(db, colecciones=[CATALOG_COLLECTION])
+    for error in informe["errores"]:
+        print(f"❌ No se pudo crear el índice {error}")
+    if informe["errores"]:
+        return False
+    print(f"Índices creados: {informe['creados'] or 'ninguno (ya existían)'}")
+    return True
+
+
+if __name__ == "__main__":
+    if not MONGO_URI:
+        print("Error: la variable de entorno MONGO_URI no está definida")
+        sys.exit(1)
+
+    client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+    if not migrar(client[MONGO_DB]):
+        sys.exit(1)
+    print("✅ Migración completada")
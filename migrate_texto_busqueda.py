@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Migración del campo de búsqueda de texto de los registros del catálogo.
+
+Este script:
+1. Rellena "TextoBusqueda" (el texto de los encabezados del registro) en los
+   registros de cada tabla, con una actualización por tabla ejecutada en el
+   servidor
+2. Crea el índice de texto {table, TextoBusqueda} (declarado en mongo_indexes.py);
+   un índice de texto anterior con otra definición (p. ej. sin el prefijo
+   "table") se elimina antes, ya que solo puede haber uno por colección
+
+La aplicación mantiene el campo al crear y editar registros; este script solo
+es necesario para los registros anteriores. Es idempotente.
+"""
+
+import os
+import sys
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from catalog_records import CAMPO_BUSQUEDA, COLACION_NUMERICA, expresion_texto_busqueda
+from mongo_indexes import (
+    CATALOG_COLLECTION, SPREADSHEETS_COLLECTION, INDICES, diferencias_indice, sincronizar_indices
+)
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+INDICE_TEXTO = "texto_busqueda"
+
+
+def migrar(db):
+    """Rellena el campo de búsqueda de todas las tablas y crea el índice de texto"""
+    catalog_collection = db[CATALOG_COLLECTION]
+    actualizados = 0
+    for tabla in db[SPREADSHEETS_COLLECTION].find({}, {"filename": 1, "headers": 1}):
+        resultado = catalog_collection.update_many(
+            {"table": tabla["filename"]},
+            [{"$set": {CAMPO_BUSQUEDA: expresion_texto_busqueda(tabla.get("headers") or [])}}],
+            collation=COLACION_NUMERICA
+        )
+        actualizados += resultado.modified_count
+        print(f"  - {tabla['filename']}: {resultado.matched_count} registros")
+    print(f"Registros actualizados: {actualizados}")
+
+    # Solo se admite un índice de texto por colección: el anterior se sustituye
+    for indice in catalog_collection.list_indexes():
+        if "_fts" in indice.get("key", {}) and (
+            indice["name"] != INDICE_TEXTO
+            or diferencias_indice(INDICES[CATALOG_COLLECTION][INDICE_TEXTO], indice)
+        ):
+            catalog_collection.drop_index(indice["name"])
+            print(f"Índice de texto anterior eliminado: {indice['name']}")
+
+    informe = sincronizar_indices(db, colecciones=[CATALOG_COLLECTION])
+    for error in informe["errores"]:
+        print(f"❌ No se pudo crear el índice {error}")
+    print(f"Índices creados: {informe['creados'] or 'ninguno (ya existían)'}")
+    return not informe["errores"]
+
+
+if __name__ == "__main__":
+    if not MONGO_URI:
+        print("Error: la variable de entorno MONGO_URI no está definida")
+        sys.exit(1)
+
+    client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+    if not migrar(client[MONGO_DB]):
+        sys.exit(1)
+    print("✅ Migración completada")
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gestión declarativa de los índices de MongoDB de la aplicación.
+
+Los índices necesarios para cada colección se declaran en INDICES. La función
+`sincronizar_indices` crea los que faltan (es idempotente, se puede ejecutar
+en cada arranque o despliegue) e informa de las diferencias ("drift") entre lo
+declarado y lo que existe en el servidor.
+
+Además, `consultas_criticas` recoge las consultas más frecuentes de la
+aplicación para comprobar con explain() que ninguna recorre la colección
+completa (COLLSCAN). Uso desde la línea de comandos:
+
+    python mongo_indexes.py            # sincroniza e informa de diferencias
+    python mongo_indexes.py --check    # solo informa, no crea nada
+    python mongo_indexes.py --explain  # comprueba los planes de las consultas críticas
+"""
+
+import os
+import sys
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from catalog_records import COLACION_NUMERICA, CAMPO_ORDEN, CAMPO_BUSQUEDA, CAMPO_IDENTIFICADOR, filtro_tabla
+
+# Nombres de las colecciones (los mismos que usa app.py)
+CATALOG_COLLECTION = os.getenv("CATALOG_COLLECTION", "67b8c24a7fdc72dd4d8703cf")
+SPREADSHEETS_COLLECTION = "spreadsheets"
+USERS_COLLECTION = "users"
+RESETS_COLLECTION = "password_resets"
+S3_DELETIONS_COLLECTION = "s3_deletion_queue"
+IMAGES_COLLECTION = "image_registry"
+
+# Colación para búsquedas de usuario sin distinguir mayúsculas/minúsculas
+COLACION_SIN_MAYUSCULAS = {"locale": "es", "strength": 2}
+
+# Índices declarados por colección: nombre -> especificación
+INDICES = {
+    CATALOG_COLLECTION: {
+        # Identificador único por tabla; sirve también la ordenación de los listados.
+        # Es parcial: los registros antiguos sin tabla o sin identificador no colisionan,
+        # y las consultas deben incluir la misma condición (ver catalog_records.filtro_tabla)
+        "table_numero_unico": {
+            "keys": [("table", 1), (CAMPO_ORDEN, 1)],
+            "unique": True,
+            "collation": COLACION_NUMERICA,
+            "partialFilterExpression": {CAMPO_ORDEN: {"$type": "string"}, "table": {"$exists": True}},
+        },
+        # Identificador único por tabla en las tablas cuyo primer encabezado no es "Número"
+        "table_identificador_unico": {
+            "keys": [("table", 1), (CAMPO_IDENTIFICADOR, 1)],
+            "unique": True,
+            "collation": COLACION_NUMERICA,
+            "partialFilterExpression": {CAMPO_IDENTIFICADOR: {"$type": "string"}, "table": {"$exists": True}},
+        },
+        # Registros de una tabla, incluidos los que quedan fuera del índice parcial anterior
+        # (renumeración, recuentos, inicialización del contador, búsquedas por otros campos).
+        # Con la colación del catálogo: las consultas deben usar COLACION_NUMERICA
+        "table_registros": {"keys": [("table", 1)], "collation": COLACION_NUMERICA},
+        # Único índice de texto permitido por colección. El prefijo "table" limita cada
+        # búsqueda a su tabla; las consultas deben dar una igualdad sobre él (no $in)
+        "texto_busqueda": {"keys": [("table", 1), (CAMPO_BUSQUEDA, "text")], "default_language": "spanish"},
+    },
+    SPREADSHEETS_COLLECTION: {
+        "filename": {"keys": [("filename", 1)]},
+        "owner_created_at": {"keys": [("owner", 1), ("created_at", 1)]},
+    },
+    USERS_COLLECTION: {
+        "email_ci": {"keys": [("email", 1)], "collation": COLACION_SIN_MAYUSCULAS},
+        "nombre_ci": {"keys": [("nombre", 1)], "collation": COLACION_SIN_MAYUSCULAS},
+    },
+    RESETS_COLLECTION: {
+        "token": {"keys": [("token", 1)], "unique": True},
+    },
+    IMAGES_COLLECTION: {
+        # Recogida de basura: imágenes sin referencias desde antes de una fecha (ver image_store.py)
+        "refcount_ultimo_cambio": {"keys": [("refcount", 1), ("ultimo_cambio", 1)]},
+    },
+    S3_DELETIONS_COLLECTION: {
+        # Lotes listos para borrar (ver s3_deletion_queue.py)
+        "estado_siguiente": {"keys": [("estado", 1), ("siguiente", 1)]},
+        "token": {"keys": [("token", 1)], "sparse": True},
+    },
+}
+
+# Índices creados bajo demanda para las columnas por las que más se ordena el catálogo.
+# No se declaran en INDICES (dependen de los encabezados de cada tabla), así que la
+# sincronización no los trata como sobrantes.
+PREFIJO_INDICES_COLUMNA = "columna_"
+USOS_ORDEN_PARA_INDICE = int(os.getenv("CATALOG_SORT_INDEX_THRESHOLD", "20"))
+MAXIMO_INDICES_COLUMNA = int(os.getenv("CATALOG_MAX_COLUMN_INDEXES", "20"))
+
+# Opciones de índice que se comparan al detectar diferencias
+OPCIONES_COMPARADAS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+def _opciones_creacion(nombre, especificacion):
+    opciones = {k: v for k, v in especificacion.items() if k != "keys"}
+    opciones["name"] = nombre
+    return opciones
+
+
+def diferencias_indice(especificacion, existente):
+    """Compara un índice declarado con el existente en el servidor.
+
+    Args:
+        especificacion: Especificación declarada en INDICES
+        existente: Documento devuelto por `list_indexes()` para el mismo nombre
+
+    Returns:
+        list: Descripción de cada diferencia encontrada (vacía si coinciden)
+    """
+    diferencias = []
+    campos_texto = [campo for campo, tipo in especificacion["keys"] if tipo == "text"]
+    if campos_texto:
+        # El servidor guarda los campos de texto como {_fts, _ftsx} y los lista en "weights";
+        # los demás campos (prefijos) se conservan en "key"
+        pesos = sorted(existente.get("weights", {}))
+        if pesos != sorted(campos_texto):
+            diferencias.append(f"campos de texto {pesos} != {sorted(campos_texto)}")
+        prefijos = [(campo, tipo) for campo, tipo in especificacion["keys"] if tipo != "text"]
+        prefijos_existentes = [
+            (campo, tipo) for campo, tipo in existente.get("key", {}).items() if campo not in ("_fts", "_ftsx")
+        ]
+        if prefijos_existentes != prefijos:
+            diferencias.append(f"claves {prefijos_existentes} != {prefijos}")
+        idioma = especificacion.get("default_language", "english")
+        if existente.get("default_language") != idioma:
+            diferencias.append(f"default_language: {existente.get('default_language')!r} != {idioma!r}")
+    else:
+        claves_existentes = list(existente.get("key", {}).items())
+        if claves_existentes != list(especificacion["keys"]):
+            diferencias.append(f"claves {claves_existentes} != {list(especificacion['keys'])}")
+
+    for opcion in OPCIONES_COMPARADAS:
+        declarado = especificacion.get(opcion)
+        actual = existente.get(opcion)
+        if opcion in ("unique", "sparse"):
+            declarado, actual = bool(declarado), bool(actual)
+        if declarado != actual:
+            diferencias.append(f"{opcion}: {actual!r} != {declarado!r}")
+
+    # El servidor devuelve la colación completa; solo se comparan las opciones declaradas
+    colacion_declarada = especificacion.get("collation")
+    colacion_actual = existente.get("collation") or {}
+    if colacion_declarada:
+        for clave, valor in colacion_declarada.items():
+            if colacion_actual.get(clave) != valor:
+                diferencias.append(f"collation.{clave}: {colacion_actual.get(clave)!r} != {valor!r}")
+    elif colacion_actual and colacion_actual.get("locale") != "simple":
+        diferencias.append(f"collation: {colacion_actual!r} != None")
+
+    return diferencias
+
+
+def sincronizar_indices(db, crear=True, colecciones=None, logger=None):
+    """Crea los índices declarados que faltan e informa de las diferencias.
+
+    Nunca elimina ni modifica índices existentes: las diferencias solo se informan,
+    para que se corrijan de forma deliberada. Un índice que no se puede crear (p. ej.
+    un índice único con valores repetidos) se informa en "errores" y no impide
+    crear los demás.
+
+    Args:
+        db: Base de datos de MongoDB
+        crear: Si False, solo se comprueba (modo informe)
+        colecciones: Limitar la sincronización a estas colecciones (por defecto, todas)
+        logger: Logger donde escribir el informe (opcional)
+
+    Returns:
+        dict: {"creados": [...], "diferencias": [...], "sobrantes": [...], "errores": [...]}
+        con "coleccion.indice"
+    """
+    informe = {"creados": [], "diferencias": [], "sobrantes": [], "errores": []}
+
+    for nombre_coleccion, indices in INDICES.items():
+        if colecciones is not None and nombre_coleccion not in colecciones:
+            continue
+        coleccion = db[nombre_coleccion]
+        existentes = {indice["name"]: indice for indice in coleccion.list_indexes()}
+
+        for nombre, especificacion in indices.items():
+            etiqueta = f"{nombre_coleccion}.{nombre}"
+            if nombre not in existentes:
+                if crear:
+                    try:
+                        coleccion.create_index(especificacion["keys"], **_opciones_creacion(nombre, especificacion))
+                    except PyMongoError as e:
+                        informe["errores"].append(f"{etiqueta}: {str(e)}")
+                        continue
+                informe["creados"].append(etiqueta)
+                continue
+            for diferencia in diferencias_indice(especificacion, existentes[nombre]):
+                informe["diferencias"].append(f"{etiqueta}: {diferencia}")
+
+        for nombre in existentes:
+            if nombre != "_id_" and nombre not in indices and not nombre.startswith(PREFIJO_INDICES_COLUMNA):
+                informe["sobrantes"].append(f"{nombre_coleccion}.{nombre}")
+
+    if logger:
+        accion = "creados" if crear else "pendientes de crear"
+        for etiqueta in informe["creados"]:
+            logger.info(f"Índice {accion}: {etiqueta}")
+        for diferencia in informe["diferencias"]:
+            logger.warning(f"Índice distinto del declarado: {diferencia}")
+        for etiqueta in informe["sobrantes"]:
+            logger.warning(f"Índice no declarado: {etiqueta}")
+        for error in informe["errores"]:
+            logger.error(f"No se pudo crear el índice {error}")
+
+    return informe
+
+
+# -------------------------------------------
+# ÍNDICES BAJO DEMANDA POR COLUMNA
+# -------------------------------------------
+def registrar_uso_orden(estadisticas, campo, umbral=USOS_ORDEN_PARA_INDICE):
+    """Cuenta una ordenación del catálogo por un campo.
+
+    Args:
+        estadisticas: Colección con los usos por campo ({_id: <campo>, usos: n})
+        campo: Campo (saneado) por el que se ha ordenado
+        umbral: Número de usos a partir del cual conviene indexar el campo
+
+    Returns:
+        bool: True solo la vez en que se alcanza el umbral
+    """
+    documento = estadisticas.find_one_and_update(
+        {"_id": campo}, {"$inc": {"usos": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return documento["usos"] == umbral
+
+
+def crear_indice_columna(coleccion, campo, maximo=MAXIMO_INDICES_COLUMNA):
+    """Crea el índice {table, <campo>, NumeroOrdenacion} para filtrar por una columna.
+
+    La ordenación por columna usa una clave tipada calculada (ver catalog_query.py)
+    que ningún índice puede servir; las columnas por las que más se ordena son
+    también por las que más se filtra. El índice es compartido por todas las tablas que tienen esa columna. Se
+    limita el número de índices de columna, porque cada índice encarece las
+    escrituras y MongoDB admite como máximo 64 por colección.
+
+    Returns:
+        str: Nombre del índice creado, o None si ya existía o se ha alcanzado el máximo
+    """
+    nombre = f"{PREFIJO_INDICES_COLUMNA}{campo}"
+    existentes = [indice["name"] for indice in coleccion.list_indexes()]
+    if nombre in existentes:
+        return None
+    if sum(1 for n in existentes if n.startswith(PREFIJO_INDICES_COLUMNA)) >= maximo:
+        return None
+    coleccion.create_index(
+        [("table", 1), (campo, 1), (CAMPO_ORDEN, 1)], name=nombre, collation=COLACION_NUMERICA
+    )
+    return nombre
+
+
+# -------------------------------------------
+# COMPROBACIÓN DE PLANES DE CONSULTA (explain)
+# -------------------------------------------
+def consultas_criticas(tabla="tabla_ejemplo.xlsx", owner="usuario", login="usuario@example.com"):
+    """Devuelve las consultas más frecuentes de la aplicación como comandos explicables.
+
+    Cada consulta es un dict con "nombre", "coleccion", "comando" (find o aggregate).
+    """
+    return [
+        {
+            "nombre": "listado del catálogo",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "aggregate": CATALOG_COLLECTION,
+                "pipeline": [
+                    {"$match": filtro_tabla(tabla)},
+                    {"$sort": {CAMPO_ORDEN: 1}},
+                    {"$limit": 51},
+                ],
+                "cursor": {},
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "búsqueda de registro en editar",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "find": CATALOG_COLLECTION,
+                "filter": filtro_tabla(tabla, {"$eq": "1"}),
+                "limit": 1,
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "comprobación de identificador repetido al insertar",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "find": CATALOG_COLLECTION,
+                "filter": {"table": tabla, CAMPO_IDENTIFICADOR: "A-1"},
+                "projection": {"_id": 1},
+                "limit": 1,
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "renumeración de una tabla",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "aggregate": CATALOG_COLLECTION,
+                "pipeline": [
+                    {"$match": {"table": tabla}},
+                    {"$setWindowFields": {"sortBy": {CAMPO_ORDEN: 1}, "output": {"nuevo": {"$documentNumber": {}}}}},
+                ],
+                "cursor": {},
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "recuento de registros de una tabla (renumeración y compactación)",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "aggregate": CATALOG_COLLECTION,
+                "pipeline": [{"$match": {"table": tabla}}, {"$count": "total"}],
+                "cursor": {},
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "inicialización del contador de la tabla",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "aggregate": CATALOG_COLLECTION,
+                "pipeline": [
+                    {"$match": {"table": tabla, "Número": {"$type": "number"}}},
+                    {"$group": {"_id": None, "maximo": {"$max": "$Número"}}},
+                ],
+                "cursor": {},
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "búsqueda de registro en editar por el primer encabezado",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "find": CATALOG_COLLECTION,
+                "filter": {"Referencia": "A-1", "table": tabla},
+                "limit": 1,
+                "collation": COLACION_NUMERICA,
+            },
+        },
+        {
+            "nombre": "búsqueda de texto",
+            "coleccion": CATALOG_COLLECTION,
+            "comando": {
+                "aggregate": CATALOG_COLLECTION,
+                "pipeline": [
+                    {"$match": {"table": tabla, "$text": {"$search": "anillo"}}},
+                    {"$sort": {"puntuacion": {"$meta": "textScore"}, "_id": 1}},
+                    {"$limit": 51},
+                ],
+                "cursor": {},
+            },
+        },
+        {
+            "nombre": "metadatos de la tabla",
+            "coleccion": SPREADSHEETS_COLLECTION,
+            "comando": {"find": SPREADSHEETS_COLLECTION, "filter": {"filename": tabla}, "limit": 1},
+        },
+        {
+            "nombre": "listado de tablas",
+            "coleccion": SPREADSHEETS_COLLECTION,
+            "comando": {"find": SPREADSHEETS_COLLECTION, "filter": {"owner": owner}},
+        },
+        {
+            "nombre": "login",
+            "coleccion": USERS_COLLECTION,
+            "comando": {
+                "find": USERS_COLLECTION,
+                "filter": {"$or": [{"nombre": login}, {"email": login}]},
+                "limit": 1,
+                "collation": COLACION_SIN_MAYUSCULAS,
+            },
+        },
+        {
+            "nombre": "token de recuperación",
+            "coleccion": RESETS_COLLECTION,
+            "comando": {"find": RESETS_COLLECTION, "filter": {"token": "token"}, "limit": 1},
+        },
+    ]
+
+
+def etapas_plan(plan):
+    """Devuelve los nombres de todas las etapas de un plan de ejecución (recursivo)"""
+    etapas = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            etapas.append(plan["stage"])
+        for valor in plan.values():
+            if isinstance(valor, (dict, list)):
+                etapas.extend(etapas_plan(valor))
+    elif isinstance(plan, list):
+        for valor in plan:
+            etapas.extend(etapas_plan(valor))
+    return etapas
+
+
+def plan_ganador(explicacion):
+    """Extrae los planes ganadores de la salida de explain (find o aggregate)"""
+    planes = []
+    if isinstance(explicacion, dict):
+        planificador = explicacion.get("queryPlanner")
+        if planificador:
+            planes.append(planificador.get("winningPlan", {}))
+        for clave in ("stages", "shards"):
+            valor = explicacion.get(clave)
+            if isinstance(valor, list):
+                for etapa in valor:
+                    for contenido in etapa.values():
+                        planes.extend(plan_ganador(contenido))
+            elif isinstance(valor, dict):
+                for contenido in valor.values():
+                    planes.extend(plan_ganador(contenido))
+    return planes
+
+
+def comprobar_planes(db, consultas=None):
+    """Ejecuta explain() sobre las consultas críticas.
+
+    Returns:
+        list: Nombres de las consultas cuyo plan usa COLLSCAN
+    """
+    con_collscan = []
+    for consulta in consultas or consultas_criticas():
+        explicacion = db.command("explain", consulta["comando"], verbosity="queryPlanner")
+        if "COLLSCAN" in etapas_plan(plan_ganador(explicacion)):
+            con_collscan.append(consulta["nombre"])
+    return con_collscan
+
+
+if __name__ == "__main__":
+    import logging
+    import certifi
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from pymongo.server_api import ServerApi
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("mongo_indexes")
+
+    client = MongoClient(os.getenv("MONGO_URI"), tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+    db = client[os.getenv("MONGO_DB", "app_catalogojoyero")]
+
+    if "--explain" in sys.argv:
+        fallos = comprobar_planes(db)
+        for nombre in fallos:
+            logger.error(f"La consulta '{nombre}' recorre la colección completa (COLLSCAN)")
+        sys.exit(1 if fallos else 0)
+
+    informe = sincronizar_indices(db, crear="--check" not in sys.argv, logger=logger)
+    sys.exit(1 if informe["diferencias"] or informe["errores"] else 0)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Paginación por cursor (keyset) para los listados del catálogo.
+
+En lugar de saltar N documentos con skip(), cada página se pide a partir de
+los valores de la clave de ordenación del último (o primer) registro de la
+página anterior. Así el coste de cada página depende solo de su tamaño y no
+del número de registros de la tabla.
+"""
+
+import base64
+import os
+from collections import namedtuple
+
+from bson import json_util
+
+# Tamaños de página permitidos en el catálogo
+TAMANO_PAGINA_POR_DEFECTO = int(os.getenv("CATALOG_PAGE_SIZE", "50"))
+TAMANO_PAGINA_MAXIMO = int(os.getenv("CATALOG_MAX_PAGE_SIZE", "200"))
+TAMANOS_PAGINA = (25, 50, 100, 200)
+
+# Valor de "por_pagina" que muestra todos los registros (la página se envía en streaming)
+MOSTRAR_TODOS = "todos"
+
+Pagina = namedtuple("Pagina", ["registros", "cursor_siguiente", "cursor_anterior", "tamano"])
+
+
+def obtener_tamano_pagina(valor, por_defecto=TAMANO_PAGINA_POR_DEFECTO, maximo=TAMANO_PAGINA_MAXIMO):
+    """Convierte el tamaño de página pedido por el usuario en un valor válido.
+
+    Args:
+        valor: Valor recibido en la query string (puede ser None o texto)
+        por_defecto: Tamaño que se usa si el valor no es un entero
+        maximo: Límite superior del tamaño de página
+
+    Returns:
+        int: Tamaño de página entre 1 y `maximo`
+    """
+    try:
+        tamano = int(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+    return max(1, min(tamano, maximo))
+
+
+def codificar_cursor(valores):
+    """Codifica los valores de la clave de ordenación en un token apto para URL"""
+    datos = json_util.dumps(valores).encode("utf-8")
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(token):
+    """Decodifica un token generado por `codificar_cursor`.
+
+    Returns:
+        list: Valores de la clave de ordenación, o None si el token no es válido
+    """
+    if not token:
+        return None
+    try:
+        relleno = "=" * (-len(token) % 4)
+        valores = json_util.loads(base64.urlsafe_b64decode(token + relleno).decode("utf-8"))
+    except (ValueError, TypeError):
+        return None
+    return valores if isinstance(valores, list) else None
+
+
+def condicion_keyset(campos_orden, valores, hacia_atras=False):
+    """Construye el filtro que selecciona los documentos posteriores (o anteriores)
+    a una posición concreta de la ordenación.
+
+    Para una ordenación (a, b) el filtro equivale a: a > va OR (a == va AND b > vb).
+
+    Args:
+        campos_orden: Lista de tuplas (campo, dirección) con dirección 1 o -1
+        valores: Valores de cada campo en la posición de referencia
+        hacia_atras: Si True, selecciona los documentos anteriores a la posición
+
+    Returns:
+        dict: Filtro de MongoDB
+    """
+    condiciones = []
+    for i, (campo, direccion) in enumerate(campos_orden):
+        condicion = {c: v for (c, _), v in zip(campos_orden[:i], valores[:i])}
+        ascendente = (direccion == 1) != hacia_atras
+        condicion[campo] = {"$gt" if ascendente else "$lt": valores[i]}
+        condiciones.append(condicion)
+    return {"$or": condiciones}
+
+
+def _valores_orden(registro, campos_orden):
+    return [registro.get(campo) for campo, _ in campos_orden]
+
+
+def obtener_pagina(coleccion, etapas_iniciales, campos_orden, tamano,
+                   despues=None, antes=None, proyeccion=None, **opciones_aggregate):
+    """Obtiene una página de registros usando paginación por cursor.
+
+    Args:
+        coleccion: Colección de MongoDB
+        etapas_iniciales: Etapas del pipeline previas a la paginación ($match de la tabla, etc.)
+        campos_orden: Lista de tuplas (campo, dirección); el último campo debe ser único (p. ej. _id)
+        tamano: Número máximo de registros de la página
+        despues: Cursor de la página siguiente (registros posteriores a él)
+        antes: Cursor de la página anterior (registros anteriores a él)
+        proyeccion: Campos a devolver (deben incluir los de `campos_orden`)
+        **opciones_aggregate: Opciones adicionales para `aggregate` (collation, etc.)
+
+    Returns:
+        Pagina: Registros de la página y cursores para navegar a la siguiente/anterior
+    """
+    valores_despues = decodificar_cursor(despues)
+    valores_antes = decodificar_cursor(antes) if valores_despues is None else None
+    hacia_atras = valores_antes is not None
+
+    pipeline = list(etapas_iniciales)
+    referencia = valores_antes if hacia_atras else valores_despues
+    if referencia is not None and len(referencia) == len(campos_orden):
+        pipeline.append({"$match": condicion_keyset(campos_orden, referencia, hacia_atras)})
+    else:
+        referencia = None
+
+    # Al ir hacia atrás se invierte el orden y después se da la vuelta a los resultados
+    orden = {campo: (-direccion if hacia_atras else direccion) for campo, direccion in campos_orden}
+    pipeline.append({"$sort": orden})
+    # Se pide un registro de más para saber si hay otra página a continuación
+    pipeline.append({"$limit": tamano + 1})
+    if proyeccion:
+        pipeline.append({"$project": proyeccion})
+
+    registros = list(coleccion.aggregate(pipeline, **opciones_aggregate))
+    hay_mas = len(registros) > tamano
+    registros = registros[:tamano]
+    if hacia_atras:
+        registros.reverse()
+
+    cursor_siguiente = cursor_anterior = None
+    if registros:
+        primero = codificar_cursor(_valores_orden(registros[0], campos_orden))
+        ultimo = codificar_cursor(_valores_orden(registros[-1], campos_orden))
+        if hacia_atras:
+            cursor_anterior = primero if hay_mas else None
+            cursor_siguiente = ultimo
+        else:
+            cursor_siguiente = ultimo if hay_mas else None
+            cursor_anterior = primero if referencia is not None else None
+
+    return Pagina(registros, cursor_siguiente, cursor_anterior, tamano)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Conciliación periódica entre el bucket de S3 y el catálogo
+
+Los scripts de limpieza de imágenes solo miran las imágenes locales, así que la
+basura de S3 nunca se recogía y los objetos perdidos no se detectaban. Este
+script, pensado para ejecutarse como tarea programada:
+1. Recorre a la vez, ordenados, los objetos del bucket y las claves que usan los
+   registros, y los cruza (ver s3_reconciliation.py); la memoria no depende del
+   número de claves
+2. Informa de los objetos huérfanos (sin ningún registro que los use) y de las
+   referencias colgantes (registros que usan un objeto que ya no existe) en
+   logs/reconcile_s3.log y en un CSV en logs/
+3. Con --accion eliminar, encola los huérfanos en la cola de borrados de S3;
+   con --accion cuarentena, los copia bajo el prefijo de cuarentena y encola el
+   original. Por defecto solo informa
+
+Los objetos recientes (--margen) y los que siguen en el registro de imágenes (los
+recoge clean_images_scheduled.py) nunca se tocan.
+"""
+
+import os
+import csv
+import sys
+import logging
+import argparse
+from datetime import datetime
+
+import boto3
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from mongo_indexes import CATALOG_COLLECTION, IMAGES_COLLECTION, S3_DELETIONS_COLLECTION
+from s3_deletion_queue import ColaBorrados, TAMANO_LOTE_BORRADOS
+from s3_reconciliation import (
+    HUERFANO, MARGEN_CONCILIACION, objetos_s3, claves_referenciadas, cruzar, es_reciente,
+    en_registro, poner_en_cuarentena
+)
+
+# Cargar variables de entorno desde el archivo .env
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.path.join(BASE_DIR, "logs", "reconcile_s3.log")
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "app_catalogojoyero")
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+
+ACCIONES = ("informe", "eliminar", "cuarentena")
+
+# Logger del módulo (setup_logging le añade los handlers al ejecutarlo como script)
+logger = logging.getLogger("reconcile_s3")
+
+
+def setup_logging():
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in (logging.FileHandler(LOG_FILE), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def tratar_huerfanos(db, s3_client, bucket, lote, accion, margen, stats):
+    """Aplica la acción a un lote de objetos huérfanos (como mucho TAMANO_LOTE_BORRADOS)"""
+    candidatos = [objeto for objeto in lote if not es_reciente(objeto, margen)]
+    stats["recientes"] += len(lote) - len(candidatos)
+    registrados = en_registro(db[IMAGES_COLLECTION], [objeto["Key"] for objeto in candidatos])
+    stats["en_registro"] += len(registrados)
+    claves = [objeto["Key"] for objeto in candidatos if objeto["Key"] not in registrados]
+    if accion == "informe" or not claves:
+        return
+
+    if accion == "cuarentena":
+        movidas = []
+        for clave in claves:
+            try:
+                poner_en_cuarentena(s3_client, bucket, clave)
+                movidas.append(clave)
+            except Exception as e:
+                logger.error(f"No se pudo poner en cuarentena {clave}: {str(e)}")
+                stats["errores"] += 1
+        claves = movidas
+        stats["cuarentena"] += len(claves)
+
+    ColaBorrados(db[S3_DELETIONS_COLLECTION]).encolar(bucket, claves)
+    stats["encolados"] += len(claves)
+
+
+def conciliar(db, s3_client, bucket, prefijo="", accion="informe", margen=MARGEN_CONCILIACION, informe=None):
+    """Cruza el bucket con el catálogo y trata los objetos huérfanos según `accion`.
+
+    Args:
+        db: Base de datos de MongoDB
+        s3_client: Cliente de boto3 para S3
+        bucket: Bucket a conciliar
+        prefijo: Limitar la conciliación a las claves con este prefijo
+        accion: "informe", "eliminar" o "cuarentena"
+        margen: Segundos durante los que un objeto nuevo no se trata como huérfano
+        informe: Ruta del CSV con cada objeto huérfano y cada referencia colgante (opcional)
+
+    Returns:
+        dict: Contadores de la conciliación
+    """
+    stats = {"huerfanos": 0, "bytes_huerfanos": 0, "colgantes": 0, "recientes": 0,
+             "en_registro": 0, "encolados": 0, "cuarentena": 0, "errores": 0}
+    salida = open(informe, "w", newline="", encoding="utf-8") if informe else None
+    escritor = csv.writer(salida) if salida else None
+    if escritor:
+        escritor.writerow(["tipo", "clave", "tamano", "modificado"])
+
+    try:
+        lote = []
+        resultados = cruzar(objetos_s3(s3_client, bucket, prefijo),
+                            claves_referenciadas(db[CATALOG_COLLECTION], bucket, prefijo))
+        for tipo, elemento in resultados:
+            if tipo == HUERFANO:
+                stats["huerfanos"] += 1
+                stats["bytes_huerfanos"] += elemento.get("Size", 0)
+                if escritor:
+                    escritor.writerow([tipo, elemento["Key"], elemento.get("Size"), elemento.get("LastModified")])
+                lote.append(elemento)
+                if len(lote) >= TAMANO_LOTE_BORRADOS:
+                    tratar_huerfanos(db, s3_client, bucket, lote, accion, margen, stats)
+                    lote = []
+            else:
+                stats["colgantes"] += 1
+                logger.warning(f"Referencia colgante (el objeto no existe): s3://{bucket}/{elemento}")
+                if escritor:
+                    escritor.writerow([tipo, elemento, "", ""])
+        if lote:
+            tratar_huerfanos(db, s3_client, bucket, lote, accion, margen, stats)
+    finally:
+        if salida:
+            salida.close()
+    return stats
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Concilia el bucket de S3 con las imágenes del catálogo")
+    parser.add_argument("--bucket", default=S3_BUCKET_NAME, help="Bucket a conciliar (por defecto, S3_BUCKET_NAME)")
+    parser.add_argument("--prefijo", default="", help="Conciliar solo las claves con este prefijo")
+    parser.add_argument("--accion", choices=ACCIONES, default="informe",
+                        help="Qué hacer con los objetos huérfanos (por defecto, solo informar)")
+    parser.add_argument("--margen", type=int, default=MARGEN_CONCILIACION,
+                        help="Segundos durante los que un objeto nuevo no se considera huérfano")
+    args = parser.parse_args()
+
+    if not args.bucket:
+        logger.error("No hay bucket: definir S3_BUCKET_NAME o usar --bucket")
+        sys.exit(1)
+
+    try:
+        client = MongoClient(MONGO_URI, tls=True, tlsCAFile=certifi.where(), server_api=ServerApi('1'))
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            region_name=os.getenv('AWS_REGION')
+        )
+        informe = os.path.join(BASE_DIR, "logs", f"reconcile_s3_{datetime.now():%Y%m%d_%H%M%S}.csv")
+        stats = conciliar(client[MONGO_DB], s3_client, args.bucket, args.prefijo, args.accion, args.margen, informe)
+        logger.info(f"Informe detallado: {informe}")
+        logger.info(f"=== Conciliación finalizada: {stats} ===")
+    except Exception as e:
+        logger.error(f"Error general en la ejecución: {str(e)}", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Utilidades de la API de registros (/api/tables/<id>/records).
+
+Los registros se envían en streaming a partir de un cursor de MongoDB, como
+NDJSON (un registro JSON por línea) o como un único documento JSON escrito por
+partes, de modo que la memoria del servidor no depende del tamaño de la tabla.
+Cada registro incluye "_cursor", que permite reanudar la descarga justo
+después de él con el parámetro `after`. Los filtros usan la misma sintaxis
+que el listado del catálogo (ver catalog_query.py).
+"""
+
+import json
+
+from catalog_records import CAMPO_ORDEN, campo_seguro
+from pagination import codificar_cursor
+
+FORMATOS = ("ndjson", "json")
+
+
+def campos_solicitados(headers, fields):
+    """Devuelve los encabezados pedidos en el parámetro `fields`.
+
+    Args:
+        headers: Encabezados de la tabla
+        fields: Valor del parámetro (nombres separados por comas) o None para todos
+
+    Returns:
+        list: Encabezados a devolver
+
+    Raises:
+        ValueError: Si se pide un campo que no es un encabezado de la tabla
+    """
+    if not fields:
+        return list(headers)
+    pedidos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+    desconocidos = [campo for campo in pedidos if campo not in headers and campo != "Imagenes"]
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}")
+    return pedidos
+
+
+def serializar_registro(registro, campos):
+    """Convierte un registro de MongoDB en el dict que se envía por la API.
+
+    Las claves son los nombres originales de los encabezados, no los nombres saneados.
+    """
+    salida = {"_id": str(registro["_id"]), "Número": registro.get("Número")}
+    for header in campos:
+        salida[header] = registro.get(campo_seguro(header))
+    salida["_cursor"] = codificar_cursor([registro.get(CAMPO_ORDEN)])
+    return salida
+
+
+def _dumps(valor):
+    return json.dumps(valor, ensure_ascii=False, default=str)
+
+
+def generar_ndjson(cursor, campos):
+    """Genera una línea JSON por registro"""
+    for registro in cursor:
+        yield _dumps(serializar_registro(registro, campos)) + "\n"
+
+
+def generar_json(cursor, campos, limite=None):
+    """Genera un documento {"records": [...], "next_cursor": ...} por partes.
+
+    `next_cursor` es el cursor del último registro enviado cuando la respuesta se
+    ha cortado por `limite`, o null si se ha llegado al final de la tabla.
+    """
+    yield '{"records": ['
+    enviados = 0
+    ultimo = None
+    for registro in cursor:
+        if limite is not None and enviados >= limite:
+            yield f'], "next_cursor": {_dumps(ultimo)}}}'
+            return
+        salida = serializar_registro(registro, campos)
+        yield ("," if enviados else "") + _dumps(salida)
+        ultimo = salida["_cursor"]
+        enviados += 1
+    yield '], "next_cursor": null}'
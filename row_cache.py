@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de las filas ya renderizadas del listado del catálogo.
+
+Renderizar la tabla de index.html recorre cada registro × encabezado y decide
+para cada imagen si está en S3 o en local. Como la mayoría de las filas no
+cambian entre peticiones, el HTML de cada fila se guarda por `_id` junto con
+una huella del contenido del registro: la página se monta con las filas
+cacheadas y solo se renderizan las que no están o cuya huella ha cambiado.
+
+La huella hace que una fila editada por otro proceso se vuelva a renderizar
+sin necesidad de invalidarla; las ediciones de este proceso invalidan además
+la fila de forma explícita para liberar la entrada antigua.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from bson import json_util
+from markupsafe import Markup
+
+from catalog_records import campo_seguro
+
+TAMANO_CACHE_FILAS = int(os.getenv("ROW_CACHE_SIZE", "5000"))
+
+# Plantilla con las celdas de una fila
+PLANTILLA_FILA = "_fila_registro.html"
+
+
+def huella_registro(registro, campos, variante=""):
+    """Huella del contenido de un registro y de los campos con que se muestra"""
+    datos = json_util.dumps([campos, variante, registro], sort_keys=True)
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+
+class CacheFilas:
+    """Caché LRU de filas renderizadas, segura entre hilos.
+
+    Args:
+        maximo: Número máximo de filas guardadas
+    """
+
+    def __init__(self, maximo=TAMANO_CACHE_FILAS):
+        self.maximo = maximo
+        self._filas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _obtener(self, clave, huella):
+        with self._lock:
+            entrada = self._filas.get(clave)
+            if entrada is not None and entrada[0] == huella:
+                self._filas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+            return None
+
+    def _guardar(self, clave, huella, html):
+        with self._lock:
+            self._filas[clave] = (huella, html)
+            self._filas.move_to_end(clave)
+            while len(self._filas) > self.maximo:
+                self._filas.popitem(last=False)
+
+    def iterar(self, plantilla, registros, headers, variante="", **contexto):
+        """Genera (registro, HTML de sus celdas) a medida que se consumen los registros.
+
+        Admite un cursor de MongoDB: los registros se leen y renderizan de uno en
+        uno, sin cargar la página completa en memoria.
+
+        Args:
+            plantilla: Plantilla de Jinja de una fila (PLANTILLA_FILA)
+            registros: Registros (lista o cursor)
+            headers: Encabezados de la tabla
+            variante: Valor que forma parte de la huella además del registro (p. ej. la
+                ventana de las URLs de las imágenes, que cambian aunque el registro no)
+            **contexto: Variables adicionales para la plantilla
+        """
+        campos = [campo_seguro(header) for header in headers]
+        for registro in registros:
+            clave = str(registro.get("_id"))
+            huella = huella_registro(registro, campos, variante)
+            html = self._obtener(clave, huella)
+            if html is None:
+                html = Markup(plantilla.render(item=registro, campos=campos, **contexto))
+                self._guardar(clave, huella, html)
+            yield registro, html
+
+    def renderizar(self, plantilla, registros, headers, variante="", **contexto):
+        """Devuelve el HTML de las celdas de cada registro, usando las filas cacheadas.
+
+        Returns:
+            list: Markup de cada fila, en el orden de `registros`
+        """
+        return [html for _, html in self.iterar(plantilla, registros, headers, variante, **contexto)]
+
+    def invalidar(self, registro_id=None):
+        """Elimina la fila de un registro (o todas si no se indica)"""
+        with self._lock:
+            if registro_id is None:
+                self._filas.clear()
+            else:
+                self._filas.pop(str(registro_id), None)
+
+    def estadisticas(self):
+        """Devuelve los contadores de uso de la caché"""
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(self._filas),
+                "maximo": self.maximo,
+            }
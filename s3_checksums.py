@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Subidas a S3 verificadas con suma de comprobación en la propia petición PUT.
+
+En lugar de subir el objeto y confirmar después con head_object (una llamada
+más por imagen), se calcula el SHA-256 del contenido leyéndolo por bloques y
+se envía en la cabecera x-amz-checksum-sha256: S3 recalcula la suma al recibir
+los bytes y rechaza la subida (BadDigest) si no coincide. Una respuesta
+correcta garantiza que el objeto está guardado íntegro.
+
+La suma y el tamaño se guardan en el registro, en "ImagenesIntegridad",
+alineados con "Imagenes" (una entrada {"sha256": ..., "tamano": ...} o None).
+"""
+
+import base64
+import hashlib
+
+TAMANO_BLOQUE = 1024 * 1024
+
+
+def suma_sha256(fileobj, tamano_bloque=TAMANO_BLOQUE):
+    """Calcula el SHA-256 de un objeto tipo archivo leyéndolo por bloques.
+
+    El objeto se lee desde el principio y se deja de nuevo al principio.
+
+    Returns:
+        tuple: (suma en base64 como la espera S3, tamaño en bytes)
+    """
+    suma = hashlib.sha256()
+    tamano = 0
+    fileobj.seek(0)
+    for bloque in iter(lambda: fileobj.read(tamano_bloque), b""):
+        suma.update(bloque)
+        tamano += len(bloque)
+    fileobj.seek(0)
+    return base64.b64encode(suma.digest()).decode("ascii"), tamano
+
+
+def subir_con_suma(cliente, bucket, clave, fileobj, integridad=None, **extra):
+    """Sube un objeto a S3 con su SHA-256 para que S3 verifique la integridad al recibirlo.
+
+    Args:
+        cliente: Cliente de boto3 para S3
+        bucket: Bucket de destino
+        clave: Clave del objeto
+        fileobj: Objeto tipo archivo con posibilidad de seek
+        integridad: {"sha256": ..., "tamano": ...} ya calculados del contenido (si no, se calculan aquí)
+        **extra: Parámetros adicionales de put_object (ContentType, CacheControl...)
+
+    Returns:
+        dict: {"sha256": ..., "tamano": ...} del objeto subido
+
+    Raises:
+        botocore.exceptions.ClientError: Si S3 rechaza la subida (incluida una suma que no coincide)
+        ValueError: Si S3 confirma una suma distinta de la enviada
+    """
+    if integridad:
+        suma, tamano = integridad["sha256"], integridad["tamano"]
+        fileobj.seek(0)
+    else:
+        suma, tamano = suma_sha256(fileobj)
+    respuesta = cliente.put_object(
+        Bucket=bucket, Key=clave, Body=fileobj, ContentLength=tamano, ChecksumSHA256=suma, **extra
+    )
+    confirmada = respuesta.get("ChecksumSHA256")
+    if confirmada and confirmada != suma:
+        raise ValueError(f"S3 confirmó una suma distinta para {clave}")
+    return {"sha256": suma, "tamano": tamano}
+
+
+def integridad_cabecera(cabecera):
+    """Suma y tamaño de un objeto a partir de la respuesta de head_object (con ChecksumMode="ENABLED")"""
+    return {"sha256": cabecera.get("ChecksumSHA256"), "tamano": cabecera.get("ContentLength")}
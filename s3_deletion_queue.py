@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Cola persistente de borrados de objetos de S3, procesada por lotes en segundo plano.
+
+Eliminar una imagen ya no llama a delete_object dentro de la petición: sus
+claves (original y derivados) se guardan en una colección de MongoDB y un hilo
+de fondo las borra agrupadas en llamadas a delete_objects de hasta 1000 claves.
+Así las peticiones de borrado responden al momento y una limpieza masiva cuesta
+unas pocas llamadas a S3 en lugar de miles.
+
+Cada documento de la cola es una clave:
+
+    {"_id": "<bucket>/<clave>", "bucket": ..., "clave": ..., "imagen": <_id en el registro de imágenes>,
+     "estado": "pendiente", "intentos": 0, "siguiente": <fecha del próximo intento>, "creado": <fecha>}
+
+Los lotes se reclaman con un token (varios procesos pueden vaciar la cola a la
+vez). Las claves que S3 no consigue borrar se reintentan con espera exponencial
+y, agotados los intentos, pasan al estado "fallido" con el último error.
+
+Justo antes de cada delete_objects se vuelve a consultar el registro de
+imágenes. Solo se encolan claves de imágenes que no están en el registro (la
+recogida de basura retira la entrada antes de encolar), así que si la imagen
+de una clave ("imagen") vuelve a tener entrada es que se ha subido otra vez el
+mismo contenido mientras tanto: la clave se retira de la cola sin borrarla.
+"""
+
+import os
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+from botocore.exceptions import ClientError
+from pymongo import UpdateOne
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+FALLIDO = "fallido"
+
+# Máximo de claves por llamada a delete_objects (límite de S3)
+TAMANO_LOTE_BORRADOS = 1000
+MAXIMO_INTENTOS_BORRADO = int(os.getenv("S3_DELETE_MAX_ATTEMPTS", "8"))
+# Segundos tras los que un lote reclamado y no terminado vuelve a la cola
+RECLAMO_BORRADOS_CADUCADO = int(os.getenv("S3_DELETE_CLAIM_TIMEOUT", "600"))
+# Segundos entre pasadas del hilo de fondo (también se despierta al encolar)
+INTERVALO_BORRADOS = float(os.getenv("S3_DELETE_INTERVAL", "10"))
+
+
+class ColaBorrados:
+    """Cola de claves de S3 pendientes de borrar, guardada en una colección de MongoDB.
+
+    Args:
+        coleccion: Colección de la cola
+        maximo_intentos: Intentos de borrado antes de marcar una clave como fallida
+        reloj: Función que devuelve la fecha actual (para tests)
+    """
+
+    def __init__(self, coleccion, maximo_intentos=MAXIMO_INTENTOS_BORRADO, reloj=datetime.utcnow):
+        self.coleccion = coleccion
+        self.maximo_intentos = maximo_intentos
+        self._reloj = reloj
+        self.aviso = threading.Event()
+
+    def encolar(self, bucket, claves, imagen=None):
+        """Añade claves a la cola (una clave ya encolada no se duplica).
+
+        Args:
+            bucket: Bucket de las claves
+            claves: Claves a borrar (p. ej. un original y sus derivados)
+            imagen: _id en el registro de imágenes de la imagen a la que pertenecen las claves
+
+        Returns:
+            int: Número de claves nuevas en la cola
+        """
+        ahora = self._reloj()
+        operaciones = [
+            UpdateOne(
+                {"_id": f"{bucket}/{clave}"},
+                {"$setOnInsert": {"bucket": bucket, "clave": clave, "imagen": imagen, "estado": PENDIENTE,
+                                  "intentos": 0, "siguiente": ahora, "creado": ahora}},
+                upsert=True,
+            )
+            for clave in dict.fromkeys(claves)
+        ]
+        if not operaciones:
+            return 0
+        resultado = self.coleccion.bulk_write(operaciones, ordered=False)
+        self.aviso.set()
+        return resultado.upserted_count
+
+    def cancelar(self, bucket, claves):
+        """Retira de la cola claves que se vuelven a usar (p. ej. una imagen que se sube de nuevo).
+
+        Las claves de un lote que ya se está procesando no se pueden retirar.
+        """
+        self.coleccion.delete_many({"_id": {"$in": [f"{bucket}/{clave}" for clave in claves]},
+                                    "estado": {"$ne": PROCESANDO}})
+
+    def reclamar(self, tamano=TAMANO_LOTE_BORRADOS):
+        """Reclama un lote de claves listas para borrar.
+
+        Antes devuelve a la cola los lotes reclamados hace más de RECLAMO_BORRADOS_CADUCADO segundos.
+
+        Returns:
+            list: Documentos reclamados
+        """
+        ahora = self._reloj()
+        self.coleccion.update_many(
+            {"estado": PROCESANDO, "reclamado": {"$lt": ahora - timedelta(seconds=RECLAMO_BORRADOS_CADUCADO)}},
+            {"$set": {"estado": PENDIENTE}, "$unset": {"token": ""}}
+        )
+        candidatos = self.coleccion.find(
+            {"estado": PENDIENTE, "siguiente": {"$lte": ahora}}, {"_id": 1}
+        ).sort("siguiente", 1).limit(tamano)
+        ids = [documento["_id"] for documento in candidatos]
+        if not ids:
+            return []
+        # Solo se quedan con este token los documentos que nadie ha reclamado entretanto
+        token = secrets.token_hex(8)
+        self.coleccion.update_many(
+            {"_id": {"$in": ids}, "estado": PENDIENTE},
+            {"$set": {"estado": PROCESANDO, "token": token, "reclamado": ahora}}
+        )
+        return list(self.coleccion.find({"token": token}))
+
+    def fallidos(self, documentos, errores):
+        """Registra un intento fallido: espera exponencial o estado "fallido" si se agotan los intentos.
+
+        Args:
+            documentos: Documentos de la cola que no se han podido borrar
+            errores: Dict clave -> mensaje de error de S3
+
+        Returns:
+            tuple: (claves que se reintentarán, claves marcadas como fallidas)
+        """
+        ahora = self._reloj()
+        operaciones = []
+        reintentos = fallidos = 0
+        for documento in documentos:
+            intentos = documento.get("intentos", 0) + 1
+            cambios = {"intentos": intentos, "error": errores.get(documento["clave"], "")}
+            if intentos >= self.maximo_intentos:
+                cambios["estado"] = FALLIDO
+                fallidos += 1
+            else:
+                cambios.update(estado=PENDIENTE, siguiente=ahora + timedelta(seconds=min(2 ** intentos * 30, 6 * 3600)))
+                reintentos += 1
+            operaciones.append(UpdateOne({"_id": documento["_id"]}, {"$set": cambios, "$unset": {"token": ""}}))
+        if operaciones:
+            self.coleccion.bulk_write(operaciones, ordered=False)
+        return reintentos, fallidos
+
+    def estadisticas(self):
+        """Número de claves de la cola por estado"""
+        conteo = {PENDIENTE: 0, PROCESANDO: 0, FALLIDO: 0}
+        for grupo in self.coleccion.aggregate([{"$group": {"_id": "$estado", "total": {"$sum": 1}}}]):
+            conteo[grupo["_id"]] = grupo["total"]
+        return conteo
+
+
+def en_uso(imagenes, documentos):
+    """Imágenes de un lote de la cola que vuelven a estar en el registro de imágenes.
+
+    Basta con que exista la entrada (aunque tenga cero referencias): desde que se
+    creó, el objeto lo gestiona la recogida de basura del registro.
+    """
+    ids = list({d["imagen"] for d in documentos if d.get("imagen")})
+    if imagenes is None or not ids:
+        return set()
+    return {e["_id"] for e in imagenes.find({"_id": {"$in": ids}}, {"_id": 1})}
+
+
+def procesar_cola_borrados(cola, cliente, tamano_lote=TAMANO_LOTE_BORRADOS, imagenes=None, cache=None):
+    """Vacía la cola de borrados con llamadas a delete_objects de hasta `tamano_lote` claves.
+
+    Args:
+        cola: ColaBorrados
+        cliente: Cliente de boto3 para S3
+        tamano_lote: Claves por lote (como máximo 1000)
+        imagenes: Colección del registro de imágenes; las claves de imágenes que vuelven
+            a estar en el registro se retiran de la cola sin borrarlas
+        cache: CacheObjetosS3 de la que se descartan los objetos borrados (opcional)
+
+    Returns:
+        dict: Número de claves borradas, que se reintentarán, marcadas como fallidas y
+        retiradas por estar otra vez en uso
+    """
+    resumen = {"borrados": 0, "reintentos": 0, "fallidos": 0, "en_uso": 0}
+    while True:
+        documentos = cola.reclamar(min(tamano_lote, TAMANO_LOTE_BORRADOS))
+        if not documentos:
+            return resumen
+        # Comprobación justo antes de borrar: una subida del mismo contenido puede haber
+        # vuelto a usar la imagen después de encolarla (cancelar no retira lotes reclamados)
+        usadas = en_uso(imagenes, documentos)
+        if usadas:
+            retiradas = [d["_id"] for d in documentos if d.get("imagen") in usadas]
+            cola.coleccion.delete_many({"_id": {"$in": retiradas}})
+            resumen["en_uso"] += len(retiradas)
+            documentos = [d for d in documentos if d.get("imagen") not in usadas]
+
+        por_bucket = {}
+        for documento in documentos:
+            por_bucket.setdefault(documento["bucket"], []).append(documento)
+
+        for bucket, grupo in por_bucket.items():
+            try:
+                respuesta = cliente.delete_objects(
+                    Bucket=bucket,
+                    Delete={"Objects": [{"Key": d["clave"]} for d in grupo], "Quiet": True},
+                )
+                # En modo "Quiet" la respuesta solo enumera las claves que no se han borrado
+                errores = {e["Key"]: f"{e.get('Code')}: {e.get('Message')}" for e in respuesta.get("Errors", [])}
+            except ClientError as e:
+                errores = {d["clave"]: str(e) for d in grupo}
+
+            borrados = [d["_id"] for d in grupo if d["clave"] not in errores]
+            if cache:
+                for documento in grupo:
+                    if documento["clave"] not in errores:
+                        cache.descartar(bucket, documento["clave"])
+            if borrados:
+                cola.coleccion.delete_many({"_id": {"$in": borrados}})
+                resumen["borrados"] += len(borrados)
+            reintentos, fallidos = cola.fallidos([d for d in grupo if d["clave"] in errores], errores)
+            resumen["reintentos"] += reintentos
+            resumen["fallidos"] += fallidos
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Caché local en disco de objetos de S3, acotada por tamaño total.
+
+La exportación a ZIP, la generación de derivados y los scripts de diagnóstico
+leen imágenes de S3; sin caché, cada exportación del mismo catálogo volvía a
+descargar todos sus originales. Aquí cada objeto leído se guarda en disco:
+
+    <directorio>/<xx>/<sha256 de "bucket/clave">.obj    contenido
+    <directorio>/<xx>/<sha256 de "bucket/clave">.json   bucket, clave, ETag, tipo, tamaño y última validación
+
+- Escrituras atómicas: el contenido se descarga a un fichero temporal único y
+  se publica con os.replace, y el .json se escribe después; varios procesos
+  (workers de gunicorn, scripts) pueden compartir el directorio.
+- Validación por ETag: pasados S3_CACHE_REVALIDATE segundos desde la última
+  validación se pide el objeto con If-None-Match; si S3 responde 304 no se
+  descarga nada. Las claves direccionadas por contenido ("sha256/...") no
+  cambian nunca y no se revalidan.
+- Expulsión LRU por bytes: cada acierto actualiza la fecha de modificación del
+  fichero y, cuando el total supera el máximo, se borran los menos usados
+  hasta bajar del 90 %.
+- Los objetos borrados de S3 se descartan de la caché (`descartar`): las claves
+  por contenido no se revalidan y, sin ello, se seguirían sirviendo.
+
+Los objetos se devuelven abiertos: un fichero abierto sigue siendo legible
+aunque otro proceso lo expulse de la caché a continuación.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from image_store import es_clave_contenido
+
+DIRECTORIO_CACHE_S3 = os.getenv(
+    "S3_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_s3")
+)
+TAMANO_CACHE_S3 = int(os.getenv("S3_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Segundos durante los que un objeto cacheado se usa sin preguntar a S3 si ha cambiado
+REVALIDACION_CACHE_S3 = int(os.getenv("S3_CACHE_REVALIDATE", "300"))
+
+# Códigos con los que boto3 informa de una respuesta 304 a If-None-Match
+NO_MODIFICADO = ("304", "NotModified")
+# Los temporales más antiguos son de descargas interrumpidas
+TEMPORAL_ABANDONADO = 3600
+
+
+def _escribir_atomico(ruta, datos):
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def _leer_meta(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class CacheObjetosS3:
+    """Caché de lectura de objetos de S3 en disco, con expulsión LRU por bytes.
+
+    Args:
+        cliente: Cliente de boto3 para S3
+        directorio: Carpeta de la caché (se crea si no existe)
+        maximo_bytes: Tamaño total máximo de los objetos cacheados
+        revalidar: Segundos entre validaciones del ETag de un objeto
+        reloj: Función que devuelve el instante actual en segundos (para tests)
+    """
+
+    def __init__(self, cliente, directorio=DIRECTORIO_CACHE_S3, maximo_bytes=TAMANO_CACHE_S3,
+                 revalidar=REVALIDACION_CACHE_S3, reloj=time.time):
+        self.cliente = cliente
+        self.directorio = directorio
+        self.maximo_bytes = maximo_bytes
+        self.revalidar = revalidar
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._ocupado = None
+        self._contadores = {"aciertos": 0, "revalidados": 0, "descargas": 0, "bytes_descargados": 0, "expulsados": 0}
+        os.makedirs(directorio, exist_ok=True)
+
+    def _rutas(self, bucket, clave):
+        nombre = hashlib.sha256(f"{bucket}/{clave}".encode("utf-8")).hexdigest()
+        base = os.path.join(self.directorio, nombre[:2], nombre)
+        return f"{base}.obj", f"{base}.json"
+
+    def _contar(self, contador, cantidad=1):
+        with self._lock:
+            self._contadores[contador] += cantidad
+
+    def abrir(self, bucket, clave):
+        """Devuelve el contenido de un objeto como fichero binario abierto (a cerrar por quien llama).
+
+        Raises:
+            ClientError: Si S3 no devuelve el objeto
+        """
+        datos, meta = self._rutas(bucket, clave)
+        entrada = _leer_meta(meta)
+        respuesta = None
+        if entrada and not es_clave_contenido(clave) and self._reloj() - entrada["validado"] >= self.revalidar:
+            try:
+                respuesta = self.cliente.get_object(Bucket=bucket, Key=clave, IfNoneMatch=entrada["etag"])
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in NO_MODIFICADO:
+                    raise
+                entrada["validado"] = self._reloj()
+                _escribir_atomico(meta, json.dumps(entrada).encode("utf-8"))
+                self._contar("revalidados")
+
+        if entrada and respuesta is None:
+            try:
+                archivo = open(datos, "rb")
+            except FileNotFoundError:
+                pass
+            else:
+                # La fecha de modificación es la del último uso (orden LRU)
+                try:
+                    os.utime(datos)
+                except FileNotFoundError:
+                    pass
+                self._contar("aciertos")
+                return archivo
+
+        if respuesta is None:
+            respuesta = self.cliente.get_object(Bucket=bucket, Key=clave)
+        return self._guardar(bucket, clave, respuesta, datos, meta)
+
+    def leer(self, bucket, clave):
+        """Devuelve el contenido de un objeto en bytes"""
+        with self.abrir(bucket, clave) as archivo:
+            return archivo.read()
+
+    def tipo(self, bucket, clave):
+        """Content-Type de un objeto cacheado, o None si no está en la caché"""
+        entrada = _leer_meta(self._rutas(bucket, clave)[1])
+        return entrada.get("tipo") if entrada else None
+
+    def descartar(self, bucket, clave):
+        """Quita un objeto de la caché (tras borrarlo de S3).
+
+        Returns:
+            bool: True si el objeto estaba en la caché
+        """
+        datos, meta = self._rutas(bucket, clave)
+        tamano = None
+        try:
+            tamano = os.path.getsize(datos)
+            os.remove(datos)
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(meta)
+        except FileNotFoundError:
+            pass
+        if tamano is None:
+            return False
+        with self._lock:
+            if self._ocupado is not None:
+                self._ocupado = max(self._ocupado - tamano, 0)
+        return True
+
+    def _guardar(self, bucket, clave, respuesta, datos, meta):
+        """Guarda en la caché el cuerpo de una respuesta de get_object y lo devuelve abierto"""
+        tamano = respuesta.get("ContentLength", 0)
+        self._contar("descargas")
+        self._contar("bytes_descargados", tamano)
+        if tamano > self.maximo_bytes:
+            # No cabe en la caché: se sirve desde un temporal anónimo
+            archivo = tempfile.TemporaryFile()
+            shutil.copyfileobj(respuesta["Body"], archivo)
+            archivo.seek(0)
+            return archivo
+
+        os.makedirs(os.path.dirname(datos), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(datos), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                shutil.copyfileobj(respuesta["Body"], f)
+            os.replace(temporal, datos)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        entrada = {"bucket": bucket, "clave": clave, "etag": respuesta.get("ETag"),
+                   "tipo": respuesta.get("ContentType"), "tamano": tamano, "validado": self._reloj()}
+        _escribir_atomico(meta, json.dumps(entrada).encode("utf-8"))
+
+        # Se abre antes de recortar: aunque se expulse, el fichero abierto sigue siendo legible
+        archivo = open(datos, "rb")
+        self._ocupar(tamano)
+        return archivo
+
+    def _ocupar(self, tamano):
+        with self._lock:
+            if self._ocupado is None:
+                self._ocupado = self._recorrer()[1]
+            else:
+                self._ocupado += tamano
+            if self._ocupado > self.maximo_bytes:
+                self._recortar()
+
+    def _recorrer(self):
+        """Lista los objetos de la caché (ruta, tamaño, último uso) y su tamaño total.
+
+        Borra de paso los temporales de descargas interrumpidas.
+        """
+        objetos = []
+        total = 0
+        ahora = time.time()
+        for subdirectorio in os.scandir(self.directorio):
+            if not subdirectorio.is_dir():
+                continue
+            for fichero in os.scandir(subdirectorio.path):
+                try:
+                    estado = fichero.stat()
+                    if fichero.name.endswith(".obj"):
+                        objetos.append((fichero.path, estado.st_size, estado.st_mtime))
+                        total += estado.st_size
+                    elif fichero.name.endswith(".tmp") and ahora - estado.st_mtime > TEMPORAL_ABANDONADO:
+                        os.remove(fichero.path)
+                except FileNotFoundError:
+                    # Otro proceso lo ha expulsado o publicado entretanto
+                    continue
+        return objetos, total
+
+    def _recortar(self):
+        """Expulsa los objetos usados hace más tiempo hasta bajar del 90 % del máximo (con el lock tomado)"""
+        objetos, total = self._recorrer()
+        objetivo = self.maximo_bytes * 0.9
+        for ruta, tamano, _ in sorted(objetos, key=lambda objeto: objeto[2]):
+            if total <= objetivo:
+                break
+            for fichero in (ruta, f"{ruta[:-len('.obj')]}.json"):
+                try:
+                    os.remove(fichero)
+                except FileNotFoundError:
+                    pass
+            total -= tamano
+            self._contadores["expulsados"] += 1
+        self._ocupado = total
+
+    def estadisticas(self):
+        """Contadores de la caché y bytes ocupados"""
+        with self._lock:
+            if self._ocupado is None:
+                self._ocupado = self._recorrer()[1]
+            return dict(self._contadores, ocupado=self._ocupado, maximo=self.maximo_bytes)
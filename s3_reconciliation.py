@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Conciliación en los dos sentidos entre un bucket de S3 y el catálogo.
+
+Compara los objetos del bucket con las rutas "s3://" que usan los registros
+(en "Imagenes" y en "ImagenesDerivadas") y encuentra:
+
+- Objetos huérfanos: están en S3 pero ningún registro los usa
+- Referencias colgantes: un registro usa un objeto que ya no está en S3
+
+Ninguno de los dos lados se carga en memoria. list_objects_v2 devuelve las
+claves ordenadas por sus bytes UTF-8 y MongoDB ordena las cadenas de la misma
+forma (comparación binaria, sin collation), así que ambos se recorren como
+flujos ordenados y se cruzan con un merge-join: la memoria es la de una página
+de S3 y un lote del cursor, haya mil claves o millones.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from catalog_records import CAMPO_DERIVADOS
+from image_derivatives import VARIANTES
+
+HUERFANO = "huerfano"
+COLGANTE = "colgante"
+
+# Prefijo al que se mueven los objetos huérfanos en cuarentena (no se concilia)
+PREFIJO_CUARENTENA = os.getenv("S3_QUARANTINE_PREFIX", "cuarentena").strip("/")
+# Segundos durante los que un objeto recién subido no se considera huérfano
+# (subidas directas o del spool cuyo registro aún no se ha guardado)
+MARGEN_CONCILIACION = int(os.getenv("S3_RECONCILE_GRACE", str(24 * 3600)))
+
+
+def objetos_s3(cliente, bucket, prefijo=""):
+    """Recorre los objetos de un bucket, página a página y en orden de clave.
+
+    Los objetos en cuarentena se omiten.
+
+    Yields:
+        dict: Objeto de la respuesta de list_objects_v2 ("Key", "Size", "LastModified", ...)
+    """
+    paginador = cliente.get_paginator("list_objects_v2")
+    for pagina in paginador.paginate(Bucket=bucket, Prefix=prefijo):
+        for objeto in pagina.get("Contents", []):
+            if not objeto["Key"].startswith(f"{PREFIJO_CUARENTENA}/"):
+                yield objeto
+
+
+def claves_referenciadas(coleccion, bucket, prefijo="", tamano_lote=1000):
+    """Recorre, sin repetir y en orden, las claves del bucket que usan los registros.
+
+    La extracción, la deduplicación y la ordenación se hacen en el servidor
+    (con allowDiskUse, para que no dependan de la memoria de MongoDB).
+
+    Yields:
+        str: Clave de S3
+    """
+    inicio = f"s3://{bucket}/"
+    # "Imagenes" y las rutas de cada variante de "ImagenesDerivadas" en una sola lista
+    rutas = [{"$ifNull": ["$Imagenes", []]}] + [
+        {"$map": {"input": {"$ifNull": [f"${CAMPO_DERIVADOS}", []]}, "as": "d", "in": f"$$d.{variante}"}}
+        for variante in VARIANTES
+    ]
+    cursor = coleccion.aggregate([
+        {"$project": {"rutas": {"$concatArrays": rutas}}},
+        {"$unwind": "$rutas"},
+        {"$match": {"rutas": {"$type": "string", "$regex": "^" + re.escape(f"{inicio}{prefijo}")}}},
+        {"$group": {"_id": {"$substrCP": ["$rutas", len(inicio), {"$strLenCP": "$rutas"}]}}},
+        {"$sort": {"_id": 1}},
+    ], allowDiskUse=True, batchSize=tamano_lote)
+    for grupo in cursor:
+        yield grupo["_id"]
+
+
+def _en_orden(claves, origen):
+    """Comprueba que un flujo de claves llega ordenado (el merge-join depende de ello).
+
+    Raises:
+        ValueError: Si una clave es menor que la anterior
+    """
+    anterior = None
+    for clave, elemento in claves:
+        if anterior is not None and clave < anterior:
+            raise ValueError(f"Las claves de {origen} no están ordenadas: {anterior!r} > {clave!r}")
+        anterior = clave
+        yield clave, elemento
+
+
+def cruzar(objetos, referencias):
+    """Merge-join de los objetos de S3 con las claves referenciadas, ambos ordenados.
+
+    Args:
+        objetos: Iterable ordenado de objetos de list_objects_v2
+        referencias: Iterable ordenado y sin repetidos de claves referenciadas
+
+    Yields:
+        tuple: (HUERFANO, objeto) o (COLGANTE, clave)
+    """
+    objetos = _en_orden(((objeto["Key"], objeto) for objeto in objetos), "S3")
+    referencias = _en_orden(((clave, clave) for clave in referencias), "MongoDB")
+    objeto = next(objetos, None)
+    referencia = next(referencias, None)
+    while objeto is not None or referencia is not None:
+        if referencia is None or (objeto is not None and objeto[0] < referencia[0]):
+            yield HUERFANO, objeto[1]
+            objeto = next(objetos, None)
+        elif objeto is None or referencia[0] < objeto[0]:
+            yield COLGANTE, referencia[1]
+            referencia = next(referencias, None)
+        else:
+            objeto = next(objetos, None)
+            referencia = next(referencias, None)
+
+
+def es_reciente(objeto, margen=MARGEN_CONCILIACION, ahora=None):
+    """Indica si un objeto se ha modificado hace menos de `margen` segundos"""
+    ahora = ahora or datetime.now(timezone.utc)
+    return objeto["LastModified"] > ahora - timedelta(seconds=margen)
+
+
+def en_registro(imagenes, claves):
+    """Claves de una lista que tienen entrada en el registro de imágenes.
+
+    Sus objetos los recoge la recogida de basura del registro (clean_images_scheduled.py),
+    que sabe si alguien los ha vuelto a usar; la conciliación no los toca.
+    """
+    return {entrada["_id"] for entrada in imagenes.find({"_id": {"$in": list(claves)}}, {"_id": 1})}
+
+
+def poner_en_cuarentena(cliente, bucket, clave):
+    """Copia un objeto bajo PREFIJO_CUARENTENA (el original se borra aparte, por lotes).
+
+    Returns:
+        str: Clave del objeto en cuarentena
+    """
+    destino = f"{PREFIJO_CUARENTENA}/{clave}"
+    cliente.copy_object(Bucket=bucket, Key=destino, CopySource={"Bucket": bucket, "Key": clave})
+    return destino
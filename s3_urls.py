@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+URLs prefirmadas estables para mostrar las imágenes de S3 directamente en las páginas.
+
+Una URL prefirmada cambia cada vez que se firma (incluye la fecha de firma),
+así que si se firma en cada petición el navegador nunca reutiliza la imagen
+de su caché. Aquí el tiempo se divide en ventanas de S3_URL_WINDOW segundos:
+la primera vez que se pide un objeto en una ventana se firma una URL que
+caduca al final de la ventana siguiente, y esa misma URL se sirve durante toda
+la ventana desde una caché LRU acotada. Así:
+
+- Las páginas enlazan a S3 sin pasar por /imagenes_subidas (sin redirección)
+- Un mismo objeto tiene la misma URL durante la ventana y el navegador la cachea
+  (la respuesta de S3 lleva Cache-Control con la duración de la ventana)
+- Una URL incluida en una página sigue siendo válida al menos una ventana completa
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+VENTANA_URLS = int(os.getenv("S3_URL_WINDOW", "3600"))
+TAMANO_CACHE_URLS = int(os.getenv("S3_URL_CACHE_SIZE", "10000"))
+
+# Caducidad máxima de una URL prefirmada con SigV4 (7 días)
+CADUCIDAD_MAXIMA = 7 * 24 * 3600
+
+
+def clave_s3(ruta):
+    """Devuelve (bucket, clave) de una ruta "s3://bucket/clave", o None si no es de S3"""
+    if not ruta or not ruta.startswith("s3://"):
+        return None
+    partes = ruta[len("s3://"):].split("/", 1)
+    if len(partes) != 2 or not partes[1]:
+        return None
+    return partes[0], partes[1]
+
+
+class FirmadorUrls:
+    """Firma URLs de lectura de S3 estables por ventana de tiempo, con caché LRU.
+
+    Args:
+        cliente: Cliente de boto3 para S3
+        bucket: Bucket por defecto (para claves sin bucket)
+        ventana: Segundos durante los que se reutiliza la misma URL
+        maximo: Número máximo de URLs guardadas
+        reloj: Función que devuelve el instante actual en segundos (para tests)
+    """
+
+    def __init__(self, cliente, bucket, ventana=VENTANA_URLS, maximo=TAMANO_CACHE_URLS, reloj=time.time):
+        self.cliente = cliente
+        self.bucket = bucket
+        self.ventana = min(ventana, CADUCIDAD_MAXIMA // 2)
+        self.maximo = maximo
+        self._reloj = reloj
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.firmas = 0
+
+    def ventana_actual(self):
+        """Índice de la ventana de tiempo actual (sirve también para invalidar fragmentos cacheados)"""
+        return int(self._reloj() // self.ventana)
+
+    def _firmar(self, bucket, clave, ventana):
+        # La URL caduca al final de la ventana siguiente, sea cual sea el momento de la firma
+        caduca = (ventana + 2) * self.ventana
+        try:
+            return self.cliente.generate_presigned_url(
+                "get_object",
+                Params={
+                    "Bucket": bucket,
+                    "Key": clave,
+                    "ResponseCacheControl": f"private, max-age={self.ventana}, immutable",
+                },
+                ExpiresIn=max(1, int(caduca - self._reloj())),
+            )
+        except ClientError:
+            return None
+
+    def url(self, clave, bucket=None):
+        """Devuelve la URL de lectura de un objeto para la ventana actual.
+
+        Returns:
+            str: URL prefirmada, o None si no se ha podido firmar
+        """
+        bucket = bucket or self.bucket
+        ventana = self.ventana_actual()
+        entrada = (bucket, clave, ventana)
+        with self._lock:
+            url = self._urls.get(entrada)
+            if url is not None:
+                self._urls.move_to_end(entrada)
+                self.aciertos += 1
+                return url
+
+        url = self._firmar(bucket, clave, ventana)
+        if url is None:
+            return None
+        with self._lock:
+            self.firmas += 1
+            self._urls[entrada] = url
+            while len(self._urls) > self.maximo:
+                self._urls.popitem(last=False)
+        return url
+
+    def firmar_lote(self, rutas):
+        """Firma de una vez las URLs de las rutas "s3://" indicadas (sin repetir objetos).
+
+        Returns:
+            dict: ruta -> URL
+        """
+        urls = {}
+        for ruta in dict.fromkeys(rutas):
+            partes = clave_s3(ruta)
+            if partes:
+                urls[ruta] = self.url(partes[1], partes[0])
+        return urls
+
+    def url_imagen(self, ruta):
+        """URL con la que una plantilla muestra una imagen guardada en un registro.
+
+        Las rutas de S3 se convierten en URLs prefirmadas; si no se pueden firmar
+        se usa la ruta /imagenes_subidas, que redirige a S3. Las rutas locales no cambian.
+        """
+        partes = clave_s3(ruta)
+        if not partes:
+            return ruta
+        return self.url(partes[1], partes[0]) or f"/imagenes_subidas/{partes[1]}?s3=true"
+
+    def estadisticas(self):
+        """Devuelve los contadores de uso de la caché"""
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "firmas": self.firmas,
+                "entradas": len(self._urls),
+                "maximo": self.maximo,
+                "ventana": self.ventana,
+            }
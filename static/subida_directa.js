@@ -0,0 +1,79 @@
+// Subida de imágenes directamente del navegador a S3 (ver direct_uploads.py).
+//
+// En los formularios con data-subida-directa="<url de la política>", cada archivo
+// seleccionado se sube al bucket con una política de POST prefirmada y en el
+// formulario se envía solo el token del objeto (campo "<nombre del input>_s3").
+// Si algo falla, el formulario se envía con los archivos, como sin subida directa.
+
+// SHA-256 del archivo en base64, para que S3 verifique el contenido al recibirlo
+// (crypto.subtle solo existe en contextos seguros; sin él se sube sin suma)
+async function sumaSha256(archivo) {
+  if (!window.crypto || !window.crypto.subtle) {
+    return null;
+  }
+  const suma = new Uint8Array(await window.crypto.subtle.digest('SHA-256', await archivo.arrayBuffer()));
+  return btoa(String.fromCharCode(...suma));
+}
+
+async function subirArchivoDirecto(urlPolitica, archivo) {
+  const respuesta = await fetch(urlPolitica, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: archivo.name, size: archivo.size, sha256: await sumaSha256(archivo) })
+  });
+  if (!respuesta.ok) {
+    throw new Error('No se pudo obtener la política de subida (' + respuesta.status + ')');
+  }
+  const politica = await respuesta.json();
+  if (politica.existente) {
+    // La misma imagen ya está en S3 (clave por contenido): no hace falta subirla
+    return politica.token;
+  }
+  const datos = new FormData();
+  Object.entries(politica.fields).forEach(([campo, valor]) => datos.append(campo, valor));
+  // S3 exige que el archivo sea el último campo del formulario
+  datos.append('file', archivo);
+  const subida = await fetch(politica.url, { method: 'POST', body: datos });
+  if (!subida.ok) {
+    throw new Error('S3 rechazó la subida (' + subida.status + ')');
+  }
+  return politica.token;
+}
+
+document.querySelectorAll('form[data-subida-directa]').forEach(function (form) {
+  form.addEventListener('submit', async function (event) {
+    if (event.defaultPrevented) {
+      return;
+    }
+    const inputs = Array.from(form.querySelectorAll('input[type=file]')).filter((input) => input.files.length);
+    if (!inputs.length) {
+      return;
+    }
+    event.preventDefault();
+    const boton = form.querySelector('[type=submit]');
+    if (boton) {
+      boton.disabled = true;
+    }
+    const tokens = [];
+    try {
+      for (const input of inputs) {
+        const maximo = input.multiple ? 3 : 1;
+        for (const archivo of Array.from(input.files).slice(0, maximo)) {
+          tokens.push([input.name + '_s3', await subirArchivoDirecto(form.dataset.subidaDirecta, archivo)]);
+        }
+      }
+      tokens.forEach(([nombre, token]) => {
+        const oculto = document.createElement('input');
+        oculto.type = 'hidden';
+        oculto.name = nombre;
+        oculto.value = token;
+        form.appendChild(oculto);
+      });
+      // Los bytes ya están en S3: no se vuelven a enviar al servidor
+      inputs.forEach((input) => { input.value = ''; });
+    } catch (error) {
+      console.warn('Subida directa a S3 no disponible, se envían los archivos al servidor:', error);
+    }
+    form.submit();
+  });
+});
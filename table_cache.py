@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en memoria (por proceso) de los metadatos de las tablas.
+
+Cada petición al catálogo necesita el documento de la tabla seleccionada
+(encabezados, modo de numeración...) de la colección spreadsheets, que casi
+nunca cambia. La caché evita esa consulta a MongoDB en cada petición:
+
+- Tamaño acotado: al llenarse se expulsa la entrada usada hace más tiempo (LRU)
+- Caducidad (TTL): una entrada solo se sirve durante TABLE_CACHE_TTL segundos,
+  lo que limita el tiempo que otro worker puede ver datos antiguos
+- Las escrituras del propio proceso (crear, importar, modificar o eliminar una
+  tabla) invalidan la entrada de forma explícita
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TAMANO_CACHE_TABLAS = int(os.getenv("TABLE_CACHE_SIZE", "256"))
+TTL_CACHE_TABLAS = float(os.getenv("TABLE_CACHE_TTL", "60"))
+
+
+class CacheTablas:
+    """Caché LRU con caducidad y contadores de aciertos/fallos, segura entre hilos.
+
+    Args:
+        maximo: Número máximo de entradas
+        ttl: Segundos durante los que una entrada es válida
+        reloj: Función que devuelve el instante actual en segundos (para tests)
+    """
+
+    def __init__(self, maximo=TAMANO_CACHE_TABLAS, ttl=TTL_CACHE_TABLAS, reloj=time.monotonic):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._reloj = reloj
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave, cargar):
+        """Devuelve el valor de la clave, cargándolo con `cargar()` si no está o ha caducado.
+
+        Los valores None (tabla inexistente) no se guardan, para que una tabla
+        recién creada por otro proceso se vea en la siguiente petición.
+
+        Returns:
+            Copia del valor guardado (el llamante puede modificarla sin afectar a la caché)
+        """
+        ahora = self._reloj()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] > ahora:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return copy.deepcopy(entrada[1])
+            self.fallos += 1
+
+        # La carga se hace fuera del lock para no bloquear a otros hilos durante la consulta
+        valor = cargar()
+        if valor is None:
+            return None
+        with self._lock:
+            self._entradas[clave] = (ahora + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+        return copy.deepcopy(valor)
+
+    def invalidar(self, clave=None):
+        """Elimina una entrada (o todas si no se indica clave)"""
+        with self._lock:
+            if clave is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(clave, None)
+
+    def estadisticas(self):
+        """Devuelve los contadores de uso de la caché"""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": round(self.aciertos / consultas, 3) if consultas else None,
+                "expulsiones": self.expulsiones,
+                "entradas": len(self._entradas),
+                "maximo": self.maximo,
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,82 @@
+import re
+
+import pytest
+
+from catalog_query import (
+    condicion_columna, filtros_columnas, orden_columna, parametros_consulta, campo_columna, etapas_orden,
+    TEXTO_NUMERICO
+)
+
+HEADERS = ["Número", "Descripción", "Peso (gr.)"]
+
+
+def test_condicion_columna_tipada():
+    """La igualdad compara con el texto y con el número; los rangos de texto solo con textos."""
+    assert condicion_columna("Peso", "eq", "2,5") == {"Peso": {"$in": ["2,5", 2.5]}}
+    assert condicion_columna("Descripción", "lt", "oro") == {"Descripción": {"$type": "string", "$lt": "oro"}}
+    assert condicion_columna("Descripción", "contiene", "a.b") == {"Descripción": {"$regex": r"a\.b", "$options": "i"}}
+
+
+def test_rango_numerico_solo_con_valores_numericos():
+    """Un rango numérico compara con números y con textos numéricos convertidos, nunca con "N/A"."""
+    condicion = condicion_columna("Peso", "gte", "5")
+    numeros, textos = condicion["$or"]
+    assert numeros == {"Peso": {"$type": "number", "$gte": 5}}
+    patron = re.compile(textos["$and"][0]["Peso"]["$regex"])
+    assert textos["$and"][0]["Peso"]["$type"] == "string"
+    assert all(patron.match(v) for v in ("5", " 12 ", "2,75", "-3.5"))
+    assert not any(patron.match(v) for v in ("N/A", "", "5 gr", "1e3"))
+    comparacion = textos["$and"][1]["$expr"]["$let"]["in"]["$and"][1]
+    assert comparacion == {"$gte": ["$$n", 5]}
+
+
+def test_rango_con_valor_no_finito():
+    """"nan" e "inf" no se tratan como números."""
+    assert condicion_columna("Peso", "gt", "nan") == {"Peso": {"$type": "string", "$gt": "nan"}}
+
+
+def test_filtros_columnas():
+    """Los parámetros f.<encabezado>[<operador>] se validan y se combinan con $and."""
+    assert filtros_columnas(HEADERS, {"f.Descripción": "Anillo", "f.Peso (gr.)": ""}) == {
+        "Descripción": {"$in": ["Anillo"]}
+    }
+    filtro = filtros_columnas(HEADERS, {"f.Peso (gr.)[gt]": "1", "f.Peso (gr.)[lt]": "9"})
+    assert len(filtro["$and"]) == 2
+    with pytest.raises(ValueError):
+        filtros_columnas(HEADERS, {"f.Precio": "1"})
+    with pytest.raises(ValueError):
+        filtros_columnas(HEADERS, {"f.Descripción[regex]": ".*"})
+
+
+def test_orden_columna():
+    """La ordenación por columna añade el orden natural como desempate en la misma dirección."""
+    assert orden_columna(HEADERS, None) == [("NumeroOrdenacion", 1)]
+    assert orden_columna(HEADERS, "Número", "desc") == [("NumeroOrdenacion", -1)]
+    assert orden_columna(HEADERS, "Peso (gr.)", "desc") == [
+        ("_rango_orden", 1), ("_valor_orden", -1), ("NumeroOrdenacion", -1)
+    ]
+    with pytest.raises(ValueError):
+        orden_columna(HEADERS, "Precio")
+    with pytest.raises(ValueError):
+        orden_columna(HEADERS, "Peso (gr.)", "arriba")
+
+
+def test_clave_tipada_de_la_ordenacion():
+    """La ordenación por columna calcula un rango y un valor convertido del campo pedido."""
+    assert campo_columna(HEADERS, "Peso (gr.)") == "Peso_(gr_)"
+    assert campo_columna(HEADERS, "Número") is None
+    assert etapas_orden(None) == []
+
+    etapas = etapas_orden("Peso_(gr_)")
+    assert [list(etapa["$addFields"]) for etapa in etapas] == [
+        ["_valor_orden"], ["_rango_orden", "_valor_orden"]
+    ]
+    # Los textos solo se convierten si se leen como número
+    conversion = etapas[0]["$addFields"]["_valor_orden"]["$switch"]["branches"][1]
+    assert {"$regexMatch": {"input": "$Peso_(gr_)", "regex": TEXTO_NUMERICO}} in conversion["case"]["$and"]
+
+
+def test_parametros_consulta():
+    """Solo se conservan en los enlaces los parámetros de filtro y orden con valor."""
+    args = {"f.Peso (gr.)[gte]": "3", "f.Descripción": "", "orden": "Peso (gr.)", "despues": "abc"}
+    assert parametros_consulta(args) == {"f.Peso (gr.)[gte]": "3", "orden": "Peso (gr.)"}
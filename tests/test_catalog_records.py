@@ -0,0 +1,203 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from catalog_records import (
+    clave_ordenacion, clave_identificador, filtro_tabla, siguiente_numero, bloqueo_tabla, TablaBloqueada, renumerar_tabla,
+    modo_numeracion, posicion_inicial, NUMERACION_CONTINUA, NUMERACION_CON_HUECOS,
+    proyeccion_registros, texto_busqueda, campos_texto, etapas_busqueda, version_tabla,
+    proyeccion_edicion, listas_imagenes, CAMPO_INTEGRIDAD
+)
+
+
+def test_clave_ordenacion():
+    """El identificador se guarda como texto para ordenarlo con colación numérica."""
+    assert clave_ordenacion(12) == "12"
+    assert clave_ordenacion(" A-10 ") == "A-10"
+    assert clave_ordenacion(None) is None
+    assert clave_ordenacion("  ") is None
+
+
+def test_clave_identificador():
+    """Solo las tablas que no se identifican por "Número" guardan una copia del identificador."""
+    assert clave_identificador(["Número", "Peso"], {"Número": 3}) is None
+    assert clave_identificador(["Código pieza", "Peso"], {"Código_pieza": " A-1 "}) == "A-1"
+    assert clave_identificador(["Código pieza"], {"Código_pieza": ""}) is None
+    assert clave_identificador([], {}) is None
+
+
+def test_filtro_tabla_cumple_el_filtro_del_indice():
+    """El filtro de una tabla incluye la condición del índice único parcial."""
+    assert filtro_tabla("t.xlsx") == {"table": "t.xlsx", "NumeroOrdenacion": {"$type": "string"}}
+    assert filtro_tabla("t.xlsx", {"$eq": "7"}) == {
+        "table": "t.xlsx", "NumeroOrdenacion": {"$type": "string", "$eq": "7"}
+    }
+
+
+def test_siguiente_numero_contador_existente():
+    """Con el contador ya creado basta un único find_one_and_update."""
+    contadores = MagicMock()
+    contadores.find_one_and_update.return_value = {"_id": "t.xlsx", "seq": 8}
+    registros = MagicMock()
+
+    assert siguiente_numero(contadores, registros, "t.xlsx") == 8
+    assert contadores.find_one_and_update.call_count == 1
+    registros.aggregate.assert_not_called()
+
+
+def test_siguiente_numero_inicializa_contador():
+    """La primera vez se inicializa el contador con el mayor número existente."""
+    contadores = MagicMock()
+    contadores.find_one_and_update.side_effect = [None, {"_id": "t.xlsx", "seq": 42}]
+    registros = MagicMock()
+    registros.aggregate.return_value = iter([{"_id": None, "maximo": 41}])
+
+    assert siguiente_numero(contadores, registros, "t.xlsx") == 42
+    contadores.update_one.assert_called_once_with({"_id": "t.xlsx"}, {"$max": {"seq": 41}}, upsert=True)
+
+
+def test_siguiente_numero_reserva_un_bloque():
+    """Se pueden reservar varios números consecutivos con un único incremento."""
+    contadores = MagicMock()
+    contadores.find_one_and_update.return_value = {"_id": "t.xlsx", "seq": 15}
+
+    assert siguiente_numero(contadores, MagicMock(), "t.xlsx", cantidad=5) == 15
+    assert contadores.find_one_and_update.call_args[0][1] == {"$inc": {"seq": 5}}
+
+
+def test_bloqueo_tabla_se_libera():
+    """El bloqueo se libera al terminar, solo si sigue siendo nuestro."""
+    bloqueos = MagicMock()
+    with bloqueo_tabla(bloqueos, "t.xlsx"):
+        token = bloqueos.update_one.call_args[0][1]["$set"]["token"]
+    bloqueos.delete_one.assert_called_once_with({"_id": "renumerar:t.xlsx", "token": token})
+
+
+def test_bloqueo_tabla_ocupado():
+    """Si otro proceso tiene el bloqueo, el upsert falla y se informa."""
+    bloqueos = MagicMock()
+    bloqueos.update_one.side_effect = DuplicateKeyError("E11000")
+    with pytest.raises(TablaBloqueada):
+        with bloqueo_tabla(bloqueos, "t.xlsx"):
+            pass
+    bloqueos.delete_one.assert_not_called()
+
+
+def test_renumerar_tabla_en_el_servidor():
+    """La renumeración no lee los registros: usa pipelines con $merge y limpia la colección temporal."""
+    registros = MagicMock()
+    registros.name = "catalogo"
+    registros.count_documents.return_value = 3
+    temporal = registros.database.__getitem__.return_value
+    temporal.name = "renumeracion_x"
+    contadores = MagicMock()
+    contadores.find_one.return_value = {"seq": 7}
+
+    assert renumerar_tabla(registros, contadores, "t.xlsx") == 3
+
+    pipeline = registros.aggregate.call_args_list[0][0][0]
+    assert "$setWindowFields" in pipeline[1]
+    assert pipeline[-1] == {"$merge": {"into": "renumeracion_x"}}
+    assert temporal.aggregate.call_count == 2
+    registros.find.assert_not_called()
+    temporal.drop.assert_called_once()
+    contadores.update_one.assert_any_call(
+        {"_id": "t.xlsx"}, {"$inc": {"version": 1}, "$currentDate": {"modificado": True}}, upsert=True
+    )
+
+
+def test_renumerar_no_rebaja_un_contador_que_ha_cambiado():
+    """El contador solo se rebaja al mayor número asignado si nadie ha reservado otro entretanto."""
+    registros = MagicMock()
+    registros.name = "catalogo"
+    registros.database.__getitem__.return_value.name = "renumeracion_x"
+    registros.aggregate.return_value = iter([{"_id": None, "maximo": 3}])
+    contadores = MagicMock()
+    contadores.find_one.return_value = {"seq": 7}
+
+    renumerar_tabla(registros, contadores, "t.xlsx")
+
+    # Condicionado al valor leído al empezar: si una inserción lo ha incrementado no coincide
+    contadores.update_one.assert_called_with({"_id": "t.xlsx", "seq": 7}, {"$set": {"seq": 3}})
+
+
+def test_modo_numeracion():
+    """Las tablas sin modo configurado (o con uno desconocido) usan numeración continua."""
+    assert modo_numeracion({}) == NUMERACION_CONTINUA
+    assert modo_numeracion({"numeracion": "otro"}) == NUMERACION_CONTINUA
+    assert modo_numeracion({"numeracion": NUMERACION_CON_HUECOS}) == NUMERACION_CON_HUECOS
+
+
+def test_posicion_inicial_cuenta_los_anteriores():
+    """La posición de la primera fila es el número de registros anteriores más uno."""
+    registros = MagicMock()
+    registros.count_documents.return_value = 50
+
+    assert posicion_inicial(registros, "t.xlsx", {"NumeroOrdenacion": "57"}) == 51
+    filtro = registros.count_documents.call_args[0][0]
+    assert filtro == {"table": "t.xlsx", "NumeroOrdenacion": {"$type": "string", "$lt": "57"}}
+    assert posicion_inicial(registros, "t.xlsx", None) == 1
+
+
+def test_proyeccion_registros():
+    """La proyección incluye los encabezados saneados y los campos que usan las plantillas."""
+    proyeccion = proyeccion_registros(["Número", "Peso (gr.)", "Código interno"])
+    assert proyeccion == {
+        "Número": 1, "Peso_(gr_)": 1, "Código_interno": 1,
+        "Imagenes": 1, "ImagenesDerivadas": 1, "NumeroOrdenacion": 1,
+    }
+    assert "table" in proyeccion_registros(["Número"], "table")
+
+
+def test_texto_busqueda():
+    """El texto indexado une los campos de texto del registro, sin "Número" ni imágenes."""
+    headers = ["Número", "Descripción", "Peso (gr.)", "Notas"]
+    registro = {"Número": 7, "Descripción": "Anillo de oro", "Peso_(gr_)": 3, "Notas": ""}
+    assert texto_busqueda(registro, headers) == "Anillo de oro 3"
+    assert campos_texto(headers + ["Imagenes"]) == ["Descripción", "Peso (gr.)", "Notas"]
+
+
+def test_etapas_busqueda():
+    """La búsqueda se limita a las tablas indicadas y añade la relevancia para ordenar."""
+    etapas = etapas_busqueda("anillo", ["a.xlsx"], "catalogo")
+    assert etapas == [
+        {"$match": {"table": "a.xlsx", "$text": {"$search": "anillo"}}},
+        {"$addFields": {"puntuacion": {"$meta": "textScore"}}},
+    ]
+
+
+def test_etapas_busqueda_varias_tablas_con_igualdad():
+    """Cada tabla se busca con igualdad sobre el prefijo del índice de texto y se unen los resultados."""
+    etapas = etapas_busqueda("anillo", ["a.xlsx", "b.xlsx"], "catalogo")
+    assert etapas[0]["$match"]["table"] == "a.xlsx"
+    union = etapas[2]["$unionWith"]
+    assert union["coll"] == "catalogo"
+    assert union["pipeline"][0] == {"$match": {"table": "b.xlsx", "$text": {"$search": "anillo"}}}
+
+
+def test_version_tabla():
+    """Las tablas sin cambios registrados tienen versión 0."""
+    contadores = MagicMock()
+    contadores.find_one.return_value = None
+    assert version_tabla(contadores, "t.xlsx") == (0, None)
+    contadores.find_one.return_value = {"_id": "t.xlsx", "seq": 4, "version": 9, "modificado": "fecha"}
+    assert version_tabla(contadores, "t.xlsx") == (9, "fecha")
+
+
+def test_editar_conserva_la_integridad_de_las_imagenes_sin_cambios():
+    """El registro que se edita se lee con la integridad: las sumas de las imágenes
+    que no se tocan llegan intactas al replace_one."""
+    guardado = {
+        "_id": 1, "Número": 1, "Descripción": "Anillo", "table": "t.xlsx",
+        "Imagenes": ["s3://b/sha256/a", "s3://b/sha256/b"],
+        CAMPO_INTEGRIDAD: [{"sha256": "A", "tamano": 1}, {"sha256": "B", "tamano": 2}],
+    }
+    proyeccion = proyeccion_edicion(["Número", "Descripción"])
+    registro = {campo: valor for campo, valor in guardado.items() if campo in proyeccion or campo == "_id"}
+
+    rutas, derivados, integridad = listas_imagenes(registro)
+    # Se sustituye la segunda imagen y la primera no se toca
+    rutas[1], integridad[1] = "s3://b/sha256/c", {"sha256": "C", "tamano": 3}
+    assert integridad == [{"sha256": "A", "tamano": 1}, {"sha256": "C", "tamano": 3}, None]
+    assert len(rutas) == len(derivados) == 3
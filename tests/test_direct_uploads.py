@@ -0,0 +1,56 @@
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from itsdangerous import URLSafeTimedSerializer
+
+from direct_uploads import (
+    tipo_contenido, politica_subida, token_subida, clave_de_token, verificar_objeto
+)
+
+
+def test_tipo_contenido():
+    assert tipo_contenido("foto.JPG") == "image/jpeg"
+    assert tipo_contenido("notas.txt") is None
+    assert tipo_contenido(None) is None
+
+
+def test_politica_limita_tipo_y_tamano():
+    """La política fija la clave, el Content-Type y el rango de tamaños."""
+    cliente = MagicMock()
+    politica_subida(cliente, "bucket", "a.png", "image/png", maximo=1000, caducidad=60)
+    kwargs = cliente.generate_presigned_post.call_args.kwargs
+    assert kwargs["Key"] == "a.png"
+    assert kwargs["Fields"] == {"Content-Type": "image/png"}
+    assert ["content-length-range", 1, 1000] in kwargs["Conditions"]
+    assert kwargs["ExpiresIn"] == 60
+
+    politica_subida(cliente, "bucket", "a.png", "image/png", suma="c3VtYQ==")
+    kwargs = cliente.generate_presigned_post.call_args.kwargs
+    assert kwargs["Fields"]["x-amz-checksum-sha256"] == "c3VtYQ=="
+    assert {"x-amz-checksum-sha256": "c3VtYQ=="} in kwargs["Conditions"]
+
+
+def test_token_de_subida_por_usuario():
+    """El token solo es válido para el usuario al que se emitió."""
+    serializador = URLSafeTimedSerializer("secreto")
+    token = token_subida(serializador, "a.png", "ana")
+    assert clave_de_token(serializador, token, "ana") == "a.png"
+    with pytest.raises(ValueError):
+        clave_de_token(serializador, token, "luis")
+    with pytest.raises(ValueError):
+        clave_de_token(serializador, token + "x", "ana")
+
+
+def test_verificar_objeto():
+    cliente = MagicMock()
+    cliente.head_object.return_value = {"ContentType": "image/png", "ContentLength": 10}
+    assert verificar_objeto(cliente, "bucket", "a.png", maximo=100)["ContentLength"] == 10
+
+    cliente.head_object.return_value = {"ContentType": "text/html", "ContentLength": 10}
+    with pytest.raises(ValueError):
+        verificar_objeto(cliente, "bucket", "a.png", maximo=100)
+
+    cliente.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+    with pytest.raises(ValueError):
+        verificar_objeto(cliente, "bucket", "a.png", maximo=100)
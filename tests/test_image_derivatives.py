@@ -0,0 +1,65 @@
+import io
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+import image_derivatives
+from image_derivatives import clave_derivado, generar_derivados, rutas_mostradas, subir_derivados
+
+
+def _jpeg(ancho, alto, orientacion=None):
+    imagen = Image.new("RGB", (ancho, alto), (200, 10, 10))
+    salida = io.BytesIO()
+    exif = Image.Exif()
+    if orientacion:
+        exif[0x0112] = orientacion
+    exif[0x010F] = "Apple"
+    imagen.save(salida, "JPEG", exif=exif.tobytes())
+    return salida.getvalue()
+
+
+def test_generar_derivados_reduce_orienta_y_quita_metadatos():
+    """Los derivados respetan la orientación EXIF, el tamaño de cada variante y no llevan EXIF."""
+    derivados = generar_derivados(_jpeg(1200, 800, orientacion=6), {"thumb": 100, "medium": 600})
+
+    with Image.open(io.BytesIO(derivados["thumb"])) as miniatura:
+        assert miniatura.size == (67, 100)
+        assert not miniatura.getexif()
+    with Image.open(io.BytesIO(derivados["medium"])) as medio:
+        assert max(medio.size) == 600
+        assert medio.format == "JPEG"
+
+
+def test_generar_derivados_png_transparente():
+    """Las imágenes con transparencia se convierten a JPEG sobre fondo blanco."""
+    salida = io.BytesIO()
+    Image.new("RGBA", (50, 40), (0, 0, 0, 0)).save(salida, "PNG")
+    derivados = generar_derivados(salida.getvalue(), {"thumb": 20})
+    with Image.open(io.BytesIO(derivados["thumb"])) as miniatura:
+        assert miniatura.mode == "RGB"
+        assert miniatura.getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_subir_derivados_y_rutas():
+    """Los derivados se guardan bajo el prefijo de derivados y se muestran en lugar del original."""
+    cliente = MagicMock()
+    rutas = subir_derivados(cliente, "bucket", "20250216_foto.jpeg", {"thumb": b"x"})
+
+    assert clave_derivado("20250216_foto.jpeg", "thumb") == "derivados/thumb/20250216_foto.jpg"
+    assert rutas == {"thumb": "s3://bucket/derivados/thumb/20250216_foto.jpg"}
+    assert cliente.put_object.call_args.kwargs["ContentType"] == "image/jpeg"
+
+    registro = {"Imagenes": ["s3://bucket/a.jpg", None, "s3://bucket/b.jpg"], "ImagenesDerivadas": [rutas]}
+    assert list(rutas_mostradas(registro)) == [
+        "s3://bucket/derivados/thumb/20250216_foto.jpg", "s3://bucket/a.jpg",
+        "s3://bucket/b.jpg", "s3://bucket/b.jpg",
+    ]
+
+
+def test_pool_imagenes_no_usa_fork():
+    """El pool de procesos se crea con forkserver o spawn (se crea desde hilos del proceso web)."""
+    with patch.object(image_derivatives, "_pool", None), \
+            patch.object(image_derivatives, "ProcessPoolExecutor") as executor:
+        image_derivatives.pool_imagenes()
+    contexto = executor.call_args.kwargs["mp_context"]
+    assert contexto.get_start_method() in ("forkserver", "spawn")
@@ -0,0 +1,79 @@
+import base64
+import hashlib
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from image_derivatives import clave_derivado
+
+from image_store import (
+    clave_contenido, es_clave_contenido, id_imagen, reservar, liberar, subida_de_usuario,
+    sin_referencias, retirar_sin_referencias
+)
+
+SUMA = base64.b64encode(hashlib.sha256(b"foto").digest()).decode("ascii")
+
+
+def test_clave_contenido():
+    """La misma imagen tiene siempre la misma clave, derivada de su SHA-256 (sin la extensión
+    del archivo, para que ".jpg" y ".jpeg" no sean dos originales con los mismos derivados)."""
+    clave = clave_contenido(SUMA)
+    assert clave == f"sha256/{hashlib.sha256(b'foto').hexdigest()}"
+    assert clave_derivado(clave, "thumb") == f"derivados/thumb/{clave}.jpg"
+    assert es_clave_contenido(clave) and not es_clave_contenido("20250101_abcd.jpg")
+    with pytest.raises(ValueError):
+        clave_contenido("bm8=")
+
+
+def test_reservar_suma_una_referencia():
+    imagenes = MagicMock()
+    imagenes.find_one_and_update.return_value = {"_id": "k", "refcount": 1, "almacenada": True}
+    assert reservar(imagenes, "k", {"sha256": SUMA, "tamano": 4}, "bucket", "image/jpeg")["almacenada"]
+    filtro, cambios = imagenes.find_one_and_update.call_args[0]
+    assert cambios["$inc"] == {"refcount": 1}
+    assert cambios["$setOnInsert"]["tamano"] == 4 and cambios["$setOnInsert"]["tipo"] == "image/jpeg"
+    assert imagenes.find_one_and_update.call_args.kwargs["upsert"] is True
+
+
+def test_atajo_de_subida_solo_para_quien_la_subio():
+    """Quien conoce la suma de una imagen ajena no puede saber si existe ni enlazarla."""
+    imagenes = MagicMock()
+    reservar(imagenes, "k", bucket="bucket", usuario="ana")
+    assert imagenes.find_one_and_update.call_args[0][1]["$addToSet"] == {"usuarios": "ana"}
+
+    imagenes.find_one.return_value = None
+    assert subida_de_usuario(imagenes, "k", "luis") is False
+    imagenes.find_one.assert_called_once_with({"_id": "k", "almacenada": True, "usuarios": "luis"}, {"_id": 1})
+
+
+def test_liberar_solo_resta_la_referencia():
+    """Liberar no borra nada: la imagen sin referencias la recoge la recogida de basura."""
+    imagenes = MagicMock()
+    imagenes.find_one_and_update.return_value = {"_id": "k", "refcount": 0}
+    assert liberar(imagenes, "k") == 0
+    filtro, cambios = imagenes.find_one_and_update.call_args[0]
+    assert cambios["$inc"] == {"refcount": -1} and "ultimo_cambio" in cambios["$currentDate"]
+    imagenes.delete_one.assert_not_called()
+
+    imagenes.find_one_and_update.return_value = None
+    assert liberar(imagenes, "antigua.jpg") is None
+
+
+def test_sin_referencias_es_una_consulta_indexada():
+    imagenes = MagicMock()
+    ahora = datetime(2025, 1, 2)
+    sin_referencias(imagenes, margen=3600, ahora=ahora)
+    imagenes.find.assert_called_once_with(
+        {"refcount": {"$lte": 0}, "ultimo_cambio": {"$lt": ahora - timedelta(hours=1)}})
+    assert id_imagen("s3://bucket/sha256/a.jpg") == "sha256/a.jpg"
+
+
+def test_retirar_solo_si_nadie_la_ha_vuelto_a_usar():
+    """El borrado se condiciona a "ultimo_cambio": una reserva posterior lo impide."""
+    imagenes = MagicMock()
+    entrada = {"_id": "k", "refcount": 0, "ultimo_cambio": datetime(2025, 1, 1)}
+    imagenes.delete_one.return_value.deleted_count = 0
+    assert retirar_sin_referencias(imagenes, entrada) is False
+    imagenes.delete_one.assert_called_once_with(
+        {"_id": "k", "refcount": {"$lte": 0}, "ultimo_cambio": datetime(2025, 1, 1)})
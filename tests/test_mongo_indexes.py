@@ -0,0 +1,181 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from mongo_indexes import (
+    INDICES, CATALOG_COLLECTION, diferencias_indice, sincronizar_indices,
+    etapas_plan, plan_ganador, comprobar_planes, consultas_criticas,
+    crear_indice_columna, registrar_uso_orden
+)
+
+# URI de un mongod local desechable para las comprobaciones con explain()
+MONGO_TEST_URI = os.environ.get("MONGO_TEST_URI")
+
+
+def _db_simulada(indices_por_coleccion):
+    """Crea una base de datos simulada cuyas colecciones devuelven los índices indicados."""
+    colecciones = {}
+
+    def obtener(nombre):
+        if nombre not in colecciones:
+            coleccion = MagicMock()
+            coleccion.list_indexes.return_value = indices_por_coleccion.get(nombre, [{"name": "_id_", "key": {"_id": 1}}])
+            colecciones[nombre] = coleccion
+        return colecciones[nombre]
+
+    db = MagicMock()
+    db.__getitem__.side_effect = obtener
+    return db, colecciones
+
+
+def test_diferencias_indice_iguales():
+    """Un índice igual al declarado no produce diferencias aunque el servidor complete la colación."""
+    especificacion = INDICES[CATALOG_COLLECTION]["table_numero_unico"]
+    existente = {
+        "name": "table_numero_unico",
+        "unique": True,
+        "key": dict(especificacion["keys"]),
+        "collation": {"locale": "es", "numericOrdering": True, "strength": 3, "caseLevel": False},
+        "partialFilterExpression": {"table": {"$exists": True}, "NumeroOrdenacion": {"$type": "string"}},
+    }
+    assert diferencias_indice(especificacion, existente) == []
+
+
+def test_diferencias_indice_distinto():
+    """Se informa de claves y opciones distintas a las declaradas."""
+    especificacion = {"keys": [("token", 1)], "unique": True}
+    existente = {"name": "token", "key": {"token": -1}}
+    diferencias = diferencias_indice(especificacion, existente)
+    assert len(diferencias) == 2
+
+
+def test_sincronizar_crea_los_que_faltan():
+    """La sincronización crea los índices ausentes e informa de los no declarados."""
+    db, colecciones = _db_simulada({
+        "users": [{"name": "_id_", "key": {"_id": 1}}, {"name": "antiguo", "key": {"x": 1}}],
+    })
+    informe = sincronizar_indices(db)
+
+    assert "users.email_ci" in informe["creados"]
+    assert "users.antiguo" in informe["sobrantes"]
+    colecciones["users"].create_index.assert_any_call(
+        [("email", 1)], collation={"locale": "es", "strength": 2}, name="email_ci"
+    )
+
+
+def test_sincronizar_informa_los_que_no_se_pueden_crear():
+    """Un índice que falla al crearse se informa y no impide crear los demás."""
+    db, colecciones = _db_simulada({})
+    catalogo = db[CATALOG_COLLECTION]
+    catalogo.create_index.side_effect = OperationFailure("E11000 duplicate key")
+
+    informe = sincronizar_indices(db)
+
+    assert f"{CATALOG_COLLECTION}.table_numero_unico" not in informe["creados"]
+    assert any(error.startswith(f"{CATALOG_COLLECTION}.table_numero_unico:") for error in informe["errores"])
+    assert "users.email_ci" in informe["creados"]
+
+
+def test_indice_numero_parcial():
+    """El índice único solo cubre registros con tabla e identificador de texto."""
+    especificacion = INDICES[CATALOG_COLLECTION]["table_numero_unico"]
+    assert especificacion["partialFilterExpression"] == {
+        "NumeroOrdenacion": {"$type": "string"}, "table": {"$exists": True}
+    }
+
+
+def test_indice_identificador_unico_parcial():
+    """El identificador de las tablas sin "Número" es único por tabla y solo cubre registros que lo tienen."""
+    especificacion = INDICES[CATALOG_COLLECTION]["table_identificador_unico"]
+    assert especificacion["keys"] == [("table", 1), ("IdentificadorTabla", 1)]
+    assert especificacion["unique"] is True
+    assert especificacion["partialFilterExpression"] == {
+        "IdentificadorTabla": {"$type": "string"}, "table": {"$exists": True}
+    }
+
+
+def test_consultas_por_tabla_con_la_colacion_del_indice():
+    """Las consultas del catálogo por tabla usan la colación de sus índices (si no, no pueden usarlos)."""
+    assert INDICES[CATALOG_COLLECTION]["table_registros"]["keys"] == [("table", 1)]
+    for consulta in consultas_criticas():
+        comando = consulta["comando"]
+        if consulta["coleccion"] == CATALOG_COLLECTION and "$text" not in str(comando):
+            assert comando["collation"] == INDICES[CATALOG_COLLECTION]["table_registros"]["collation"], consulta["nombre"]
+
+
+def test_sincronizar_solo_comprobar():
+    """En modo comprobación no se crea ningún índice."""
+    db, colecciones = _db_simulada({})
+    informe = sincronizar_indices(db, crear=False)
+    assert informe["creados"]
+    assert all(not c.create_index.called for c in colecciones.values())
+
+
+def test_etapas_plan_aggregate():
+    """Se localizan las etapas del plan ganador dentro de la salida de un aggregate."""
+    explicacion = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {
+        "stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+    }}}}]}
+    assert etapas_plan(plan_ganador(explicacion)) == ["LIMIT", "FETCH", "IXSCAN"]
+
+
+@pytest.mark.skipif(not MONGO_TEST_URI, reason="MONGO_TEST_URI no definida (requiere un mongod local)")
+def test_consultas_criticas_sin_collscan():
+    """Ninguna consulta crítica recorre la colección completa con los índices declarados."""
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGO_TEST_URI)
+    db = client["test_indices_catalogo"]
+    try:
+        db[CATALOG_COLLECTION].insert_many([
+            {"table": "tabla_ejemplo.xlsx", "Número": i, "NumeroOrdenacion": str(i)} for i in range(1, 20)
+        ])
+        db["spreadsheets"].insert_one({"filename": "tabla_ejemplo.xlsx", "owner": "usuario"})
+        db["users"].insert_one({"nombre": "usuario", "email": "usuario@example.com"})
+        db["password_resets"].insert_one({"token": "token"})
+        sincronizar_indices(db)
+
+        assert comprobar_planes(db, consultas_criticas()) == []
+    finally:
+        client.drop_database("test_indices_catalogo")
+        client.close()
+
+
+def test_diferencias_indice_de_texto():
+    """Los índices de texto se comparan por su prefijo, sus campos ("weights") y su idioma."""
+    especificacion = INDICES[CATALOG_COLLECTION]["texto_busqueda"]
+    existente = {
+        "name": "texto_busqueda",
+        "key": {"table": 1, "_fts": "text", "_ftsx": 1},
+        "weights": {"TextoBusqueda": 1},
+        "default_language": "spanish",
+    }
+    assert diferencias_indice(especificacion, existente) == []
+    existente["default_language"] = "english"
+    assert len(diferencias_indice(especificacion, existente)) == 1
+    # El índice anterior, sin el prefijo "table"
+    existente.update(key={"_fts": "text", "_ftsx": 1}, default_language="spanish")
+    assert len(diferencias_indice(especificacion, existente)) == 1
+
+
+def test_crear_indice_columna():
+    """Los índices de columna se crean una vez y sin superar el máximo."""
+    coleccion = MagicMock()
+    coleccion.list_indexes.return_value = [{"name": "_id_"}]
+    assert crear_indice_columna(coleccion, "Peso", maximo=2) == "columna_Peso"
+    claves = coleccion.create_index.call_args[0][0]
+    assert claves == [("table", 1), ("Peso", 1), ("NumeroOrdenacion", 1)]
+
+    coleccion.list_indexes.return_value = [{"name": "columna_Peso"}, {"name": "columna_Valor"}]
+    assert crear_indice_columna(coleccion, "Peso", maximo=2) is None
+    assert crear_indice_columna(coleccion, "Talla", maximo=2) is None
+
+
+def test_registrar_uso_orden():
+    """Solo se avisa de crear el índice la vez en que se alcanza el umbral."""
+    estadisticas = MagicMock()
+    estadisticas.find_one_and_update.return_value = {"_id": "Peso", "usos": 3}
+    assert registrar_uso_orden(estadisticas, "Peso", umbral=3)
+    assert not registrar_uso_orden(estadisticas, "Peso", umbral=2)
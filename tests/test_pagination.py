@@ -0,0 +1,80 @@
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+
+from pagination import (
+    codificar_cursor, decodificar_cursor, condicion_keyset,
+    obtener_pagina, obtener_tamano_pagina
+)
+
+
+def test_cursor_ida_y_vuelta():
+    """Un cursor codificado se decodifica a los mismos valores, incluidos ObjectId."""
+    oid = ObjectId()
+    token = codificar_cursor([12, oid])
+    assert decodificar_cursor(token) == [12, oid]
+
+
+def test_cursor_invalido():
+    """Los tokens manipulados o vacíos se ignoran."""
+    assert decodificar_cursor("no-es-un-cursor!") is None
+    assert decodificar_cursor("") is None
+
+
+def test_tamano_pagina_limitado():
+    """El tamaño de página se acota y tiene valor por defecto."""
+    assert obtener_tamano_pagina("10", por_defecto=50, maximo=200) == 10
+    assert obtener_tamano_pagina("100000", por_defecto=50, maximo=200) == 200
+    assert obtener_tamano_pagina("0", por_defecto=50, maximo=200) == 1
+    assert obtener_tamano_pagina(None, por_defecto=50, maximo=200) == 50
+
+
+def test_condicion_keyset():
+    """La condición keyset compara la clave de ordenación de forma lexicográfica."""
+    campos = [("Número", 1), ("_id", 1)]
+    assert condicion_keyset(campos, [5, "x"]) == {
+        "$or": [{"Número": {"$gt": 5}}, {"Número": 5, "_id": {"$gt": "x"}}]
+    }
+    assert condicion_keyset(campos, [5, "x"], hacia_atras=True) == {
+        "$or": [{"Número": {"$lt": 5}}, {"Número": 5, "_id": {"$lt": "x"}}]
+    }
+
+
+def test_obtener_pagina_con_siguiente():
+    """Se pide un registro de más para saber si existe una página siguiente."""
+    coleccion = MagicMock()
+    coleccion.aggregate.return_value = [{"_id": i, "Número": i} for i in range(1, 4)]
+    campos = [("Número", 1), ("_id", 1)]
+
+    pagina = obtener_pagina(coleccion, [{"$match": {"table": "t"}}], campos, 2)
+
+    pipeline = coleccion.aggregate.call_args[0][0]
+    assert pipeline[-1] == {"$limit": 3}
+    assert [r["Número"] for r in pagina.registros] == [1, 2]
+    assert decodificar_cursor(pagina.cursor_siguiente) == [2, 2]
+    assert pagina.cursor_anterior is None
+
+
+def test_obtener_pagina_hacia_atras():
+    """Al retroceder se invierte el orden y los resultados vuelven a su orden natural."""
+    coleccion = MagicMock()
+    coleccion.aggregate.return_value = [{"_id": i, "Número": i} for i in (4, 3)]
+    campos = [("Número", 1), ("_id", 1)]
+
+    pagina = obtener_pagina(coleccion, [], campos, 2, antes=codificar_cursor([5, 5]))
+
+    pipeline = coleccion.aggregate.call_args[0][0]
+    assert {"$sort": {"Número": -1, "_id": -1}} in pipeline
+    assert [r["Número"] for r in pagina.registros] == [3, 4]
+    assert pagina.cursor_anterior is None
+    assert decodificar_cursor(pagina.cursor_siguiente) == [4, 4]
+
+
+def test_keyset_con_clave_tipada():
+    """Con la clave tipada (rango, valor) el cursor nunca compara valores de tipos distintos."""
+    campos = [("_rango_orden", 1), ("_valor_orden", -1), ("NumeroOrdenacion", -1)]
+    assert condicion_keyset(campos, [0, 2.75, "8"]) == {"$or": [
+        {"_rango_orden": {"$gt": 0}},
+        {"_rango_orden": 0, "_valor_orden": {"$lt": 2.75}},
+        {"_rango_orden": 0, "_valor_orden": 2.75, "NumeroOrdenacion": {"$lt": "8"}},
+    ]}
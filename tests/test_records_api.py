@@ -0,0 +1,44 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from pagination import decodificar_cursor
+from records_api import campos_solicitados, generar_ndjson, generar_json
+
+HEADERS = ["Número", "Descripción", "Peso (gr.)"]
+
+
+def _registros(n):
+    return [
+        {"_id": ObjectId(), "Número": i, "NumeroOrdenacion": str(i), "Descripción": f"Pieza {i}", "Peso_(gr_)": "5"}
+        for i in range(1, n + 1)
+    ]
+
+
+def test_campos_solicitados():
+    """Por defecto se devuelven todos los encabezados y se rechazan los desconocidos."""
+    assert campos_solicitados(HEADERS, None) == HEADERS
+    assert campos_solicitados(HEADERS, "Descripción, Imagenes") == ["Descripción", "Imagenes"]
+    with pytest.raises(ValueError):
+        campos_solicitados(HEADERS, "Precio")
+
+
+def test_generar_ndjson():
+    """Cada línea es un registro con sus encabezados originales y un cursor de reanudación."""
+    lineas = list(generar_ndjson(iter(_registros(2)), ["Descripción", "Peso (gr.)"]))
+    primero = json.loads(lineas[0])
+    assert len(lineas) == 2
+    assert primero["Descripción"] == "Pieza 1"
+    assert primero["Peso (gr.)"] == "5"
+    assert decodificar_cursor(primero["_cursor"]) == ["1"]
+
+
+def test_generar_json_con_limite():
+    """Con límite, el documento JSON incluye el cursor para continuar."""
+    documento = json.loads("".join(generar_json(iter(_registros(3)), ["Descripción"], limite=2)))
+    assert [r["Número"] for r in documento["records"]] == [1, 2]
+    assert decodificar_cursor(documento["next_cursor"]) == ["2"]
+
+    completo = json.loads("".join(generar_json(iter(_registros(2)), ["Descripción"], limite=2)))
+    assert completo["next_cursor"] is None
@@ -0,0 +1,76 @@
+import os
+
+from bson import ObjectId
+from jinja2 import Environment, FileSystemLoader
+
+from row_cache import CacheFilas, PLANTILLA_FILA
+from upload_spool import es_pendiente
+
+PLANTILLAS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+HEADERS = ["Número", "Descripción"]
+
+
+def _url_imagen(ruta):
+    return "https://s3.example.com/" + ruta.split("/")[-1] + "?firma"
+
+
+def _plantilla():
+    entorno = Environment(loader=FileSystemLoader(PLANTILLAS), autoescape=True)
+    entorno.tests["pendiente"] = es_pendiente
+    return entorno.get_template(PLANTILLA_FILA)
+
+
+def test_filas_cacheadas_por_id_y_contenido():
+    """Las filas sin cambios salen de la caché; una fila editada se vuelve a renderizar."""
+    cache = CacheFilas(maximo=10)
+    plantilla = _plantilla()
+    registros = [
+        {"_id": ObjectId(), "Número": 1, "Descripción": "Anillo <oro>", "Imagenes": [None, None, None]},
+        {"_id": ObjectId(), "Número": 2, "Descripción": "Collar", "Imagenes": ["s3://bucket/a.jpg", "pendiente://b.jpg"]},
+    ]
+
+    filas = cache.renderizar(plantilla, registros, HEADERS, url_imagen=_url_imagen)
+    assert "Anillo &lt;oro&gt;" in filas[0]
+    assert 'src="https://s3.example.com/a.jpg?firma"' in filas[1]
+    assert "imagen-pendiente" in filas[1] and "b.jpg" not in filas[1]
+
+    registros[1] = dict(registros[1], Descripción="Collar largo")
+    filas = cache.renderizar(plantilla, registros, HEADERS, url_imagen=_url_imagen)
+    assert "Collar largo" in filas[1]
+    assert cache.estadisticas()["aciertos"] == 1
+    assert cache.estadisticas()["fallos"] == 3
+
+
+def test_invalidar_fila():
+    """Invalidar un registro solo elimina su fila."""
+    cache = CacheFilas(maximo=10)
+    registros = [{"_id": ObjectId(), "Número": n, "Descripción": "x"} for n in (1, 2)]
+    cache.renderizar(_plantilla(), registros, HEADERS)
+
+    cache.invalidar(registros[0]["_id"])
+    assert cache.estadisticas()["entradas"] == 1
+
+
+def test_iterar_consume_los_registros_de_uno_en_uno():
+    """En modo streaming cada registro se lee solo cuando se renderiza su fila."""
+    leidos = []
+
+    def cursor():
+        for n in (1, 2, 3):
+            leidos.append(n)
+            yield {"_id": ObjectId(), "Número": n, "Descripción": "x"}
+
+    filas = CacheFilas(maximo=10).iterar(_plantilla(), cursor(), HEADERS)
+    registro, html = next(filas)
+    assert registro["Número"] == 1 and "/editar/1" in html
+    assert leidos == [1]
+
+
+def test_variante_renueva_las_filas():
+    """Al cambiar la variante (ventana de las URLs) las filas se vuelven a renderizar."""
+    cache = CacheFilas(maximo=10)
+    registros = [{"_id": ObjectId(), "Número": 1, "Descripción": "x"}]
+    cache.renderizar(_plantilla(), registros, HEADERS, 1)
+    cache.renderizar(_plantilla(), registros, HEADERS, 1)
+    cache.renderizar(_plantilla(), registros, HEADERS, 2)
+    assert cache.estadisticas()["aciertos"] == 1
@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import io
+from unittest.mock import MagicMock
+
+import pytest
+
+from s3_checksums import suma_sha256, subir_con_suma, integridad_cabecera
+
+DATOS = b"x" * 2500
+SUMA = base64.b64encode(hashlib.sha256(DATOS).digest()).decode("ascii")
+
+
+def test_suma_sha256_por_bloques():
+    """La suma se calcula por bloques y el objeto queda listo para subirlo desde el principio."""
+    fileobj = io.BytesIO(DATOS)
+    fileobj.seek(100)
+    assert suma_sha256(fileobj, tamano_bloque=1000) == (SUMA, 2500)
+    assert fileobj.tell() == 0
+
+
+def test_subir_con_suma_sin_head_object():
+    """La suma viaja en el PUT y no se hace ninguna llamada de verificación posterior."""
+    cliente = MagicMock()
+    cliente.put_object.return_value = {"ChecksumSHA256": SUMA}
+    assert subir_con_suma(cliente, "bucket", "a.jpg", io.BytesIO(DATOS)) == {"sha256": SUMA, "tamano": 2500}
+    kwargs = cliente.put_object.call_args.kwargs
+    assert kwargs["ChecksumSHA256"] == SUMA and kwargs["ContentLength"] == 2500
+    cliente.head_object.assert_not_called()
+
+
+def test_subir_con_suma_distinta():
+    cliente = MagicMock()
+    cliente.put_object.return_value = {"ChecksumSHA256": "otra"}
+    with pytest.raises(ValueError):
+        subir_con_suma(cliente, "bucket", "a.jpg", io.BytesIO(DATOS))
+
+
+def test_integridad_cabecera():
+    assert integridad_cabecera({"ChecksumSHA256": SUMA, "ContentLength": 3}) == {"sha256": SUMA, "tamano": 3}
+
+
+def test_subir_con_suma_ya_calculada():
+    """Con la suma ya calculada el contenido no se vuelve a leer para calcularla."""
+    cliente = MagicMock()
+    cliente.put_object.return_value = {"ChecksumSHA256": SUMA}
+    cuerpo = io.BytesIO(DATOS)
+    cuerpo.seek(100)
+    assert subir_con_suma(cliente, "bucket", "a.jpg", cuerpo, {"sha256": SUMA, "tamano": 2500})["sha256"] == SUMA
+    kwargs = cliente.put_object.call_args.kwargs
+    assert kwargs["ChecksumSHA256"] == SUMA and kwargs["ContentLength"] == 2500
+    assert cuerpo.tell() == 0
@@ -0,0 +1,95 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from s3_deletion_queue import ColaBorrados, procesar_cola_borrados, FALLIDO, PENDIENTE
+
+AHORA = datetime(2025, 1, 1)
+
+
+def _documento(clave, intentos=0, bucket="bucket"):
+    return {"_id": f"{bucket}/{clave}", "bucket": bucket, "clave": clave, "intentos": intentos}
+
+
+def test_encolar_sin_duplicados():
+    """Cada clave es un upsert por _id, así que volver a encolarla no la duplica."""
+    coleccion = MagicMock()
+    cola = ColaBorrados(coleccion, reloj=lambda: AHORA)
+    cola.encolar("bucket", ["a.jpg", "derivados/thumb/a.jpg", "a.jpg"])
+    operaciones = coleccion.bulk_write.call_args[0][0]
+    assert [op._filter for op in operaciones] == [{"_id": "bucket/a.jpg"}, {"_id": "bucket/derivados/thumb/a.jpg"}]
+    assert cola.aviso.is_set()
+    assert cola.encolar("bucket", []) == 0
+
+
+def test_lotes_de_delete_objects():
+    """Las claves se borran con una llamada a delete_objects por lote y bucket."""
+    cola = ColaBorrados(MagicMock(), reloj=lambda: AHORA)
+    lote = [_documento(f"{i}.jpg") for i in range(3)] + [_documento("x.jpg", bucket="otro")]
+    cola.reclamar = MagicMock(side_effect=[lote, []])
+    cliente = MagicMock()
+    cliente.delete_objects.return_value = {}
+
+    assert procesar_cola_borrados(cola, cliente) == {"borrados": 4, "reintentos": 0, "fallidos": 0, "en_uso": 0}
+    assert cliente.delete_objects.call_count == 2
+    objetos = cliente.delete_objects.call_args_list[0].kwargs["Delete"]["Objects"]
+    assert objetos == [{"Key": "0.jpg"}, {"Key": "1.jpg"}, {"Key": "2.jpg"}]
+
+
+def test_errores_se_reintentan_o_fallan():
+    """Las claves con error vuelven a la cola con espera o pasan a "fallido" al agotar los intentos."""
+    coleccion = MagicMock()
+    cola = ColaBorrados(coleccion, maximo_intentos=3, reloj=lambda: AHORA)
+    lote = [_documento("a.jpg"), _documento("b.jpg", intentos=2), _documento("c.jpg")]
+    cola.reclamar = MagicMock(side_effect=[lote, []])
+    cliente = MagicMock()
+    cliente.delete_objects.return_value = {"Errors": [
+        {"Key": "a.jpg", "Code": "SlowDown", "Message": "..."},
+        {"Key": "b.jpg", "Code": "AccessDenied", "Message": "..."},
+    ]}
+
+    assert procesar_cola_borrados(cola, cliente) == {"borrados": 1, "reintentos": 1, "fallidos": 1, "en_uso": 0}
+    coleccion.delete_many.assert_called_once_with({"_id": {"$in": ["bucket/c.jpg"]}})
+    cambios = [op._doc["$set"] for op in coleccion.bulk_write.call_args[0][0]]
+    assert cambios[0]["estado"] == PENDIENTE and cambios[0]["siguiente"] > AHORA
+    assert cambios[1]["estado"] == FALLIDO and cambios[1]["error"].startswith("AccessDenied")
+
+
+def test_borrados_se_descartan_de_la_cache():
+    """Solo las claves borradas de S3 se descartan de la caché local."""
+    cola = ColaBorrados(MagicMock(), reloj=lambda: AHORA)
+    cola.reclamar = MagicMock(side_effect=[[_documento("a.jpg"), _documento("b.jpg")], []])
+    cliente = MagicMock()
+    cliente.delete_objects.return_value = {"Errors": [{"Key": "b.jpg", "Code": "SlowDown", "Message": "..."}]}
+    cache = MagicMock()
+
+    procesar_cola_borrados(cola, cliente, cache=cache)
+    cache.descartar.assert_called_once_with("bucket", "a.jpg")
+
+
+def test_fallo_de_la_llamada_completa():
+    cola = ColaBorrados(MagicMock(), reloj=lambda: AHORA)
+    cola.reclamar = MagicMock(side_effect=[[_documento("a.jpg")], []])
+    cliente = MagicMock()
+    cliente.delete_objects.side_effect = ClientError({"Error": {"Code": "500"}}, "DeleteObjects")
+    assert procesar_cola_borrados(cola, cliente)["reintentos"] == 1
+
+
+def test_claves_de_imagenes_en_uso_no_se_borran():
+    """Una imagen que vuelve al registro mientras su borrado está en curso no se borra."""
+    coleccion = MagicMock()
+    cola = ColaBorrados(coleccion, reloj=lambda: AHORA)
+    lote = [dict(_documento("sha256/a"), imagen="sha256/a"),
+            dict(_documento("derivados/thumb/sha256/a.jpg"), imagen="sha256/a"),
+            dict(_documento("sha256/b"), imagen="sha256/b")]
+    cola.reclamar = MagicMock(side_effect=[lote, []])
+    imagenes = MagicMock()
+    imagenes.find.return_value = [{"_id": "sha256/a"}]
+    cliente = MagicMock()
+    cliente.delete_objects.return_value = {}
+
+    resumen = procesar_cola_borrados(cola, cliente, imagenes=imagenes)
+    assert resumen["borrados"] == 1 and resumen["en_uso"] == 2
+    assert cliente.delete_objects.call_args.kwargs["Delete"]["Objects"] == [{"Key": "sha256/b"}]
+    assert sorted(imagenes.find.call_args[0][0]["_id"]["$in"]) == ["sha256/a", "sha256/b"]
@@ -0,0 +1,99 @@
+import io
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from s3_object_cache import CacheObjetosS3
+
+
+def _cliente(contenidos):
+    """Cliente de S3 simulado: clave -> (bytes, etag); responde 304 si el ETag coincide."""
+    cliente = MagicMock()
+
+    def get_object(Bucket, Key, IfNoneMatch=None):
+        datos, etag = contenidos[Key]
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(datos), "ContentLength": len(datos), "ETag": etag, "ContentType": "image/png"}
+
+    cliente.get_object.side_effect = get_object
+    return cliente
+
+
+def test_segunda_lectura_desde_disco(tmp_path):
+    cliente = _cliente({"sha256/ab.jpg": (b"foto", '"e1"')})
+    cache = CacheObjetosS3(cliente, str(tmp_path), maximo_bytes=100, revalidar=0)
+    assert cache.leer("bucket", "sha256/ab.jpg") == b"foto"
+    # Las claves direccionadas por contenido no cambian: ni siquiera se revalidan
+    assert cache.leer("bucket", "sha256/ab.jpg") == b"foto"
+    assert cliente.get_object.call_count == 1
+    assert cache.estadisticas()["aciertos"] == 1
+    assert cache.tipo("bucket", "sha256/ab.jpg") == "image/png"
+    assert not [f for _, _, fs in os.walk(tmp_path) for f in fs if f.endswith(".tmp")]
+
+
+def test_validacion_por_etag(tmp_path):
+    """Pasado el plazo se pregunta a S3 con If-None-Match; solo se descarga si ha cambiado."""
+    ahora = [1000.0]
+    contenidos = {"a.jpg": (b"v1", '"e1"')}
+    cliente = _cliente(contenidos)
+    cache = CacheObjetosS3(cliente, str(tmp_path), maximo_bytes=100, revalidar=60, reloj=lambda: ahora[0])
+    cache.leer("bucket", "a.jpg")
+    ahora[0] += 30
+    assert cache.leer("bucket", "a.jpg") == b"v1"
+    assert cliente.get_object.call_count == 1
+
+    ahora[0] += 60
+    assert cache.leer("bucket", "a.jpg") == b"v1"
+    assert cliente.get_object.call_args.kwargs["IfNoneMatch"] == '"e1"'
+    assert cache.estadisticas()["revalidados"] == 1
+
+    ahora[0] += 60
+    contenidos["a.jpg"] = (b"v2", '"e2"')
+    assert cache.leer("bucket", "a.jpg") == b"v2"
+    assert cache.estadisticas()["descargas"] == 2
+
+
+def test_descartar_objeto_borrado(tmp_path):
+    """Un objeto descartado (borrado de S3) deja de servirse desde el disco."""
+    contenidos = {"sha256/ab": (b"foto", '"e1"')}
+    cliente = _cliente(contenidos)
+    cache = CacheObjetosS3(cliente, str(tmp_path), maximo_bytes=100, revalidar=0)
+    cache.leer("bucket", "sha256/ab")
+    assert cache.estadisticas()["ocupado"] == 4
+
+    assert cache.descartar("bucket", "sha256/ab") is True
+    assert cache.descartar("bucket", "sha256/ab") is False
+    assert cache.estadisticas()["ocupado"] == 0
+    assert cache.tipo("bucket", "sha256/ab") is None
+    del contenidos["sha256/ab"]
+    # Ya no está en la caché: se pide a S3, donde tampoco existe
+    with pytest.raises(KeyError):
+        cache.leer("bucket", "sha256/ab")
+
+
+def test_expulsion_lru_por_bytes(tmp_path):
+    cliente = _cliente({f"sha256/{n}.jpg": (n.encode() * 40, f'"{n}"') for n in "abc"})
+    cache = CacheObjetosS3(cliente, str(tmp_path), maximo_bytes=100)
+    cache.leer("bucket", "sha256/a.jpg")
+    cache.leer("bucket", "sha256/b.jpg")
+    # "a" se usa de nuevo, así que el menos usado es "b"
+    datos_a = cache._rutas("bucket", "sha256/a.jpg")[0]
+    os.utime(cache._rutas("bucket", "sha256/b.jpg")[0], (1, 1))
+    cache.leer("bucket", "sha256/a.jpg")
+    cache.leer("bucket", "sha256/c.jpg")
+
+    estadisticas = cache.estadisticas()
+    assert estadisticas["expulsados"] == 1 and estadisticas["ocupado"] == 80
+    assert os.path.exists(datos_a)
+    assert not os.path.exists(cache._rutas("bucket", "sha256/b.jpg")[0])
+
+
+def test_objeto_mayor_que_la_cache(tmp_path):
+    cliente = _cliente({"grande.jpg": (b"x" * 200, '"e"')})
+    cache = CacheObjetosS3(cliente, str(tmp_path), maximo_bytes=100)
+    assert cache.leer("bucket", "grande.jpg") == b"x" * 200
+    assert cache.estadisticas()["ocupado"] == 0
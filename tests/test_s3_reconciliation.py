@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+
+from s3_reconciliation import (
+    HUERFANO, COLGANTE, objetos_s3, claves_referenciadas, cruzar, es_reciente
+)
+
+
+def _objetos(*claves):
+    return [{"Key": clave, "Size": 10} for clave in claves]
+
+
+def test_cruzar_huerfanos_y_colgantes():
+    """El merge-join encuentra objetos sin referencias y referencias sin objeto."""
+    resultado = list(cruzar(_objetos("a.jpg", "b.jpg", "d.jpg", "f.jpg"), ["b.jpg", "c.jpg", "f.jpg", "g.jpg"]))
+    assert [(tipo, e["Key"] if tipo == HUERFANO else e) for tipo, e in resultado] == [
+        (HUERFANO, "a.jpg"), (COLGANTE, "c.jpg"), (HUERFANO, "d.jpg"), (COLGANTE, "g.jpg"),
+    ]
+    assert list(cruzar([], [])) == []
+
+
+def test_cruzar_es_perezoso():
+    """Solo se consume lo necesario de cada flujo (la memoria no depende del número de claves)."""
+    referencias = iter(["a.jpg", "b.jpg"])
+    resultados = cruzar(iter(_objetos("0.jpg")), referencias)
+    assert next(resultados)[0] == HUERFANO
+    assert list(referencias) == ["b.jpg"]
+
+
+def test_cruzar_exige_orden():
+    with pytest.raises(ValueError):
+        list(cruzar(_objetos("b.jpg", "a.jpg"), []))
+
+
+def test_objetos_s3_omite_la_cuarentena():
+    cliente = MagicMock()
+    cliente.get_paginator.return_value.paginate.return_value = [
+        {"Contents": _objetos("a.jpg", "cuarentena/x.jpg")}, {"Contents": _objetos("z.jpg")}, {},
+    ]
+    assert [o["Key"] for o in objetos_s3(cliente, "bucket")] == ["a.jpg", "z.jpg"]
+
+
+def test_claves_referenciadas_se_ordenan_en_el_servidor():
+    coleccion = MagicMock()
+    coleccion.aggregate.return_value = [{"_id": "a.jpg"}, {"_id": "derivados/thumb/a.jpg"}]
+    assert list(claves_referenciadas(coleccion, "mi.bucket")) == ["a.jpg", "derivados/thumb/a.jpg"]
+    etapas = coleccion.aggregate.call_args[0][0]
+    assert etapas[-1] == {"$sort": {"_id": 1}}
+    assert etapas[2]["$match"]["rutas"]["$regex"] == r"^s3://mi\.bucket/"
+    assert coleccion.aggregate.call_args.kwargs["allowDiskUse"] is True
+
+
+def test_es_reciente():
+    ahora = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    assert es_reciente({"LastModified": ahora - timedelta(minutes=5)}, margen=3600, ahora=ahora)
+    assert not es_reciente({"LastModified": ahora - timedelta(days=1)}, margen=3600, ahora=ahora)
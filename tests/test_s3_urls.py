@@ -0,0 +1,62 @@
+from unittest.mock import MagicMock
+
+from s3_urls import FirmadorUrls, clave_s3
+
+
+class Reloj:
+    def __init__(self, ahora):
+        self.ahora = ahora
+
+    def __call__(self):
+        return self.ahora
+
+
+def _cliente():
+    cliente = MagicMock()
+    cliente.generate_presigned_url.side_effect = lambda *a, **kw: f"https://s3/{kw['Params']['Key']}?e={kw['ExpiresIn']}"
+    return cliente
+
+
+def test_clave_s3():
+    assert clave_s3("s3://bucket/carpeta/a.jpg") == ("bucket", "carpeta/a.jpg")
+    assert clave_s3("/imagenes_subidas/a.jpg") is None
+    assert clave_s3(None) is None
+
+
+def test_url_estable_dentro_de_la_ventana():
+    """El mismo objeto tiene la misma URL durante la ventana y se firma una sola vez."""
+    reloj = Reloj(1000)
+    cliente = _cliente()
+    firmador = FirmadorUrls(cliente, "bucket", ventana=3600, reloj=reloj)
+
+    primera = firmador.url("a.jpg")
+    reloj.ahora = 3000
+    assert firmador.url("a.jpg") == primera
+    assert cliente.generate_presigned_url.call_count == 1
+
+    # La URL caduca al final de la ventana siguiente (2 * 3600 - 1000)
+    assert cliente.generate_presigned_url.call_args.kwargs["ExpiresIn"] == 6200
+
+    reloj.ahora = 3700
+    assert firmador.url("a.jpg") != primera
+    assert cliente.generate_presigned_url.call_count == 2
+
+
+def test_firmar_lote_y_url_imagen():
+    """El lote firma cada objeto una vez; las rutas locales no cambian."""
+    cliente = _cliente()
+    firmador = FirmadorUrls(cliente, "bucket", ventana=3600, reloj=Reloj(0))
+    urls = firmador.firmar_lote(["s3://bucket/a.jpg", "s3://bucket/a.jpg", "/imagenes_subidas/b.jpg", None])
+
+    assert list(urls) == ["s3://bucket/a.jpg"]
+    assert cliente.generate_presigned_url.call_count == 1
+    assert firmador.url_imagen("s3://bucket/a.jpg") == urls["s3://bucket/a.jpg"]
+    assert firmador.url_imagen("/imagenes_subidas/b.jpg") == "/imagenes_subidas/b.jpg"
+    assert firmador.estadisticas()["aciertos"] == 1
+
+
+def test_lru_acotada():
+    firmador = FirmadorUrls(_cliente(), "bucket", ventana=3600, maximo=2, reloj=Reloj(0))
+    for clave in ("a", "b", "c"):
+        firmador.url(clave)
+    assert firmador.estadisticas()["entradas"] == 2
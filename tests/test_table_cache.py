@@ -0,0 +1,55 @@
+from unittest.mock import MagicMock
+
+from table_cache import CacheTablas
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+
+def test_cache_aciertos_y_caducidad():
+    """Una entrada se sirve desde la caché hasta que caduca."""
+    reloj = Reloj()
+    cache = CacheTablas(maximo=10, ttl=60, reloj=reloj)
+    cargar = MagicMock(return_value={"filename": "t.xlsx", "headers": ["Número"]})
+
+    assert cache.obtener("t.xlsx", cargar)["headers"] == ["Número"]
+    cache.obtener("t.xlsx", cargar)
+    assert cargar.call_count == 1
+
+    reloj.ahora = 61
+    cache.obtener("t.xlsx", cargar)
+    assert cargar.call_count == 2
+    assert cache.estadisticas()["aciertos"] == 1
+    assert cache.estadisticas()["fallos"] == 2
+
+
+def test_cache_lru_e_invalidacion():
+    """Al llenarse se expulsa la menos usada; invalidar obliga a recargar."""
+    cache = CacheTablas(maximo=2, ttl=60, reloj=Reloj())
+    cache.obtener("a", lambda: {"n": "a"})
+    cache.obtener("b", lambda: {"n": "b"})
+    cache.obtener("a", lambda: {"n": "otra"})
+    cache.obtener("c", lambda: {"n": "c"})
+
+    assert cache.obtener("a", lambda: {"n": "nueva"}) == {"n": "a"}
+    assert cache.obtener("b", lambda: {"n": "b2"}) == {"n": "b2"}
+    assert cache.estadisticas()["expulsiones"] == 2
+
+    cache.invalidar("a")
+    assert cache.obtener("a", lambda: {"n": "a2"}) == {"n": "a2"}
+
+
+def test_cache_no_guarda_inexistentes_ni_comparte_valores():
+    """Los None no se guardan y las copias devueltas no modifican la caché."""
+    cache = CacheTablas(maximo=2, ttl=60, reloj=Reloj())
+    assert cache.obtener("x", lambda: None) is None
+    assert cache.estadisticas()["entradas"] == 0
+
+    valor = cache.obtener("t", lambda: {"headers": ["Número"]})
+    valor["headers"].append("Otro")
+    assert cache.obtener("t", lambda: None) == {"headers": ["Número"]}
@@ -0,0 +1,88 @@
+import os
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+
+from upload_spool import SpoolSubidas, procesar_spool, es_pendiente, ESPERA_REGISTRO
+
+
+class Reloj:
+    def __init__(self, ahora):
+        self.ahora = ahora
+
+    def __call__(self):
+        return self.ahora
+
+
+def _spool(tmp_path, **kwargs):
+    reloj = Reloj(1000)
+    return SpoolSubidas(str(tmp_path), reloj=reloj, **kwargs), reloj
+
+
+def test_encolar_y_subir(tmp_path):
+    """La imagen se sube desde el spool y la marca del registro se sustituye por la ruta de S3."""
+    spool, _ = _spool(tmp_path)
+    registro_id = ObjectId()
+    marca = spool.encolar(b"datos", "a.jpg", "t.xlsx", registro_id, 1)
+    assert es_pendiente(marca) and not es_pendiente("s3://b/a.jpg")
+
+    registros, contadores = MagicMock(), MagicMock()
+    registros.count_documents.return_value = 1
+    registros.update_one.return_value.matched_count = 1
+    subir = MagicMock(return_value=("s3://b/a.jpg", {"thumb": "s3://b/t.jpg"}, {"sha256": "x", "tamano": 5}))
+
+    assert procesar_spool(spool, registros, contadores, subir)["subidas"] == 1
+    subir.assert_called_once_with(b"datos", "a.jpg")
+    filtro, cambios = registros.update_one.call_args[0]
+    assert filtro == {"_id": registro_id, "Imagenes.1": marca}
+    assert cambios == {"$set": {
+        "Imagenes.1": "s3://b/a.jpg",
+        "ImagenesDerivadas.1": {"thumb": "s3://b/t.jpg"},
+        "ImagenesIntegridad.1": {"sha256": "x", "tamano": 5},
+    }}
+    contadores.update_one.assert_called_once()
+    assert spool.estadisticas() == {"pendientes": 0, "fallidas": 0}
+
+
+def test_fallo_de_subida_se_reintenta_con_espera(tmp_path):
+    """Tras un fallo la entrada espera antes del siguiente intento y acaba en "fallidas"."""
+    spool, reloj = _spool(tmp_path, maximo_intentos=2)
+    spool.encolar(b"datos", "a.jpg", "t.xlsx", ObjectId(), 0)
+    registros = MagicMock()
+    registros.count_documents.return_value = 1
+    subir = MagicMock(return_value=(None, None, None))
+
+    assert procesar_spool(spool, registros, MagicMock(), subir)["reintentos"] == 1
+    assert spool.pendientes() == []
+    reloj.ahora += 2
+    assert spool.pendientes() == ["a.jpg"]
+
+    procesar_spool(spool, registros, MagicMock(), subir)
+    assert spool.estadisticas() == {"pendientes": 0, "fallidas": 1}
+    registros.update_one.assert_not_called()
+
+
+def test_registro_sin_marca(tmp_path):
+    """Si el registro aún no tiene la marca se espera; pasado el margen se descarta sin subir."""
+    spool, reloj = _spool(tmp_path)
+    spool.encolar(b"datos", "a.jpg", "t.xlsx", ObjectId(), 0)
+    registros = MagicMock()
+    registros.count_documents.return_value = 0
+    subir = MagicMock()
+
+    procesar_spool(spool, registros, MagicMock(), subir)
+    assert spool.estadisticas()["pendientes"] == 1
+    reloj.ahora += ESPERA_REGISTRO + 10
+    assert procesar_spool(spool, registros, MagicMock(), subir)["descartadas"] == 1
+    subir.assert_not_called()
+    assert os.listdir(spool.directorio) == ["fallidas"]
+
+
+def test_reclamar_una_sola_vez(tmp_path):
+    """Solo un proceso puede reclamar cada entrada."""
+    spool, _ = _spool(tmp_path)
+    spool.encolar(b"datos", "a.jpg", "t.xlsx", ObjectId(), 0)
+    meta, datos = spool.reclamar("a.jpg")
+    assert datos == b"datos" and meta["indice"] == 0
+    assert spool.reclamar("a.jpg") is None
+    assert spool.pendientes() == []
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Subida diferida de imágenes a S3 mediante una cola local en disco (spool).
+
+Con S3 lento, subir las imágenes dentro de la petición (con reintentos y
+esperas) puede retener un worker de gunicorn durante muchos segundos. En modo
+diferido el registro se guarda al momento con sus imágenes marcadas como
+pendientes ("pendiente://<clave>") y los bytes se escriben en el spool:
+
+    <directorio>/<clave>.bin    contenido de la imagen
+    <directorio>/<clave>.json   tabla, _id del registro, posición y reintentos
+
+Ambos ficheros se escriben de forma atómica (fichero temporal + os.replace) y
+el .json se escribe el último, de modo que una entrada con .json está siempre
+completa. Un hilo de fondo recorre el spool, sube cada imagen y sustituye la
+marca de pendiente del registro por la ruta "s3://" (y sus derivados). Varios
+procesos pueden compartir el spool: cada entrada se reclama renombrando su
+.json, que es una operación atómica.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from bson import ObjectId
+
+from catalog_records import CAMPO_DERIVADOS, CAMPO_INTEGRIDAD, registrar_cambio
+
+PREFIJO_PENDIENTE = "pendiente://"
+
+DIRECTORIO_SPOOL = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool_subidas")
+)
+# Segundos entre pasadas del hilo de fondo (también se despierta al encolar)
+INTERVALO_SPOOL = float(os.getenv("UPLOAD_SPOOL_INTERVAL", "5"))
+# Intentos de subida antes de apartar la entrada en "fallidas"
+MAXIMO_INTENTOS = int(os.getenv("UPLOAD_SPOOL_MAX_ATTEMPTS", "10"))
+# Segundos que se espera a que el registro tenga la marca de pendiente
+# (la imagen se encola antes de insertar o actualizar el registro)
+ESPERA_REGISTRO = int(os.getenv("UPLOAD_SPOOL_RECORD_GRACE", "300"))
+# Una entrada reclamada durante más tiempo se da por abandonada (proceso caído)
+RECLAMO_CADUCADO = int(os.getenv("UPLOAD_SPOOL_CLAIM_TIMEOUT", "900"))
+
+SUFIJO_RECLAMADA = ".procesando"
+
+logger = logging.getLogger(__name__)
+
+
+def ruta_pendiente(clave):
+    """Marca que se guarda en "Imagenes" mientras la imagen está en el spool"""
+    return f"{PREFIJO_PENDIENTE}{clave}"
+
+
+def es_pendiente(ruta):
+    """Indica si una ruta de imagen es una subida pendiente"""
+    return isinstance(ruta, str) and ruta.startswith(PREFIJO_PENDIENTE)
+
+
+def _escribir_atomico(ruta, datos):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(datos)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+class SpoolSubidas:
+    """Cola de imágenes pendientes de subir a S3, guardada en disco.
+
+    Args:
+        directorio: Carpeta del spool (se crea si no existe)
+        maximo_intentos: Intentos de subida antes de apartar una entrada
+        reloj: Función que devuelve el instante actual en segundos (para tests)
+    """
+
+    def __init__(self, directorio=DIRECTORIO_SPOOL, maximo_intentos=MAXIMO_INTENTOS, reloj=time.time):
+        self.directorio = directorio
+        self.fallidas = os.path.join(directorio, "fallidas")
+        self.maximo_intentos = maximo_intentos
+        self._reloj = reloj
+        self.aviso = threading.Event()
+        os.makedirs(self.fallidas, exist_ok=True)
+
+    def _ruta(self, clave, extension):
+        return os.path.join(self.directorio, f"{clave}{extension}")
+
+    def encolar(self, datos, clave, tabla, registro_id, indice):
+        """Guarda una imagen en el spool.
+
+        Args:
+            datos: Contenido de la imagen
+            clave: Clave del objeto en S3 (nombre único del archivo)
+            tabla: Tabla del registro
+            registro_id: _id del registro al que pertenece la imagen
+            indice: Posición de la imagen en "Imagenes"
+
+        Returns:
+            str: Marca de pendiente a guardar en el registro
+        """
+        _escribir_atomico(self._ruta(clave, ".bin"), datos)
+        meta = {"tabla": tabla, "registro": str(registro_id), "indice": indice,
+                "creado": self._reloj(), "intentos": 0, "siguiente": 0}
+        _escribir_atomico(self._ruta(clave, ".json"), json.dumps(meta).encode("utf-8"))
+        self.aviso.set()
+        return ruta_pendiente(clave)
+
+    def pendientes(self):
+        """Claves de las entradas listas para procesar (sin reclamar y sin espera pendiente).
+
+        También devuelve al spool las entradas reclamadas hace más de RECLAMO_CADUCADO segundos.
+        """
+        ahora = self._reloj()
+        claves = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith(".json" + SUFIJO_RECLAMADA):
+                try:
+                    if ahora - os.path.getmtime(ruta) > RECLAMO_CADUCADO:
+                        os.replace(ruta, ruta[:-len(SUFIJO_RECLAMADA)])
+                except FileNotFoundError:
+                    pass
+                continue
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if meta.get("siguiente", 0) <= ahora:
+                claves.append(nombre[:-len(".json")])
+        return claves
+
+    def reclamar(self, clave):
+        """Reclama una entrada para procesarla.
+
+        Returns:
+            tuple: (metadatos, bytes de la imagen), o None si otro proceso la ha reclamado antes
+        """
+        reclamada = self._ruta(clave, ".json" + SUFIJO_RECLAMADA)
+        try:
+            os.rename(self._ruta(clave, ".json"), reclamada)
+        except FileNotFoundError:
+            return None
+        # Marca el instante del reclamo (para detectar reclamos abandonados)
+        os.utime(reclamada)
+        with open(reclamada, encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self._ruta(clave, ".bin"), "rb") as f:
+            return meta, f.read()
+
+    def completar(self, clave):
+        """Elimina del spool una entrada reclamada"""
+        for extension in (".bin", ".json" + SUFIJO_RECLAMADA):
+            try:
+                os.remove(self._ruta(clave, extension))
+            except FileNotFoundError:
+                pass
+
+    def liberar(self, clave, meta, espera):
+        """Devuelve al spool una entrada reclamada para procesarla dentro de `espera` segundos"""
+        meta = dict(meta, siguiente=self._reloj() + espera)
+        reclamada = self._ruta(clave, ".json" + SUFIJO_RECLAMADA)
+        _escribir_atomico(reclamada, json.dumps(meta).encode("utf-8"))
+        os.replace(reclamada, self._ruta(clave, ".json"))
+
+    def reintentar(self, clave, meta):
+        """Cuenta un intento fallido: la entrada vuelve al spool con espera exponencial,
+        o se aparta en "fallidas" si ha agotado los intentos.
+
+        Returns:
+            bool: True si se volverá a intentar
+        """
+        meta = dict(meta, intentos=meta.get("intentos", 0) + 1)
+        if meta["intentos"] >= self.maximo_intentos:
+            os.replace(self._ruta(clave, ".bin"), os.path.join(self.fallidas, f"{clave}.bin"))
+            _escribir_atomico(os.path.join(self.fallidas, f"{clave}.json"), json.dumps(meta).encode("utf-8"))
+            self.completar(clave)
+            return False
+        self.liberar(clave, meta, min(2 ** meta["intentos"], 3600))
+        return True
+
+    def antiguedad(self, meta):
+        """Segundos desde que se encoló una entrada"""
+        return self._reloj() - meta["creado"]
+
+    def estadisticas(self):
+        """Número de entradas en el spool y apartadas como fallidas"""
+        pendientes = sum(1 for nombre in os.listdir(self.directorio) if nombre.endswith(".bin"))
+        fallidas = sum(1 for nombre in os.listdir(self.fallidas) if nombre.endswith(".bin"))
+        return {"pendientes": pendientes, "fallidas": fallidas}
+
+
+def procesar_spool(spool, registros, contadores, subir, eliminar=None):
+    """Sube las imágenes del spool y actualiza los registros.
+
+    La marca de pendiente solo se sustituye si el registro la sigue teniendo; si
+    el usuario ha quitado o cambiado la imagen entretanto, el objeto subido se
+    elimina (con `eliminar`) y la entrada se descarta.
+
+    Args:
+        spool: SpoolSubidas
+        registros: Colección del catálogo
+        contadores: Colección de contadores (para la versión de la tabla)
+        subir: Función (bytes, clave) -> (ruta "s3://", derivados, suma y tamaño), con ruta None si falla
+        eliminar: Función que elimina una ruta "s3://" ya subida (opcional)
+
+    Returns:
+        dict: Número de entradas subidas, descartadas y que se reintentarán
+    """
+    resumen = {"subidas": 0, "descartadas": 0, "reintentos": 0}
+    for clave in spool.pendientes():
+        reclamada = spool.reclamar(clave)
+        if reclamada is None:
+            continue
+        meta, datos = reclamada
+        marca = ruta_pendiente(clave)
+        campo_imagen = f"Imagenes.{meta['indice']}"
+        filtro = {"_id": ObjectId(meta["registro"]), campo_imagen: marca}
+
+        if not registros.count_documents(filtro, limit=1):
+            if spool.antiguedad(meta) < ESPERA_REGISTRO:
+                # El registro aún no se ha guardado con la marca
+                spool.liberar(clave, meta, INTERVALO_SPOOL)
+            else:
+                spool.completar(clave)
+                resumen["descartadas"] += 1
+            continue
+
+        try:
+            ruta, derivados, integridad = subir(datos, clave)
+        except Exception as e:
+            logger.warning(f"Error al subir {clave} desde el spool: {e}")
+            ruta = derivados = integridad = None
+        if not ruta:
+            resumen["reintentos"] += spool.reintentar(clave, meta)
+            continue
+
+        resultado = registros.update_one(filtro, {"$set": {
+            campo_imagen: ruta,
+            f"{CAMPO_DERIVADOS}.{meta['indice']}": derivados,
+            f"{CAMPO_INTEGRIDAD}.{meta['indice']}": integridad,
+        }})
+        if resultado.matched_count:
+            registrar_cambio(contadores, meta["tabla"])
+            resumen["subidas"] += 1
+        else:
+            if eliminar:
+                eliminar(ruta)
+            resumen["descartadas"] += 1
+        spool.completar(clave)
+    return resumen
+
+
+def iniciar_trabajador(spool, procesar, intervalo=INTERVALO_SPOOL, nombre="spool-subidas"):
+    """Arranca el hilo de fondo que vacía el spool.
+
+    Procesa el spool cada `intervalo` segundos o en cuanto se encola una imagen.
+    Sirve para cualquier cola con un threading.Event `aviso` que se activa al encolar
+    (p. ej. la cola de borrados de s3_deletion_queue.py).
+
+    Args:
+        spool: SpoolSubidas (o cola equivalente)
+        procesar: Función sin argumentos que procesa el spool (ver `procesar_spool`)
+        intervalo: Segundos máximos entre pasadas
+        nombre: Nombre del hilo
+
+    Returns:
+        threading.Thread: Hilo (daemon) ya arrancado
+    """
+    def bucle():
+        while True:
+            spool.aviso.wait(intervalo)
+            spool.aviso.clear()
+            try:
+                procesar()
+            except Exception as e:
+                logger.error(f"Error en el hilo {nombre}: {e}")
+
+    hilo = threading.Thread(target=bucle, name=nombre, daemon=True)
+    hilo.start()
+    return hilo